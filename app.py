@@ -4,10 +4,16 @@ import os
 import aws_cdk as cdk
 
 from pipeline.code_whisperer_professional_edition_analysis_stack import CodeWhispererProfessionalEditionAnalysisStack
+from pipeline.code_whisperer_spoke_stack import CodeWhispererSpokeStack
 from cdk_nag import AwsSolutionsChecks
 
 app = cdk.App()
-CodeWhispererProfessionalEditionAnalysisStack(app, "CodeWhispererProfessionalEditionAnalysisStack")
+
+#Member accounts deployed as spokes only forward their events to the hub, which runs the analysis stack for every account
+if str(app.node.try_get_context("deployment_role")).lower() == "spoke":
+    CodeWhispererSpokeStack(app, "CodeWhispererSpokeStack")
+else:
+    CodeWhispererProfessionalEditionAnalysisStack(app, "CodeWhispererProfessionalEditionAnalysisStack")
 
 cdk.Aspects.of(app).add(AwsSolutionsChecks(verbose=True))
 app.synth()
\ No newline at end of file
@@ -0,0 +1,91 @@
+#Measure the cold start of the transformation function, reporting the time to import it and to process the first batch in a new process
+#Usage: python benchmarks/cold_start.py [--runs 10] [--users 200] [--groups 5] [--latency 0.02]
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+#Import and run the function once in this process, printing the timings as JSON. Each run uses a new process so nothing has been imported already
+def run_child(arguments):
+
+    os.environ['AWS_DEFAULT_REGION'] = os.environ.get('AWS_DEFAULT_REGION', 'us-east-1')
+
+    import transformer
+
+    started_at = time.perf_counter()
+    import index
+    import_time = time.perf_counter() - started_at
+
+    #Record which libraries the import loaded before the benchmark modules load anything else
+    loaded_boto3 = 'boto3' in sys.modules
+
+    from events import create_batches, generate_events
+    from identitystore_stub import StubIdentityStoreClient, create_directory
+
+    users, groups, memberships = create_directory(arguments.users, arguments.groups)
+    index.client = StubIdentityStoreClient(users, groups, memberships, arguments.latency)
+
+    batch = next(create_batches(generate_events(arguments.events, list(users))))
+
+    started_at = time.perf_counter()
+    index.lambda_handler(batch, transformer.LambdaContext())
+    first_batch_time = time.perf_counter() - started_at
+
+    print(json.dumps({
+        'import_time': import_time,
+        'first_batch_time': first_batch_time,
+        'records': len(batch['records']),
+        'loaded_boto3': loaded_boto3
+    }))
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark the cold start of the Firehose transformation function')
+    parser.add_argument('--runs', type=int, default=10, help='Number of new processes to start for each configuration')
+    parser.add_argument('--events', type=int, default=2000, help='Number of events in the first batch')
+    parser.add_argument('--users', type=int, default=200, help='Number of distinct developers')
+    parser.add_argument('--groups', type=int, default=5, help='Number of SSO groups')
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds added to every stubbed API call')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.child:
+        run_child(arguments)
+        return
+
+    from identitystore_stub import create_directory
+
+    users, groups, memberships = create_directory(arguments.users, arguments.groups)
+
+    configurations = {
+        'no sso': '',
+        'sso': ','.join(groups)
+    }
+
+    for name, group_ids in configurations.items():
+        environment = dict(os.environ, SSO_GROUP_IDS=group_ids)
+        command = [sys.executable, os.path.abspath(__file__), '--child'] + [
+            '--{}={}'.format(option, getattr(arguments, option)) for option in ['events', 'users', 'groups', 'latency']
+        ]
+
+        results = [
+            json.loads(subprocess.run(command, env=environment, check=True, capture_output=True, text=True).stdout)
+            for run in range(arguments.runs)
+        ]
+
+        print('{}:'.format(name))
+        print('    import:        {:.1f}ms (median), {:.1f}ms (max)'.format(
+            statistics.median(result['import_time'] for result in results) * 1000,
+            max(result['import_time'] for result in results) * 1000
+        ))
+        print('    first batch:   {:.1f}ms (median) for {} records'.format(
+            statistics.median(result['first_batch_time'] for result in results) * 1000,
+            results[0]['records']
+        ))
+        print('    loads boto3:   {}'.format(results[0]['loaded_boto3']))
+
+if __name__ == '__main__':
+    main()
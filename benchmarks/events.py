@@ -0,0 +1,167 @@
+import base64
+import json
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+
+IDENTITY_STORE_ID = 'd-0000000000'
+ACCOUNT_ID = '111122223333'
+
+EVENT_NAMES = ['GenerateCompletions', 'GenerateRecommendations', 'ListCodeAnalysisFindings']
+PROGRAMMING_LANGUAGES = ['python', 'java', 'javascript', 'typescript', 'csharp', 'go', 'rust', 'sql']
+
+#Firehose invokes the processor with up to 6MB of records, the default buffer for a Lambda processor is 3MB
+DEFAULT_BATCH_BYTES = 3 * 1024 * 1024
+
+#Create a CodeWhisperer data event in the format EventBridge delivers it to Firehose
+def create_event(event_name, user_id=None, event_time=None, programming_language=None, next_token=None, account_id=ACCOUNT_ID, identity_store_id=IDENTITY_STORE_ID):
+
+    if event_time is None:
+        event_time = datetime.now(timezone.utc)
+
+    event_time = event_time.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    user_identity = {
+        'type': 'AssumedRole',
+        'principalId': 'AROAEXAMPLE:{}'.format(user_id or 'lambda'),
+        'arn': 'arn:aws:sts::{}:assumed-role/AWSReservedSSO_CodeWhisperer/{}'.format(account_id, user_id or 'lambda'),
+        'accountId': account_id
+    }
+
+    #Calls made by an SSO user include the identity store details, calls from service integrations do not
+    if user_id is not None:
+        user_identity['onBehalfOf'] = {
+            'userId': user_id,
+            'identityStoreArn': 'arn:aws:identitystore::{}:identitystore/{}'.format(account_id, identity_store_id)
+        }
+
+    request_parameters = {}
+
+    if event_name == 'ListCodeAnalysisFindings':
+        request_parameters['jobId'] = str(uuid.uuid4())
+        request_parameters['codeAnalysisFindingsSchema'] = 'codeanalysis/findings/1.0'
+    else:
+        request_parameters['maxResults'] = 1
+
+        if programming_language is not None:
+            request_parameters['fileContext'] = {
+                'leftFileContent': 'HIDDEN_DUE_TO_SECURITY_REASONS',
+                'rightFileContent': 'HIDDEN_DUE_TO_SECURITY_REASONS',
+                'filename': 'HIDDEN_DUE_TO_SECURITY_REASONS',
+                'programmingLanguage': {
+                    'languageName': programming_language
+                }
+            }
+
+    if next_token is not None:
+        request_parameters['nextToken'] = next_token
+
+    return {
+        'version': '0',
+        'id': str(uuid.uuid4()),
+        'detail-type': 'AWS API Call via CloudTrail',
+        'source': 'aws.codewhisperer',
+        'account': account_id,
+        'time': event_time,
+        'region': 'us-east-1',
+        'resources': [],
+        'detail': {
+            'eventVersion': '1.09',
+            'userIdentity': user_identity,
+            'eventTime': event_time,
+            'eventSource': 'codewhisperer.amazonaws.com',
+            'eventName': event_name,
+            'awsRegion': 'us-east-1',
+            'sourceIPAddress': '192.0.2.1',
+            'userAgent': 'AWS-Toolkit-For-VSCode/1.80.0',
+            'requestParameters': request_parameters,
+            'responseElements': None,
+            'requestID': str(uuid.uuid4()),
+            'eventID': str(uuid.uuid4()),
+            'readOnly': False,
+            'resources': [{
+                'accountId': account_id,
+                'type': 'AWS::CodeWhisperer::Profile',
+                'ARN': 'arn:aws:codewhisperer:us-east-1:{}:profile/EXAMPLE'.format(account_id)
+            }],
+            'eventType': 'AwsApiCall',
+            'managementEvent': False,
+            'recipientAccountId': account_id,
+            'eventCategory': 'Data'
+        }
+    }
+
+#Generate a stream of events for the given users. A share of the events have a nextToken or no SSO user identity, so they are dropped by the transformer
+def generate_events(count, user_ids, start_time=None, duration=timedelta(hours=1), paged_share=0.05, service_share=0.05, seed=0):
+
+    generator = random.Random(seed)
+
+    if start_time is None:
+        start_time = datetime.now(timezone.utc) - duration
+
+    for i in range(count):
+        event_name = generator.choices(EVENT_NAMES, weights=[70, 25, 5])[0]
+        event_time = start_time + duration * (i / max(count, 1))
+
+        user_id = None if generator.random() < service_share else generator.choice(user_ids)
+
+        #A paged request has a nextToken, the final page has an empty one
+        next_token = None
+
+        if generator.random() < paged_share:
+            next_token = generator.choice(['', 'eyJuZXh0IjoiMiJ9'])
+
+        programming_language = None
+
+        if event_name != 'ListCodeAnalysisFindings' and generator.random() < 0.9:
+            programming_language = generator.choice(PROGRAMMING_LANGUAGES)
+
+        yield create_event(event_name, user_id, event_time, programming_language, next_token)
+
+#Pack the events into Firehose transformation invocations of up to batch_bytes of record data each. Record IDs are unique across the batches, as they are in Firehose
+def create_batches(events, batch_bytes=DEFAULT_BATCH_BYTES):
+
+    records = []
+    size = 0
+
+    for position, event in enumerate(events):
+        record = create_record(event, position)
+
+        if len(records) > 0 and size + len(record['data']) > batch_bytes:
+            yield create_batch(records)
+            records = []
+            size = 0
+
+        records.append(record)
+        size += len(record['data'])
+
+    if len(records) > 0:
+        yield create_batch(records)
+
+#Create the Firehose record carrying an event
+def create_record(event, record_id):
+    return {
+        'recordId': str(record_id),
+        'approximateArrivalTimestamp': 0,
+        'data': base64.b64encode(json.dumps(event).encode('utf-8')).decode('utf-8')
+    }
+
+#Create an invocation with one record for each event
+def create_event_batch(events):
+    return create_batch([create_record(event, position) for position, event in enumerate(events)])
+
+#Create an invocation with one code suggestion event for each user, so every uncached user has to be looked up
+def create_user_batch(user_ids, programming_language=None):
+    return create_event_batch([create_event('GenerateCompletions', user_id, programming_language=programming_language) for user_id in user_ids])
+
+#Return the event written by the transformer to a record
+def read_record(record):
+    return json.loads(base64.b64decode(record['data']))
+
+def create_batch(records):
+    return {
+        'invocationId': str(uuid.uuid4()),
+        'deliveryStreamArn': 'arn:aws:firehose:us-east-1:{}:deliverystream/benchmark'.format(ACCOUNT_ID),
+        'region': 'us-east-1',
+        'records': records
+    }
@@ -0,0 +1,50 @@
+#Compare resolving the groups of every user with IsMemberInGroups calls against sweeping the group directory once and using its index
+#Usage: python benchmarks/group_directory.py [--users 5000] [--groups 20] [--latency 0.005]
+import argparse
+import time
+
+from events import IDENTITY_STORE_ID
+from identitystore_stub import StubIdentityStoreClient, create_directory
+from transformer import load_transformer
+
+def run(name, environment, users, groups, memberships, latency):
+
+    index = load_transformer(environment)
+    index.client = StubIdentityStoreClient(users, groups, memberships, latency)
+
+    pending_users = [(IDENTITY_STORE_ID, user_id) for user_id in users]
+
+    start = time.perf_counter()
+
+    #Mirror the handler, which sweeps the directory before resolving the users
+    if index.group_directory is not None:
+        index.group_directory.get(IDENTITY_STORE_ID)
+
+    index.resolve_sso_details(pending_users, {})
+    elapsed = time.perf_counter() - start
+
+    print('{:<12} {:>8.2f}s {:>10.0f} users/s   {}'.format(name, elapsed, len(users) / elapsed, dict(index.client.calls)))
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Compare per-user group lookups against the group directory')
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--groups', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.005, help='Seconds added to every stubbed API call')
+    parser.add_argument('--concurrency', type=int, default=8)
+    arguments = parser.parse_args()
+
+    users, groups, memberships = create_directory(arguments.users, arguments.groups)
+
+    environment = {
+        'SSO_GROUP_IDS': ','.join(groups),
+        'SSO_LOOKUP_CONCURRENCY': str(arguments.concurrency)
+    }
+
+    print('{} users in {} groups, {}s latency per call, {} workers'.format(arguments.users, arguments.groups, arguments.latency, arguments.concurrency))
+
+    run('per-user', dict(environment, SSO_GROUP_DIRECTORY='false'), users, groups, memberships, arguments.latency)
+    run('directory', dict(environment, SSO_GROUP_DIRECTORY='true'), users, groups, memberships, arguments.latency)
+
+if __name__ == '__main__':
+    main()
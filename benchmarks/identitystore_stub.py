@@ -0,0 +1,88 @@
+import random
+import threading
+import time
+from collections import Counter
+
+#This class stands in for the boto3 identitystore client. Each call sleeps for the configured latency and is counted per operation
+class StubIdentityStoreClient:
+
+    def __init__(self, users, groups, memberships, latency=0.0):
+        #users maps user_id to user_name, groups maps group_id to display name and memberships maps group_id to a list of user_ids
+        self.users = users
+        self.groups = groups
+        self.memberships = memberships
+        self.user_groups = {}
+
+        for group_id, user_ids in memberships.items():
+            for user_id in user_ids:
+                self.user_groups.setdefault(user_id, set()).add(group_id)
+
+        self.latency = latency
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def _call(self, operation):
+        with self.lock:
+            self.calls[operation] += 1
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def describe_user(self, IdentityStoreId, UserId):
+        self._call('DescribeUser')
+
+        return {'UserId': UserId, 'UserName': self.users[UserId]}
+
+    def describe_group(self, IdentityStoreId, GroupId):
+        self._call('DescribeGroup')
+
+        return {'GroupId': GroupId, 'DisplayName': self.groups[GroupId]}
+
+    def is_member_in_groups(self, IdentityStoreId, MemberId, GroupIds):
+        self._call('IsMemberInGroups')
+
+        if len(GroupIds) > 100:
+            raise ValueError('IsMemberInGroups accepts at most 100 group IDs')
+
+        member_groups = self.user_groups.get(MemberId['UserId'], set())
+
+        return {
+            'Results': [
+                {'GroupId': group_id, 'MemberId': MemberId, 'MembershipExists': group_id in member_groups}
+                for group_id in GroupIds
+            ]
+        }
+
+    def list_group_memberships(self, IdentityStoreId, GroupId, MaxResults=100, NextToken=None):
+        self._call('ListGroupMemberships')
+
+        start = int(NextToken) if NextToken else 0
+        user_ids = self.memberships.get(GroupId, [])
+        page = user_ids[start:start + MaxResults]
+
+        result = {
+            'GroupMemberships': [
+                {'IdentityStoreId': IdentityStoreId, 'GroupId': GroupId, 'MemberId': {'UserId': user_id}}
+                for user_id in page
+            ]
+        }
+
+        if start + MaxResults < len(user_ids):
+            result['NextToken'] = str(start + MaxResults)
+
+        return result
+
+#Create a directory of users spread across groups. Each user is placed in one group, and a share of them are in no group at all
+def create_directory(user_count, group_count, ungrouped_share=0.1, seed=0):
+
+    generator = random.Random(seed)
+
+    users = {'user-{:06d}'.format(i): 'developer{}'.format(i) for i in range(user_count)}
+    groups = {'group-{:04d}'.format(i): 'Team {}'.format(i) for i in range(group_count)}
+    memberships = {group_id: [] for group_id in groups}
+
+    for user_id in users:
+        if generator.random() >= ungrouped_share:
+            memberships[generator.choice(list(groups))].append(user_id)
+
+    return users, groups, memberships
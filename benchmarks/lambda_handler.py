@@ -0,0 +1,80 @@
+#Run lambda_handler against synthetic Firehose batches and a stubbed identitystore client, reporting throughput, batch latency, API calls and memory
+#Usage: python benchmarks/lambda_handler.py [--events 50000] [--users 2000] [--groups 20] [--latency 0.02] [--no-sso]
+import argparse
+import copy
+import resource
+import statistics
+import time
+
+from events import create_batches, generate_events
+from identitystore_stub import StubIdentityStoreClient, create_directory
+from transformer import LambdaContext, load_transformer
+
+#Return the value at the given percentile of a list of samples
+def percentile(samples, percent):
+
+    ordered = sorted(samples)
+
+    return ordered[min(int(len(ordered) * percent / 100), len(ordered) - 1)]
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark the Firehose transformation function')
+    parser.add_argument('--events', type=int, default=50000, help='Number of events to generate')
+    parser.add_argument('--users', type=int, default=2000, help='Number of distinct developers')
+    parser.add_argument('--groups', type=int, default=20, help='Number of SSO groups')
+    parser.add_argument('--batch-mb', type=float, default=3, help='Size of each Firehose batch in MB')
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds added to every stubbed API call')
+    parser.add_argument('--concurrency', type=int, default=8, help='Value of SSO_LOOKUP_CONCURRENCY')
+    parser.add_argument('--group-directory', action='store_true', help='Enable the pre-warmed group directory')
+    parser.add_argument('--no-sso', action='store_true', help='Run without SSO enrichment')
+    arguments = parser.parse_args()
+
+    users, groups, memberships = create_directory(arguments.users, arguments.groups)
+
+    environment = {
+        'SSO_GROUP_IDS': '' if arguments.no_sso else ','.join(groups),
+        'SSO_LOOKUP_CONCURRENCY': str(arguments.concurrency),
+        'SSO_GROUP_DIRECTORY': str(arguments.group_directory).lower()
+    }
+
+    batches = list(create_batches(generate_events(arguments.events, list(users)), int(arguments.batch_mb * 1024 * 1024)))
+    input_bytes = sum(len(record['data']) for batch in batches for record in batch['records'])
+
+    index = load_transformer(environment)
+    client = StubIdentityStoreClient(users, groups, memberships, arguments.latency)
+    index.client = client
+
+    latencies = []
+    api_calls = []
+    results = {'Ok': 0, 'Dropped': 0}
+
+    for batch in batches:
+        calls_before = sum(client.calls.values())
+
+        #The handler updates the records in place, so give it a copy
+        batch = copy.deepcopy(batch)
+
+        batch_start = time.perf_counter()
+        output = index.lambda_handler(batch, LambdaContext())
+        latencies.append(time.perf_counter() - batch_start)
+
+        api_calls.append(sum(client.calls.values()) - calls_before)
+
+        for record in output['records']:
+            results[record['result']] += 1
+
+    elapsed = sum(latencies)
+
+    #On Linux the peak resident set size is reported in KB
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print('events:          {} in {} batches ({:.1f} MB)'.format(arguments.events, len(batches), input_bytes / 1024 / 1024))
+    print('results:         {Ok} Ok, {Dropped} Dropped'.format(**results))
+    print('throughput:      {:.0f} records/s'.format(arguments.events / elapsed))
+    print('batch latency:   p50 {:.3f}s  p99 {:.3f}s  max {:.3f}s'.format(percentile(latencies, 50), percentile(latencies, 99), max(latencies)))
+    print('api calls:       {:.1f} per batch (mean), {} on the first batch, {}'.format(statistics.mean(api_calls), api_calls[0], dict(client.calls)))
+    print('peak rss:        {:.0f} MB'.format(peak_rss))
+
+if __name__ == '__main__':
+    main()
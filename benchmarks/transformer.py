@@ -0,0 +1,51 @@
+import importlib
+import os
+import sys
+import time
+
+#The transformation function is packaged from its own directory, so its modules import each other by name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pipeline', 'firehose_transformation'))
+
+#The environment variables read by the transformation function, these are cleared before each load so settings from an earlier load are not carried over
+TRANSFORMER_VARIABLES = [
+    'SSO_GROUP_IDS',
+    'SSO_GROUP_IDS_PARAMETER',
+    'SSO_REGION',
+    'SSO_LOOKUP_CONCURRENCY',
+    'SSO_LOOKUP_SAFETY_MARGIN',
+    'SSO_RECORD_ALL_GROUPS',
+    'SSO_GROUP_DIRECTORY',
+    'SSO_GROUP_DIRECTORY_REFRESH_INTERVAL',
+    'SSO_GROUP_DIRECTORY_SWEEP_TIMEOUT',
+    'IDENTITY_CACHE_TTL',
+    'IDENTITY_CACHE_NEGATIVE_TTL',
+    'IDENTITY_CACHE_MAX_SIZE',
+    'IDENTITY_CACHE_FILE',
+    'IDENTITY_CACHE_TABLE',
+    'OUTPUT_FORMAT',
+    'DYNAMIC_PARTITIONING',
+    'DEDUPLICATION_WINDOW',
+    'METRICS_NAMESPACE'
+]
+
+#Load a fresh copy of the transformation module using the given environment, so its caches start empty as they would in a new container
+def load_transformer(environment):
+
+    for key in TRANSFORMER_VARIABLES:
+        os.environ.pop(key, None)
+
+    os.environ.update(environment)
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ.setdefault('SSO_GROUP_IDS', '')
+
+    import index
+    return importlib.reload(index)
+
+#This class stands in for the Lambda context object, counting down from the function timeout
+class LambdaContext:
+
+    def __init__(self, timeout=60):
+        self.deadline = time.time() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return max(int((self.deadline - time.time()) * 1000), 0)
@@ -0,0 +1,224 @@
+from constructs import Construct
+from aws_cdk import (
+    aws_athena as athena,
+    aws_glue as glue,
+    aws_s3 as s3
+)
+from tools.query import WORKGROUP_NAME
+
+#The folder in the events bucket the results of queries in the workgroup are written to
+RESULTS_PREFIX = "AthenaResults/Queries/"
+
+#The largest number of bytes a single query in the workgroup may scan before it is cancelled
+DEFAULT_BYTES_SCANNED_CUTOFF = 10 * 1024 ** 3
+
+#The example reports, saved as named queries. Each takes the year and month as execution parameters, so every report reads only the partitions of one month
+REPORT_QUERIES = {
+    "monthly_unique_users": (
+        "How many unique users used CodeWhisperer in a month",
+        '''SELECT
+    COUNT(DISTINCT "user_id") as "total_unique_users"
+FROM
+    "{database}"."{table}"
+WHERE
+    year = ?
+AND
+    month = ?;'''
+    ),
+    "monthly_users": (
+        "Who has used CodeWhisperer in a month",
+        '''SELECT
+    DISTINCT "user_name"
+FROM
+    "{database}"."{table}"
+WHERE
+    year = ?
+AND
+    month = ?
+ORDER BY
+    "user_name";'''
+    ),
+    "monthly_languages": (
+        "The most popular programming languages in a month",
+        '''SELECT
+    "programming_language",
+    COUNT(*) as "language_count"
+FROM
+    "{database}"."{table}"
+WHERE
+    year = ?
+AND
+    month = ?
+AND
+    "programming_language" IS NOT NULL
+GROUP BY
+    "programming_language"
+ORDER BY
+    "language_count" DESC;'''
+    ),
+    "monthly_users_per_group": (
+        "How unique users are split across groups in a month",
+        '''SELECT
+    "group_name",
+    COUNT(DISTINCT "user_id") as "total_users"
+FROM
+    "{database}"."{table}"
+WHERE
+    year = ?
+AND
+    month = ?
+GROUP BY
+    "group_name"
+ORDER BY
+    "total_users" DESC;'''
+    ),
+    "monthly_security_scans": (
+        "How many security scans were run in a month",
+        '''SELECT
+    COUNT(*) as "total_scans"
+FROM
+    "{database}"."{table}"
+WHERE
+    year = ?
+AND
+    month = ?
+AND
+    "event_type" = 'SecurityScanInvocation';'''
+    )
+}
+
+#The same reports answered from the daily_usage rollup table, saved when daily rollups are enabled
+ROLLUP_REPORT_QUERIES = {
+    "rollup_monthly_unique_users": (
+        "How many unique users used CodeWhisperer in a month, from the daily rollups",
+        '''SELECT
+    COUNT(DISTINCT "user_id") as "total_unique_users"
+FROM
+    "{database}"."daily_usage"
+WHERE
+    year = ?
+AND
+    month = ?;'''
+    ),
+    "rollup_monthly_languages": (
+        "The most popular programming languages in a month, from the daily rollups",
+        '''SELECT
+    "programming_language",
+    SUM("event_count") as "language_count"
+FROM
+    "{database}"."daily_usage"
+WHERE
+    year = ?
+AND
+    month = ?
+AND
+    "programming_language" IS NOT NULL
+GROUP BY
+    "programming_language"
+ORDER BY
+    "language_count" DESC;'''
+    ),
+    "rollup_monthly_users_per_group": (
+        "How unique users are split across groups in a month, from the daily rollups",
+        '''SELECT
+    "group_name",
+    COUNT(DISTINCT "user_id") as "total_users"
+FROM
+    "{database}"."daily_usage"
+WHERE
+    year = ?
+AND
+    month = ?
+GROUP BY
+    "group_name"
+ORDER BY
+    "total_users" DESC;'''
+    )
+}
+
+#Views which only read the partitions of the current and previous month, for dashboards which always show recent usage. The view columns come from the table,
+#which the crawler may still be discovering, so they are saved as named queries to be run once rather than created with the stack
+VIEW_QUERIES = {
+    "create_current_month_events_view": (
+        "Create the current_month_events view, which only reads the partitions of the current month (UTC)",
+        '''CREATE OR REPLACE VIEW "{database}"."current_month_events" AS
+SELECT
+    *
+FROM
+    "{database}"."{table}"
+WHERE
+    year = date_format(current_date, '%Y')
+AND
+    month = date_format(current_date, '%m');'''
+    ),
+    "create_previous_month_events_view": (
+        "Create the previous_month_events view, which only reads the partitions of the previous month (UTC)",
+        '''CREATE OR REPLACE VIEW "{database}"."previous_month_events" AS
+SELECT
+    *
+FROM
+    "{database}"."{table}"
+WHERE
+    year = date_format(date_add('month', -1, current_date), '%Y')
+AND
+    month = date_format(date_add('month', -1, current_date), '%m');'''
+    )
+}
+
+class Athena(Construct):
+
+    def __init__(
+        self,
+        scope: Construct,
+        id_: str,
+        bucket: s3.IBucket,
+        database: glue.CfnDatabase,
+        database_name: str,
+        table_name: str,
+        bytes_scanned_cutoff: int = None,
+        rollups: bool = False
+    ):
+        super().__init__(scope, id_)
+
+        if bytes_scanned_cutoff == None:
+            bytes_scanned_cutoff = DEFAULT_BYTES_SCANNED_CUTOFF
+
+        #Create a workgroup which encrypts its results, cancels queries that scan too much and publishes the data scanned by each query to CloudWatch.
+        #Engine version 3 is required to reuse the results of earlier queries
+        self.workgroup = athena.CfnWorkGroup(self, "CodeWhispererWorkGroup",
+            name=WORKGROUP_NAME,
+            description="Reports on CodeWhisperer usage",
+            recursive_delete_option=True,
+            work_group_configuration=athena.CfnWorkGroup.WorkGroupConfigurationProperty(
+                bytes_scanned_cutoff_per_query=int(bytes_scanned_cutoff),
+                enforce_work_group_configuration=True,
+                publish_cloud_watch_metrics_enabled=True,
+                engine_version=athena.CfnWorkGroup.EngineVersionProperty(
+                    selected_engine_version="Athena engine version 3"
+                ),
+                result_configuration=athena.CfnWorkGroup.ResultConfigurationProperty(
+                    output_location="s3://{}/{}".format(bucket.bucket_name, RESULTS_PREFIX),
+                    encryption_configuration=athena.CfnWorkGroup.EncryptionConfigurationProperty(
+                        encryption_option="SSE_S3"
+                    )
+                )
+            )
+        )
+
+        queries = dict(REPORT_QUERIES)
+        queries.update(VIEW_QUERIES)
+
+        if rollups:
+            queries.update(ROLLUP_REPORT_QUERIES)
+
+        #Save each report in the workgroup, the Athena console asks for the year and month when they are run
+        for name, (description, query_string) in queries.items():
+            named_query = athena.CfnNamedQuery(self, "{}Query".format(name.title().replace("_", "")),
+                name=name,
+                description=description,
+                database=database_name,
+                work_group=self.workgroup.ref,
+                query_string=query_string.format(database=database_name, table=table_name)
+            )
+
+            named_query.add_dependency(database)
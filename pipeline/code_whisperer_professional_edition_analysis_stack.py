@@ -1,13 +1,15 @@
 from aws_cdk import (
     Duration,
-    aws_events as events,
-    aws_events_targets as events_targets,
     aws_s3 as s3,
     Stack
 )
+from pipeline.athena import Athena
 from pipeline.cloudtrail import CloudTrail
+from pipeline.compaction import Compaction
+from pipeline.event_bus import CentralEventBus, create_delivery_rules
 from pipeline.glue import Glue
 from pipeline.kinesis_firehose import KinesisFirehose
+from pipeline.rollups import Rollups
 from constructs import Construct
 
 class CodeWhispererProfessionalEditionAnalysisStack(Stack):
@@ -62,35 +64,138 @@ class CodeWhispererProfessionalEditionAnalysisStack(Stack):
         #Get the SSO region that was specified in a context argument
         sso_region = self.node.try_get_context("sso_region")
         
+        #Get the number of concurrent identity store lookups that was specified in a context argument
+        sso_lookup_concurrency = self.node.try_get_context("sso_lookup_concurrency")
+        
+        #Get the number of seconds before the function timeout at which lookups stop
+        sso_lookup_safety_margin = self.node.try_get_context("sso_lookup_safety_margin")
+        
+        #Get the number of seconds to cache user and group details for, and whether the cache should be shared between Lambda containers
+        identity_cache_ttl = self.node.try_get_context("identity_cache_ttl")
+        identity_cache_negative_ttl = self.node.try_get_context("identity_cache_negative_ttl")
+        shared_identity_cache = str(self.node.try_get_context("shared_identity_cache")).lower() == "true"
+        
+        #Get whether every group a user is a member of should be recorded, rather than only the first
+        record_all_groups = str(self.node.try_get_context("record_all_groups")).lower() == "true"
+        
+        #Get whether the group directory should be swept up front, how often it is refreshed and how long the sweep may take
+        group_directory = str(self.node.try_get_context("group_directory")).lower() == "true"
+        group_directory_refresh_interval = self.node.try_get_context("group_directory_refresh_interval")
+        group_directory_sweep_timeout = self.node.try_get_context("group_directory_sweep_timeout")
+        
+        #Get the format the events should be written in, either json (GZIP compressed JSON lines) or parquet
+        output_format = self.node.try_get_context("output_format") or "json"
+        
+        #Get the member accounts which forward their events to this stack, when it is deployed as the hub of several accounts
+        spoke_account_ids_list = self.node.try_get_context("spoke_account_ids")
+        
+        if spoke_account_ids_list is not None:
+            spoke_account_ids = [account_id.strip() for account_id in str(spoke_account_ids_list).split(',') if account_id.strip() != ""]
+        else:
+            spoke_account_ids = []
+        
+        #Get whether the events should be partitioned by their own date, account and event type. This is only enabled when requested, including in a hub, as it can only be set when the Firehose stream is created
+        dynamic_partitioning = str(self.node.try_get_context("dynamic_partitioning")).lower() == "true"
+        
+        #Get whether the transformation function should publish batch metrics, with a dashboard and alarms
+        metrics = str(self.node.try_get_context("metrics")).lower() == "true"
+        
+        #Get the number of recent event IDs remembered by the transformation function to drop duplicate events
+        deduplication_window = self.node.try_get_context("deduplication_window")
+        
+        #Get whether events should be delivered without the transformation function. Without groups the function only filters and reshapes the events, which the EventBridge rules can do instead
+        direct_delivery = str(self.node.try_get_context("direct_delivery")).lower() == "true"
+        
+        if direct_delivery and len(group_ids) > 0:
+            raise ValueError("The direct_delivery context flag cannot be used with sso_group_ids, as enriching the events requires the transformation function")
+        
+        #Get the number of transformation function containers to keep initialised, if any
+        provisioned_concurrency = self.node.try_get_context("provisioned_concurrency")
+        
+        #Create a Glue Data Crawler to populate our Data Catalog
+        glue = Glue(
+            self,
+            "Glue",
+            bucket=codewhisperer_events_bucket,
+            output_format=output_format,
+            dynamic_partitioning=dynamic_partitioning,
+            account_ids=[self.account] + spoke_account_ids
+        )
+        
         #Create the accompanying Kinesis Data Firehose stream with all neccessary components
         firehose = KinesisFirehose(
             self,
             "KinesisFirehose",
             bucket=codewhisperer_events_bucket,
             group_ids=group_ids,
-            sso_region=sso_region
+            sso_region=sso_region,
+            sso_lookup_concurrency=sso_lookup_concurrency,
+            sso_lookup_safety_margin=sso_lookup_safety_margin,
+            identity_cache_ttl=identity_cache_ttl,
+            identity_cache_negative_ttl=identity_cache_negative_ttl,
+            shared_identity_cache=shared_identity_cache,
+            record_all_groups=record_all_groups,
+            group_directory=group_directory,
+            group_directory_refresh_interval=group_directory_refresh_interval,
+            group_directory_sweep_timeout=group_directory_sweep_timeout,
+            output_format=output_format,
+            glue_table=glue.table,
+            dynamic_partitioning=dynamic_partitioning,
+            metrics=metrics,
+            provisioned_concurrency=provisioned_concurrency,
+            deduplication_window=deduplication_window,
+            direct_delivery=direct_delivery
         )
         
-        #Create an EventBridge rule to trigger based on CodeWhisperer data event patterns
-        rule = events.Rule(self, "CodeWhispererRule",
-            event_pattern=events.EventPattern(
-                source=['aws.codewhisperer'],
-                detail_type=['AWS API Call via CloudTrail'],
-                detail={
-                    'eventSource': ['codewhisperer.amazonaws.com'],
-                    'eventName': ['GenerateCompletions', 'GenerateRecommendations', 'ListCodeAnalysisFindings']
-                }
+        #Create an EventBridge rule to trigger based on CodeWhisperer data event patterns, with the Firehose stream created as the target
+        create_delivery_rules(self, "CodeWhispererRule", firehose.stream, direct_delivery)
+        
+        #When this is the hub of several accounts, also deliver the events the spoke accounts forward to the central event bus. Firehose and the transformation function scale with the combined volume
+        if len(spoke_account_ids) > 0:
+            central_event_bus = CentralEventBus(
+                self,
+                "CentralEventBus",
+                spoke_account_ids=spoke_account_ids
             )
-        )
+            
+            create_delivery_rules(self, "CodeWhispererSpokeRule", firehose.stream, direct_delivery, central_event_bus.event_bus)
         
-        #Set the Firehose stream created as the target
-        rule.add_target(events_targets.KinesisFirehoseStream(
-            stream=firehose.stream
-        ))
+        #If requested, merge the small files of each finished day into a few large files. Parquet files are already large, and dynamic partitions are read from fixed locations
+        compaction = str(self.node.try_get_context("compaction")).lower() == "true" and output_format == "json" and not dynamic_partitioning
         
-        #Create a Glue Data Crawler to populate our Data Catalog
-        glue = Glue(
+        #If requested, maintain daily rollup tables so that reports do not need to scan every event
+        daily_rollups = str(self.node.try_get_context("daily_rollups")).lower() == "true"
+        
+        if daily_rollups:
+            Rollups(
+                self,
+                "Rollups",
+                bucket=codewhisperer_events_bucket,
+                database=glue.database,
+                database_name=glue.database_name,
+                events_table_name=glue.table_name,
+                deduplicate_events=str(self.node.try_get_context("deduplicate_rollups")).lower() == "true",
+                compacted_events=compaction
+            )
+        
+        if compaction:
+            Compaction(
+                self,
+                "Compaction",
+                bucket=codewhisperer_events_bucket,
+                database_name=glue.database_name,
+                table_name=glue.table_name,
+                sort_events=str(self.node.try_get_context("compaction_sort")).lower() == "true"
+            )
+        
+        #Create the Athena workgroup the reports are saved in, limiting the data each query can scan
+        Athena(
             self,
-            "Glue",
-            bucket=codewhisperer_events_bucket
+            "Athena",
+            bucket=codewhisperer_events_bucket,
+            database=glue.database,
+            database_name=glue.database_name,
+            table_name=glue.table_name,
+            bytes_scanned_cutoff=self.node.try_get_context("athena_bytes_scanned_cutoff"),
+            rollups=daily_rollups
         )
@@ -0,0 +1,53 @@
+from aws_cdk import (
+    Duration,
+    aws_events as events,
+    aws_events_targets as events_targets,
+    aws_s3 as s3,
+    Stack
+)
+from pipeline.cloudtrail import CloudTrail
+from pipeline.event_bus import codewhisperer_event_pattern, event_bus_arn
+from constructs import Construct
+
+#This stack is deployed to each member account when the analysis pipeline runs in a single hub account. It only records the CodeWhisperer events and forwards them to the hub
+class CodeWhispererSpokeStack(Stack):
+
+    def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
+        super().__init__(scope, construct_id, **kwargs)
+
+        #Get the account and region the hub stack was deployed in, the hub defaults to the region of this stack
+        hub_account_id = self.node.try_get_context("hub_account_id")
+        hub_region = self.node.try_get_context("hub_region") or self.region
+
+        if hub_account_id is None:
+            raise ValueError("The hub_account_id context flag is required when deploying a spoke stack")
+
+        #Create a bucket for storing the access logs
+        access_logs_bucket = s3.Bucket(
+            self,
+            "AccessLogsBucket",
+            enforce_ssl=True,
+            lifecycle_rules=[
+                s3.LifecycleRule(
+                    expiration=Duration.days(30),
+                    noncurrent_version_expiration=Duration.days(30)
+                )
+            ]
+        )
+
+        #Create the CloudTrail trail, so the CodeWhisperer data events of this account are sent to EventBridge
+        CloudTrail(
+            self,
+            "CloudTrail",
+            access_logs_bucket=access_logs_bucket
+        )
+
+        #Create an EventBridge rule to trigger based on CodeWhisperer data event patterns
+        rule = events.Rule(self, "CodeWhispererRule",
+            event_pattern=codewhisperer_event_pattern()
+        )
+
+        #Forward the events unchanged to the event bus of the hub, which processes them with the events of every other account
+        rule.add_target(events_targets.EventBus(
+            events.EventBus.from_event_bus_arn(self, "HubEventBus", event_bus_arn(hub_account_id, hub_region))
+        ))
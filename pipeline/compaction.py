@@ -0,0 +1,86 @@
+from constructs import Construct
+from aws_cdk import (
+    aws_events as events,
+    aws_events_targets as events_targets,
+    aws_iam as iam,
+    aws_lambda as lambda_,
+    aws_s3 as s3,
+    Duration as duration,
+    Size as size,
+    Stack as stack
+)
+from cdk_nag import NagSuppressions
+from cdk_nag import NagPackSuppression
+from pathlib import Path
+from tools.compact import COMPACTED_PREFIX
+
+class Compaction(Construct):
+
+    def __init__(
+        self,
+        scope: Construct,
+        id_: str,
+        bucket: s3.IBucket,
+        database_name: str,
+        table_name: str,
+        sort_events: bool = False
+    ):
+        super().__init__(scope, id_)
+
+        #Create the Lambda function that compacts each finished day. It runs the compaction tool, so only the tools package is included in the asset
+        compaction_function = lambda_.Function(self, "CompactionLambda",
+            code=lambda_.Code.from_asset(str(Path.cwd()), exclude=["**", ".*", "!tools", "!tools/*.py"]),
+            handler="tools.compact.lambda_handler",
+            runtime=lambda_.Runtime.PYTHON_3_11,
+            architecture=lambda_.Architecture.ARM_64,
+            environment={
+                'BUCKET_NAME': bucket.bucket_name,
+                'DATABASE_NAME': database_name,
+                'TABLE_NAME': table_name,
+                #Group the events of each user together, which holds each day in memory
+                'SORT_EVENTS': str(sort_events).lower()
+            },
+            #The function streams each day through a compressed file on local storage, sorting needs the day to fit in memory
+            memory_size=2048 if sort_events else 1024,
+            ephemeral_storage_size=size.gibibytes(2),
+            timeout=duration.minutes(15),
+            tracing=lambda_.Tracing.ACTIVE
+        )
+
+        #The function reads and removes the original files, and writes and replaces the compacted ones
+        bucket.grant_read_write(compaction_function, "CodeWhispererEvents/*")
+        bucket.grant_read_write(compaction_function, "{}/*".format(COMPACTED_PREFIX))
+        bucket.grant_delete(compaction_function, "CodeWhispererEvents/*")
+        bucket.grant_delete(compaction_function, "{}/*".format(COMPACTED_PREFIX))
+
+        compaction_function.add_to_role_policy(
+            iam.PolicyStatement(
+                resources=[
+                    "arn:aws:glue:{}:{}:catalog".format(stack.of(self).region, stack.of(self).account),
+                    "arn:aws:glue:{}:{}:database/{}".format(stack.of(self).region, stack.of(self).account, database_name),
+                    "arn:aws:glue:{}:{}:table/{}/{}".format(stack.of(self).region, stack.of(self).account, database_name, table_name)
+                ],
+                actions=[
+                    "glue:GetTable",
+                    "glue:GetPartition",
+                    "glue:CreatePartition",
+                    "glue:UpdatePartition"
+                ]
+            )
+        )
+
+        NagSuppressions.add_resource_suppressions(
+            compaction_function,
+            [
+                NagPackSuppression(id="AwsSolutions-IAM4", reason="Default policy contains required permissions for Lambda to function such as writing logs"),
+                NagPackSuppression(id="AwsSolutions-IAM5", reason="IAM permissions restricted to the event prefixes of this bucket, used to replace the files of each day")
+            ],
+            True
+        )
+
+        #Compact the previous days once a day, after the crawler has added their partitions and the rollups have run
+        rule = events.Rule(self, "CompactionSchedule",
+            schedule=events.Schedule.cron(minute="0", hour="2")
+        )
+
+        rule.add_target(events_targets.LambdaFunction(compaction_function))
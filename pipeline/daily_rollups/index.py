@@ -0,0 +1,187 @@
+import os
+import time
+import boto3
+from datetime import datetime, timedelta, timezone
+
+athena = boto3.client('athena')
+glue = boto3.client('glue')
+s3 = boto3.client('s3')
+
+DATABASE_NAME = os.environ['DATABASE_NAME']
+EVENTS_TABLE_NAME = os.environ['EVENTS_TABLE_NAME']
+BUCKET_NAME = os.environ['BUCKET_NAME']
+ROLLUPS_PREFIX = os.environ['ROLLUPS_PREFIX']
+WORKGROUP_NAME = os.environ['WORKGROUP_NAME']
+
+#The number of complete days rolled up on each run. Days are rolled up again on the following runs so that events which arrive late are included
+LOOKBACK_DAYS = int(os.environ.get('LOOKBACK_DAYS', '2'))
+
+#Optional columns which are only present in the events table when the events contain them, for example user_name requires SSO groups
+OPTIONAL_COLUMNS = ['user_name', 'group_name', 'programming_language', 'event_id']
+
+#If set, an event delivered more than once is only counted once. Events recorded before the event ID was kept are always counted
+DEDUPLICATE_EVENTS = os.environ.get('DEDUPLICATE_EVENTS', 'false').lower() == 'true'
+
+#The events read by the rollup queries, either the events table or only the first copy of each event in the day
+EVENTS_SOURCE = '"{database}"."{events_table}"'
+
+DEDUPLICATED_EVENTS_SOURCE = """(
+            SELECT
+                *
+            FROM (
+                SELECT
+                    *,
+                    row_number() OVER (PARTITION BY {event_id}) AS event_copy
+                FROM
+                    "{database}"."{events_table}"
+                WHERE
+                    year='{year}'
+                AND
+                    month='{month}'
+                AND
+                    day='{day}'
+            )
+            WHERE
+                event_copy = 1
+            OR
+                {event_id} IS NULL
+        )"""
+
+#The number of seconds between checks on a running query
+POLL_INTERVAL = 2
+
+#The rollups computed for each day. Each query is given the columns to read, and the partition of the day to read from
+ROLLUP_QUERIES = {
+    #The number of events of each user, group, language and event type
+    'daily_usage': """
+        INSERT INTO "{database}"."daily_usage"
+        SELECT
+            account_id,
+            user_id,
+            {user_name} AS user_name,
+            {group_name} AS group_name,
+            {programming_language} AS programming_language,
+            event_type,
+            COUNT(*) AS event_count,
+            year,
+            month,
+            day
+        FROM
+            {events}
+        WHERE
+            year='{year}'
+        AND
+            month='{month}'
+        AND
+            day='{day}'
+        GROUP BY
+            1, 2, 3, 4, 5, 6, 8, 9, 10
+    """,
+    #A HyperLogLog sketch of the distinct users in each group, these can be merged across days to estimate the distinct users over any period
+    'daily_user_sketches': """
+        INSERT INTO "{database}"."daily_user_sketches"
+        SELECT
+            {group_name} AS group_name,
+            CAST(approx_set(user_id) AS varbinary) AS users_sketch,
+            COUNT(DISTINCT user_id) AS user_count,
+            year,
+            month,
+            day
+        FROM
+            {events}
+        WHERE
+            year='{year}'
+        AND
+            month='{month}'
+        AND
+            day='{day}'
+        GROUP BY
+            1, 4, 5, 6
+    """
+}
+
+def lambda_handler(event, context):
+
+    #Specific days can be passed as a list of YYYY-MM-DD strings to backfill them, otherwise the most recent complete days are rolled up
+    if 'days' in event:
+        days = [datetime.strptime(day, '%Y-%m-%d').date() for day in event['days']]
+    else:
+        today = datetime.now(timezone.utc).date()
+        days = [today - timedelta(days=offset) for offset in range(1, LOOKBACK_DAYS + 1)]
+
+    columns = get_event_columns()
+
+    for day in days:
+        for rollup_name, query in ROLLUP_QUERIES.items():
+            rollup_day(rollup_name, query, day, columns)
+
+    return {
+        'days': [day.isoformat() for day in days]
+    }
+
+#This function returns the SQL expression for each optional column, using NULL where the events table does not have the column
+def get_event_columns():
+
+    table = glue.get_table(DatabaseName=DATABASE_NAME, Name=EVENTS_TABLE_NAME)['Table']
+
+    #The partition keys are included as account_id and event_type are partitions when dynamic partitioning is enabled
+    table_columns = [column['Name'] for column in table['StorageDescriptor']['Columns'] + table.get('PartitionKeys', [])]
+
+    return {
+        column: '"{}"'.format(column) if column in table_columns else 'CAST(NULL AS varchar)'
+        for column in OPTIONAL_COLUMNS
+    }
+
+#This function replaces the rollup of a single day, so that running it again does not count the events twice
+def rollup_day(rollup_name, query, day, columns):
+
+    year, month, day_of_month = day.strftime('%Y'), day.strftime('%m'), day.strftime('%d')
+
+    #Remove the previous rollup of the day before inserting the new one
+    delete_objects('{}{}/year={}/month={}/day={}/'.format(ROLLUPS_PREFIX, rollup_name, year, month, day_of_month))
+
+    parameters = dict(
+        database=DATABASE_NAME,
+        events_table=EVENTS_TABLE_NAME,
+        year=year,
+        month=month,
+        day=day_of_month,
+        **columns
+    )
+
+    events = (DEDUPLICATED_EVENTS_SOURCE if DEDUPLICATE_EVENTS else EVENTS_SOURCE).format(**parameters)
+
+    run_query(query.format(events=events, **parameters))
+
+def delete_objects(prefix):
+
+    paginator = s3.get_paginator('list_objects_v2')
+
+    for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=prefix):
+        if 'Contents' in page:
+            s3.delete_objects(
+                Bucket=BUCKET_NAME,
+                Delete={
+                    'Objects': [{'Key': item['Key']} for item in page['Contents']],
+                    'Quiet': True
+                }
+            )
+
+#This function runs an Athena query and waits for it to finish, raising an error if it did not succeed
+def run_query(query):
+
+    query_execution_id = athena.start_query_execution(
+        QueryString=query,
+        WorkGroup=WORKGROUP_NAME
+    )['QueryExecutionId']
+
+    while True:
+        status = athena.get_query_execution(QueryExecutionId=query_execution_id)['QueryExecution']['Status']
+
+        if status['State'] == 'SUCCEEDED':
+            return query_execution_id
+
+        if status['State'] in ['FAILED', 'CANCELLED']:
+            raise RuntimeError('Query {} {}: {}'.format(query_execution_id, status['State'], status.get('StateChangeReason', '')))
+
+        time.sleep(POLL_INTERVAL)
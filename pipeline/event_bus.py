@@ -0,0 +1,134 @@
+from constructs import Construct
+from aws_cdk import (
+    aws_events as events,
+    aws_events_targets as events_targets,
+    aws_kinesisfirehose as kinesisfirehose
+)
+
+#The name of the event bus spoke accounts forward their events to, so spokes can be deployed knowing only the hub account and region
+EVENT_BUS_NAME = "codewhisperer-events"
+
+#Return the pattern matching the CodeWhisperer data events recorded by CloudTrail
+def codewhisperer_event_pattern():
+
+    return events.EventPattern(
+        source=['aws.codewhisperer'],
+        detail_type=['AWS API Call via CloudTrail'],
+        detail={
+            'eventSource': ['codewhisperer.amazonaws.com'],
+            'eventName': ['GenerateCompletions', 'GenerateRecommendations', 'ListCodeAnalysisFindings']
+        }
+    )
+
+#The rules used when events are delivered without the transformation function. An input transformer cannot branch, so each event type, with and without
+#a programming language, has its own rule: (rule suffix, event names, event type, whether the programming language is recorded)
+DIRECT_DELIVERY_RULES = [
+    ("CodeSuggestions", ['GenerateCompletions', 'GenerateRecommendations'], "CodeSuggestionInvocation", True),
+    ("CodeSuggestionsWithoutLanguage", ['GenerateCompletions', 'GenerateRecommendations'], "CodeSuggestionInvocation", False),
+    ("SecurityScans", ['ListCodeAnalysisFindings'], "SecurityScanInvocation", True),
+    ("SecurityScansWithoutLanguage", ['ListCodeAnalysisFindings'], "SecurityScanInvocation", False)
+]
+
+#Return the pattern matching the events the transformation function keeps: calls made on behalf of an SSO user, which are not followed by another page
+def direct_delivery_event_pattern(event_names: [], with_language: bool):
+
+    return events.EventPattern(
+        source=['aws.codewhisperer'],
+        detail_type=['AWS API Call via CloudTrail'],
+        detail={
+            'eventSource': ['codewhisperer.amazonaws.com'],
+            'eventName': event_names,
+            'userIdentity': {
+                'onBehalfOf': {
+                    'userId': [{'exists': True}]
+                }
+            },
+            'requestParameters': {
+                'nextToken': [{'exists': False}, ''],
+                'fileContext': {
+                    'programmingLanguage': {
+                        'languageName': [{'exists': with_language}]
+                    }
+                }
+            }
+        }
+    )
+
+#Return the record the transformation function writes for an event, built from the fields of the event by the input transformer
+def direct_delivery_record(event_type: str, with_language: bool):
+
+    record = {
+        "event_id": events.EventField.from_path("$.detail.eventID"),
+        "event_time": events.EventField.from_path("$.detail.eventTime"),
+        "account_id": events.EventField.from_path("$.detail.userIdentity.accountId"),
+        "user_id": events.EventField.from_path("$.detail.userIdentity.onBehalfOf.userId"),
+        "identity_store_arn": events.EventField.from_path("$.detail.userIdentity.onBehalfOf.identityStoreArn"),
+        "event_type": event_type
+    }
+
+    if with_language:
+        record["programming_language"] = events.EventField.from_path("$.detail.requestParameters.fileContext.programmingLanguage.languageName")
+
+    return events.RuleTargetInput.from_object(record)
+
+#Create the rules delivering the CodeWhisperer events on the event bus to the Firehose stream. Without direct delivery the whole event is sent and the
+#transformation function reshapes it, with direct delivery the rules filter and reshape the events themselves
+def create_delivery_rules(scope: Construct, id_: str, stream: kinesisfirehose.CfnDeliveryStream, direct_delivery: bool = False, event_bus: events.IEventBus = None):
+
+    if not direct_delivery:
+        rule = events.Rule(scope, id_,
+            event_bus=event_bus,
+            event_pattern=codewhisperer_event_pattern()
+        )
+
+        rule.add_target(events_targets.KinesisFirehoseStream(
+            stream=stream
+        ))
+
+        return [rule]
+
+    rules = []
+
+    for suffix, event_names, event_type, with_language in DIRECT_DELIVERY_RULES:
+        rule = events.Rule(scope, "{}{}".format(id_, suffix),
+            event_bus=event_bus,
+            event_pattern=direct_delivery_event_pattern(event_names, with_language)
+        )
+
+        rule.add_target(events_targets.KinesisFirehoseStream(
+            stream=stream,
+            message=direct_delivery_record(event_type, with_language)
+        ))
+
+        rules.append(rule)
+
+    return rules
+
+#Return the ARN of the hub event bus in the given account and region
+def event_bus_arn(account_id: str, region: str):
+
+    return "arn:aws:events:{}:{}:event-bus/{}".format(region, account_id, EVENT_BUS_NAME)
+
+class CentralEventBus(Construct):
+
+    def __init__(
+        self,
+        scope: Construct,
+        id_: str,
+        spoke_account_ids: []
+    ):
+        super().__init__(scope, id_)
+
+        #Create the event bus that every spoke account forwards its CodeWhisperer events to
+        self.event_bus = events.EventBus(self, "CodeWhispererEventBus",
+            event_bus_name=EVENT_BUS_NAME
+        )
+
+        #Only allow the listed spoke accounts to put events on the bus
+        for spoke_account_id in spoke_account_ids:
+            events.CfnEventBusPolicy(self, "SpokePolicy{}".format(spoke_account_id),
+                event_bus_name=self.event_bus.event_bus_name,
+                statement_id="AllowSpoke{}".format(spoke_account_id),
+                action="events:PutEvents",
+                principal=spoke_account_id
+            )
@@ -0,0 +1,143 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+#The number of seconds a directory is used for before it is swept again, so that group changes are picked up
+DEFAULT_REFRESH_INTERVAL = 3600
+
+#The maximum number of seconds a sweep may take. If it takes longer the directory is not used and users are looked up individually
+DEFAULT_SWEEP_TIMEOUT = 20
+
+#This class is raised inside a sweep once the deadline has passed
+class SweepTimeout(Exception):
+    pass
+
+#This class holds the names and members of every configured group, so that a users groups can be found with a dictionary lookup
+class GroupDirectory:
+
+    def __init__(self, call_identity_store, group_ids, refresh_interval=DEFAULT_REFRESH_INTERVAL, sweep_timeout=DEFAULT_SWEEP_TIMEOUT, concurrency=8):
+        self.call_identity_store = call_identity_store
+        self.group_ids = group_ids
+        self.refresh_interval = refresh_interval
+        self.sweep_timeout = sweep_timeout
+        self.concurrency = concurrency
+
+        #The swept directory of each identity store, keyed by identity store id
+        self.stores = {}
+
+        #The sweeps in progress, keyed by identity store id. Each event is set once its sweep has finished
+        self.sweeps = {}
+        self.lock = threading.Lock()
+
+    #Return the directory for the identity store, sweeping it first if it has not been built or is out of date. Returns None if the last sweep did not complete
+    #If a timeout is given a sweep is only started when it could finish within that many seconds, otherwise the previous directory is returned
+    def get(self, identity_store_id, timeout=None):
+
+        with self.lock:
+            store = self.stores.get(identity_store_id)
+            sweeping = self.sweeps.get(identity_store_id)
+
+            #A failed sweep is not retried until the refresh interval has passed, so that every batch does not wait for it
+            start_sweep = (
+                sweeping is None
+                and (store is None or time.time() - store['swept_at'] >= self.refresh_interval)
+                and (timeout is None or timeout >= self.sweep_timeout)
+            )
+
+            if start_sweep:
+                sweeping = threading.Event()
+                self.sweeps[identity_store_id] = sweeping
+
+        #The sweep runs outside the lock, so callers can keep using the previous directory and other identity stores until the new one is swapped in
+        if start_sweep:
+            try:
+                store = self.sweep(identity_store_id)
+
+                with self.lock:
+                    self.stores[identity_store_id] = store
+            finally:
+                with self.lock:
+                    del self.sweeps[identity_store_id]
+
+                sweeping.set()
+        #Without a usable directory wait for the sweep already in progress rather than starting another
+        elif sweeping is not None and (store is None or not store['complete']):
+            if sweeping.wait(timeout):
+                with self.lock:
+                    store = self.stores.get(identity_store_id)
+
+        return store if store is not None and store['complete'] else None
+
+    #Fetch the name and members of every group and build the inverted user to groups index
+    def sweep(self, identity_store_id):
+
+        swept_at = time.time()
+        deadline = swept_at + self.sweep_timeout
+        cancelled = threading.Event()
+
+        executor = ThreadPoolExecutor(max_workers=max(min(self.concurrency, len(self.group_ids)), 1))
+
+        try:
+            futures = [executor.submit(self.sweep_group, identity_store_id, group_id, deadline, cancelled) for group_id in self.group_ids]
+
+            done, not_done = wait(futures, timeout=self.sweep_timeout)
+        finally:
+            #Do not wait for any groups still being swept, they stop at their next page
+            cancelled.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        if len(not_done) > 0 or any(future.exception() is not None for future in done):
+            return {
+                'swept_at': swept_at,
+                'complete': False
+            }
+
+        group_names = {}
+        user_groups = {}
+
+        #Keep the groups of each user in the order they were configured
+        for group_id, future in zip(self.group_ids, futures):
+            group_name, member_ids = future.result()
+            group_names[group_id] = group_name
+
+            for member_id in member_ids:
+                user_groups.setdefault(member_id, []).append(group_id)
+
+        return {
+            'swept_at': swept_at,
+            'complete': True,
+            'group_names': group_names,
+            'user_groups': user_groups
+        }
+
+    #Fetch the name of a single group and page through its members
+    def sweep_group(self, identity_store_id, group_id, deadline, cancelled):
+
+        group_description = self.call_identity_store(
+            'describe_group',
+            IdentityStoreId=identity_store_id,
+            GroupId=group_id
+        )
+
+        member_ids = []
+        request = {
+            'IdentityStoreId': identity_store_id,
+            'GroupId': group_id,
+            'MaxResults': 100
+        }
+
+        while True:
+            if cancelled.is_set() or time.time() > deadline:
+                raise SweepTimeout(group_id)
+
+            result = self.call_identity_store('list_group_memberships', **request)
+
+            #Only users are recorded, nested groups are not supported by IAM Identity Center
+            for membership in result['GroupMemberships']:
+                if 'UserId' in membership['MemberId']:
+                    member_ids.append(membership['MemberId']['UserId'])
+
+            if 'NextToken' not in result or result['NextToken'] == '':
+                return group_description['DisplayName'], member_ids
+
+            request['NextToken'] = result['NextToken']
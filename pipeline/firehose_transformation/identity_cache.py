@@ -0,0 +1,350 @@
+import atexit
+import os
+import json
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger()
+
+#The number of seconds an entry is kept before it is looked up again, this allows renamed users and group moves to be picked up
+DEFAULT_TTL = 3600
+
+#The number of seconds a user that is outside every configured group is remembered for before their membership is checked again
+DEFAULT_NEGATIVE_TTL = 900
+
+#The maximum number of entries held in memory by a single container
+DEFAULT_MAX_SIZE = 10000
+
+#BatchGetItem reads at most this many keys per call
+BATCH_GET_SIZE = 100
+
+#The number of attempts made to read the keys DynamoDB left unprocessed, these are treated as misses afterwards
+BATCH_GET_ATTEMPTS = 3
+
+#This class is the base of every cache tier and keeps the hit, miss and error counters. A tier that fails is treated as a miss, as every entry can be looked up again
+class CacheTier:
+
+    name = 'tier'
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.counter_lock = threading.Lock()
+
+    #Return the cached value for the key, or None if it is missing or has expired
+    def get(self, key):
+        entry = self.get_entry(key)
+
+        return None if entry is None else entry[0]
+
+    #Return the cached (value, expires_at) pair for the key, or None if it is missing or has expired
+    def get_entry(self, key):
+        return self.get_entries([key]).get(key)
+
+    #Return the cached (value, expires_at) pairs of the keys that are found, keyed by key
+    def get_entries(self, keys):
+        try:
+            entries = self._get_many(keys)
+        except Exception as error:
+            logger.warning("Reading %d keys from the %s cache failed, treating them as misses: %s", len(keys), self.name, error)
+            entries = {}
+
+            with self.counter_lock:
+                self.errors += 1
+
+        with self.counter_lock:
+            self.hits += len(entries)
+            self.misses += len(keys) - len(entries)
+
+        return entries
+
+    #Store the value, using the tiers TTL unless a different one is given
+    def set(self, key, value, ttl=None):
+        try:
+            self._set(key, value, time.time() + (self.ttl if ttl is None else ttl))
+        except Exception as error:
+            logger.warning("Writing to the %s cache failed: %s", self.name, error)
+
+            with self.counter_lock:
+                self.errors += 1
+
+    #Write any entries the tier holds back to its storage, a failure is logged and counted as the entries can be looked up again
+    def flush(self):
+        try:
+            self._flush()
+        except Exception as error:
+            logger.warning("Flushing the %s cache failed: %s", self.name, error)
+
+            with self.counter_lock:
+                self.errors += 1
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors
+        }
+
+    #Tiers which can read several keys in one call override this, by default each key is read in turn
+    def _get_many(self, keys):
+        entries = {}
+
+        for key in keys:
+            entry = self._get(key)
+
+            if entry is not None:
+                entries[key] = entry
+
+        return entries
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, value, expires_at):
+        raise NotImplementedError
+
+    #Tiers which write each entry as it is set have nothing to flush
+    def _flush(self):
+        pass
+
+#An in-process least recently used cache, entries expire after the TTL and the oldest entries are evicted once the size cap is reached
+class LRUCache(CacheTier):
+
+    name = 'memory'
+
+    def __init__(self, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        super().__init__(ttl)
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+
+            entry = self.entries[key]
+
+            if entry[1] <= time.time():
+                del self.entries[key]
+                return None
+
+            #Mark the entry as the most recently used
+            self.entries.move_to_end(key)
+
+            return entry
+
+    def _set(self, key, value, expires_at):
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+
+            #Evict the least recently used entries once the cap is exceeded
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+#A cache stored in a local JSON file, this allows the transformation to be run and tested offline without AWS access. New entries are held until the cache is flushed, at the end of each batch and when the process exits, so the file is written once rather than for every entry
+class FileCache(CacheTier):
+
+    name = 'file'
+
+    def __init__(self, path, ttl=DEFAULT_TTL):
+        super().__init__(ttl)
+        self.path = path
+        self.lock = threading.Lock()
+        self.dirty = False
+
+        if os.path.exists(path):
+            with open(path) as file:
+                self.entries = json.load(file)
+        else:
+            self.entries = {}
+
+        atexit.register(self.flush)
+
+    def _get(self, key):
+        with self.lock:
+            if key not in self.entries or self.entries[key]['expires_at'] <= time.time():
+                return None
+
+            return (self.entries[key]['value'], self.entries[key]['expires_at'])
+
+    def _set(self, key, value, expires_at):
+        with self.lock:
+            self.entries[key] = {
+                'value': value,
+                'expires_at': expires_at
+            }
+
+            self.dirty = True
+
+    def _flush(self):
+        with self.lock:
+            if not self.dirty:
+                return
+
+            #Write to a temporary file and swap it in so a partially written file is never read
+            temporary_path = self.path + '.tmp'
+
+            with open(temporary_path, 'w') as file:
+                json.dump(self.entries, file)
+
+            os.replace(temporary_path, self.path)
+
+            self.dirty = False
+
+#A cache stored in a DynamoDB table so that entries are shared across containers and survive cold starts and redeploys
+class DynamoDBCache(CacheTier):
+
+    name = 'dynamodb'
+
+    def __init__(self, table_name, ttl=DEFAULT_TTL, client=None):
+        super().__init__(ttl)
+        self.table_name = table_name
+
+        if client is None:
+            import boto3
+            client = boto3.client('dynamodb')
+
+        self.client = client
+
+    def _get(self, key):
+        result = self.client.get_item(
+            TableName=self.table_name,
+            Key={
+                'cache_key': {'S': key}
+            }
+        )
+
+        if 'Item' not in result:
+            return None
+
+        return self.read_item(result['Item'])
+
+    #Read the keys in as few BatchGetItem calls as possible, so a batch of new users does not wait on a round trip for each one
+    def _get_many(self, keys):
+
+        #A single key, such as the name of a group, is read with GetItem
+        if len(keys) == 1:
+            return super()._get_many(keys)
+
+        entries = {}
+
+        for position in range(0, len(keys), BATCH_GET_SIZE):
+            request_keys = [{'cache_key': {'S': key}} for key in keys[position:position + BATCH_GET_SIZE]]
+
+            for attempt in range(BATCH_GET_ATTEMPTS):
+                result = self.client.batch_get_item(
+                    RequestItems={
+                        self.table_name: {
+                            'Keys': request_keys
+                        }
+                    }
+                )
+
+                for item in result['Responses'].get(self.table_name, []):
+                    entry = self.read_item(item)
+
+                    if entry is not None:
+                        entries[item['cache_key']['S']] = entry
+
+                #DynamoDB returns the keys it could not read when it is throttled, these are read again after a short backoff
+                request_keys = result.get('UnprocessedKeys', {}).get(self.table_name, {}).get('Keys', [])
+
+                if len(request_keys) == 0:
+                    break
+
+                if attempt < BATCH_GET_ATTEMPTS - 1:
+                    time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+
+            if len(request_keys) > 0:
+                logger.warning("%d keys were not read from the %s cache, treating them as misses", len(request_keys), self.name)
+
+        return entries
+
+    #Return the (value, expires_at) pair of an item, or None if it has expired. DynamoDB may take some time to delete expired items, so the expiry is checked as well
+    def read_item(self, item):
+        expires_at = float(item['expires_at']['N'])
+
+        if expires_at <= time.time():
+            return None
+
+        return (json.loads(item['cache_value']['S']), expires_at)
+
+    def _set(self, key, value, expires_at):
+        self.client.put_item(
+            TableName=self.table_name,
+            Item={
+                'cache_key': {'S': key},
+                'cache_value': {'S': json.dumps(value)},
+                'expires_at': {'N': str(int(expires_at))}
+            }
+        )
+
+#This class checks each tier in order. A hit in a later tier is copied into the earlier tiers and new values are written to every tier
+class TieredCache:
+
+    def __init__(self, tiers):
+        self.tiers = tiers
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    #Return the cached values of the keys that are found, keyed by key. Each tier is only asked for the keys the earlier tiers did not have, in a single read
+    def get_many(self, keys):
+        values = {}
+        missing_keys = list(dict.fromkeys(keys))
+
+        for position, tier in enumerate(self.tiers):
+            if len(missing_keys) == 0:
+                break
+
+            entries = tier.get_entries(missing_keys)
+
+            for key, entry in entries.items():
+                #Keep the original expiry so the entry does not live longer in the earlier tiers
+                for earlier_tier in self.tiers[:position]:
+                    earlier_tier.set(key, entry[0], entry[1] - time.time())
+
+                values[key] = entry[0]
+
+            missing_keys = [key for key in missing_keys if key not in entries]
+
+        return values
+
+    def set(self, key, value, ttl=None):
+        for tier in self.tiers:
+            tier.set(key, value, ttl)
+
+    #Write the entries held by each tier back to its storage
+    def flush(self):
+        for tier in self.tiers:
+            tier.flush()
+
+    #Return the hit and miss counters of each tier
+    def stats(self):
+        return {tier.name: tier.stats() for tier in self.tiers}
+
+#Build the cache from the environment variables set by the KinesisFirehose construct
+def create_cache():
+
+    ttl = int(os.environ.get('IDENTITY_CACHE_TTL', DEFAULT_TTL))
+
+    tiers = [
+        LRUCache(ttl=ttl, max_size=int(os.environ.get('IDENTITY_CACHE_MAX_SIZE', DEFAULT_MAX_SIZE)))
+    ]
+
+    #If a cache file was specified add it as a second tier, this is used when running offline
+    if 'IDENTITY_CACHE_FILE' in os.environ:
+        tiers.append(FileCache(os.environ['IDENTITY_CACHE_FILE'], ttl=ttl))
+
+    #If a shared table was provisioned add it as a second tier
+    if 'IDENTITY_CACHE_TABLE' in os.environ:
+        tiers.append(DynamoDBCache(os.environ['IDENTITY_CACHE_TABLE'], ttl=ttl))
+
+    return TieredCache(tiers)
@@ -1,139 +1,702 @@
 import os
 import base64
-import boto3
 import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from contextlib import nullcontext
+from group_directory import GroupDirectory, DEFAULT_REFRESH_INTERVAL, DEFAULT_SWEEP_TIMEOUT
+from identity_cache import create_cache, DEFAULT_NEGATIVE_TTL
+from metrics import create_metrics
+from recent_events import RecentEventIds, DEFAULT_WINDOW
 
-user_details = {}
-group_details = {}
+#Use orjson to parse the events when it is packaged with the function as it is considerably faster, otherwise fall back to the standard library
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+#Events without an SSO user identity are dropped, if this key does not appear in the raw event it can be dropped without being parsed
+ON_BEHALF_OF_KEY = b'"onBehalfOf"'
+
+#The user and group details are cached across invocations of a container, and optionally shared between containers
+cache = create_cache()
+
+#If enabled, the performance of each batch is written to the logs as CloudWatch metrics. When disabled nothing is measured
+batch_metrics = create_metrics(cache)
+
+#The lookup phases are only timed and traced when metrics are enabled
+if batch_metrics is not None:
+    measure_phase = batch_metrics.phase
+else:
+    measure_phase = lambda name: nullcontext()
+
+#Users outside every configured group are cached for a shorter time, so that they are picked up soon after being added to a group
+negative_cache_ttl = int(os.environ.get('IDENTITY_CACHE_NEGATIVE_TTL', DEFAULT_NEGATIVE_TTL))
+
+#EventBridge and Firehose can both deliver an event more than once. The IDs of recently delivered events are remembered by the container so that copies can be dropped, a window of 0 disables this
+deduplication_window = int(os.environ.get('DEDUPLICATION_WINDOW', DEFAULT_WINDOW))
+
+recent_event_ids = RecentEventIds(deduplication_window) if deduplication_window > 0 else None
+
+#IsMemberInGroups accepts a limited number of group IDs per call, larger lists are split into chunks of this size
+MEMBERSHIP_CHUNK_SIZE = 100
+
+#Long lists of SSO group IDs are stored in a parameter as they do not fit in the environment variables
+if 'SSO_GROUP_IDS_PARAMETER' in os.environ:
+    import boto3
+    sso_group_ids_value = boto3.client('ssm').get_parameter(Name=os.environ['SSO_GROUP_IDS_PARAMETER'])['Parameter']['Value']
+else:
+    sso_group_ids_value = os.environ.get('SSO_GROUP_IDS', '')
+
+#Convert the SSO group IDs into a list by splitting on the , character once, ignoring any empty entries
+sso_group_ids = [group_id.strip() for group_id in sso_group_ids_value.split(',') if group_id.strip() != '']
+
+sso_enrichment_enabled = len(sso_group_ids) > 0
+
+#When the events are converted to Parquet the event time is written in the format the JSON deserializer reads as a timestamp
+timestamp_event_time = os.environ.get('OUTPUT_FORMAT', 'json') == 'parquet'
+
+#With dynamic partitioning the partition of each event is returned to Firehose, and the partitioned fields are removed from the event as they become partition columns
+dynamic_partitioning = os.environ.get('DYNAMIC_PARTITIONING', 'false').lower() == 'true'
+
+DYNAMIC_PARTITION_FIELDS = ['account_id', 'event_type']
+
+sso_group_id_chunks = [sso_group_ids[i:i + MEMBERSHIP_CHUNK_SIZE] for i in range(0, len(sso_group_ids), MEMBERSHIP_CHUNK_SIZE)]
+
+#If set, every matching group is recorded in the group_ids and group_names columns rather than only the first
+record_all_groups = os.environ.get('SSO_RECORD_ALL_GROUPS', 'false').lower() == 'true'
+
+#The maximum number of users that will be looked up concurrently when a batch contains several users that are not cached
+lookup_concurrency = int(os.environ.get('SSO_LOOKUP_CONCURRENCY', '8'))
+
+#The number of seconds before the function times out at which lookups stop. Records of users that have not been looked up by then are marked so they can be enriched later
+lookup_safety_margin = int(os.environ.get('SSO_LOOKUP_SAFETY_MARGIN', '10'))
+
+#Error codes returned by the identity store which are retried with a backoff rather than failing the batch
+THROTTLING_ERROR_CODES = ['ThrottlingException', 'TooManyRequestsException']
+RETRYABLE_ERROR_CODES = THROTTLING_ERROR_CODES + ['InternalServerException']
+
+#The number of attempts made for a single API call and the bounds of the backoff between them, in seconds
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = 0.1
+BACKOFF_CAP = 5
 
 #If the SSO_REGION variable is set use this to interact with the identity store, otherwise use the default region
 if 'SSO_REGION' in os.environ:
     sso_region = os.environ['SSO_REGION']
 else:
-    sso_region = os.environ['AWS_DEFAULT_REGION']   
+    sso_region = os.environ['AWS_DEFAULT_REGION']
+
+#The identity store client is created when the first user is looked up, so that containers without SSO groups never load boto3
+client = None
+client_lock = threading.Lock()
+
+def get_client():
+
+    global client
+
+    if client is None:
+        with client_lock:
+            if client is None:
+                import boto3
+                from botocore.config import Config
+
+                #Retries are handled by call_identity_store so that throttling can reduce the concurrency. Size the connection pool to match the number of workers
+                client = boto3.client(
+                    'identitystore',
+                    region_name=sso_region,
+                    config=Config(
+                        max_pool_connections=max(lookup_concurrency, 10),
+                        retries={'total_max_attempts': 1}
+                    )
+                )
+
+    return client
+
+#When users will be looked up create the client now, as initialisation runs ahead of the first batch when provisioned concurrency is used
+if sso_enrichment_enabled:
+    get_client()
+
+#The membership chunks of a single user are checked on a separate pool, as the user lookups already run on a pool of their own
+membership_executor = ThreadPoolExecutor(max_workers=lookup_concurrency) if len(sso_group_id_chunks) > 1 else None
+
+#This class bounds the number of in-flight identity store calls. The limit is halved whenever a call is throttled and grows back one step at a time as calls succeed
+class AdaptiveLimiter:
+
+    def __init__(self, max_limit):
+        self.max_limit = max(max_limit, 1)
+        self.limit = self.max_limit
+        self.active = 0
+        self.successes = 0
+        self.condition = threading.Condition()
+
+    #Wait until there is room for another call under the current limit
+    def acquire(self):
+        with self.condition:
+            while self.active >= self.limit:
+                self.condition.wait()
+            self.active += 1
+
+    #Release the slot, adjusting the limit based on whether the call was throttled
+    def release(self, throttled=False):
+        with self.condition:
+            self.active -= 1
+
+            if throttled:
+                self.limit = max(self.limit // 2, 1)
+                self.successes = 0
+            elif self.limit < self.max_limit:
+                self.successes += 1
+
+                #Only increase the limit once a full round of calls has succeeded at the current limit
+                if self.successes >= self.limit:
+                    self.limit += 1
+                    self.successes = 0
+
+            self.condition.notify_all()
+
+limiter = AdaptiveLimiter(lookup_concurrency)
+
+#This class is raised instead of calling the identity store once the deadline of the batch has passed
+class DeadlineExceeded(Exception):
+    pass
+
+#This class holds the deadline of a single batch. Lookups still running when their batch is returned are cancelled, so they stop before their next call rather than running on under the deadline of a later batch
+class BatchDeadline:
+
+    def __init__(self, expires_at=None):
+        #The time on the monotonic clock after which no more lookups are started, None when running without a Lambda context
+        self.expires_at = expires_at
+        self.cancelled = threading.Event()
+
+    #Return the number of seconds left until the deadline, or None if there is no deadline
+    def time_left(self):
+
+        if self.cancelled.is_set():
+            return 0
+
+        if self.expires_at is None:
+            return None
+
+        return max(self.expires_at - time.monotonic(), 0)
+
+    def expired(self):
+        return self.time_left() == 0
 
-client = boto3.client('identitystore', region_name=sso_region)
+    #Stop the lookups of the batch before their next call
+    def cancel(self):
+        self.cancelled.set()
+
+    #Wait for the given number of seconds, returning False straight away if the deadline would pass first or once the batch is cancelled
+    def sleep(self, seconds):
+
+        time_left = self.time_left()
+
+        if time_left is not None and seconds >= time_left:
+            return False
+
+        return not self.cancelled.wait(seconds)
+
+#This function calls an identity store operation through the limiter, retrying throttled calls with full jitter backoff. Calls made for a batch stop once its deadline has passed
+def call_identity_store(operation, deadline=None, **kwargs):
+
+    identity_store = get_client()
+
+    for attempt in range(MAX_ATTEMPTS):
+        if deadline is not None and deadline.expired():
+            raise DeadlineExceeded(operation)
+
+        limiter.acquire()
+
+        #The batch may have been returned while waiting for a slot
+        if deadline is not None and deadline.expired():
+            limiter.release()
+            raise DeadlineExceeded(operation)
+
+        try:
+            result = getattr(identity_store, operation)(**kwargs)
+        except Exception as error:
+            #botocore is only imported once a call has failed
+            from botocore.exceptions import ClientError
+
+            if not isinstance(error, ClientError):
+                limiter.release()
+                raise
+
+            error_code = error.response['Error']['Code']
+            limiter.release(throttled=error_code in THROTTLING_ERROR_CODES)
+
+            if batch_metrics is not None and error_code in THROTTLING_ERROR_CODES:
+                batch_metrics.add('IdentityStoreThrottles')
+
+            #Raise anything which cannot be retried, or if this was the final attempt
+            if error_code not in RETRYABLE_ERROR_CODES or attempt == MAX_ATTEMPTS - 1:
+                raise
+
+            backoff = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+            #Do not wait past the deadline for a retry that will not be made
+            if deadline is None:
+                time.sleep(backoff)
+            elif not deadline.sleep(backoff):
+                raise DeadlineExceeded(operation)
+
+            continue
+
+        limiter.release()
+
+        return result
+
+#Record the number, latency and errors of each identity store operation, including the calls made by the group directory
+if batch_metrics is not None:
+    call_identity_store = batch_metrics.instrument(call_identity_store, skipped_errors=(DeadlineExceeded,))
+
+#If enabled, the names and members of every group are fetched when the first batch arrives and refreshed periodically, so that users can be enriched without checking their membership individually
+if os.environ.get('SSO_GROUP_DIRECTORY', 'false').lower() == 'true' and len(sso_group_ids) > 0:
+    group_directory = GroupDirectory(
+        call_identity_store,
+        sso_group_ids,
+        refresh_interval=int(os.environ.get('SSO_GROUP_DIRECTORY_REFRESH_INTERVAL', DEFAULT_REFRESH_INTERVAL)),
+        sweep_timeout=int(os.environ.get('SSO_GROUP_DIRECTORY_SWEEP_TIMEOUT', DEFAULT_SWEEP_TIMEOUT)),
+        concurrency=lookup_concurrency
+    )
+else:
+    group_directory = None
 
 def lambda_handler(event, context):
-    
+
+    #Stop looking up users once only the safety margin is left, so that the batch is returned before the function times out rather than being retried by Firehose
+    if context is not None:
+        deadline = BatchDeadline(time.monotonic() + context.get_remaining_time_in_millis() / 1000 - lookup_safety_margin)
+    else:
+        deadline = BatchDeadline()
+
+    if batch_metrics is not None:
+        batch_metrics.start()
+        batch_metrics.add('BytesIn', sum(len(record['data']) for record in event['records']), 'Bytes')
+
+    #Keep each record alongside its processed data so that enrichment can happen once every user in the batch is known
+    processed_records = []
+
+    #The cached details of each distinct user in this batch, keyed by (identity_store_id, user_id)
+    batch_users = {}
+
+    #The IDs of the events kept in this batch, mapped to the ID of the record carrying each one
+    batch_event_ids = {}
+    duplicate_records = 0
+
+    #First pass: loop through each record, decode and filter it, and collect the users that need to be looked up
+    with measure_phase('Decode'):
+        for record in event['records']:
+
+            #Data is included in base64 format, decode it and only load the JSON string if the event could contain an SSO user identity
+            record_bytes = base64.b64decode(record['data'])
+
+            if ON_BEHALF_OF_KEY in record_bytes:
+                record_data = extract_record_data(json_loads(record_bytes))
+            else:
+                record_data = None
+
+            #Drop copies of an event already seen in this batch or carried by another record in a recent one. A retried batch carries its events in the same records, so they are kept
+            if record_data is not None and recent_event_ids is not None and record_data['event_id'] is not None:
+                if record_data['event_id'] in batch_event_ids or recent_event_ids.is_duplicate(record_data['event_id'], record['recordId']):
+                    record_data = None
+                    duplicate_records += 1
+                else:
+                    batch_event_ids[record_data['event_id']] = record['recordId']
+
+            #If SSO_GROUP_IDS is included then collect each distinct user, their cached details are read once the whole batch is decoded
+            if record_data is not None and sso_enrichment_enabled:
+                batch_users[(get_identity_store_id(record_data), record_data['user_id'])] = None
+
+            processed_records.append((record, record_data))
+
+        #Read every user of the batch from the cache together, so a shared cache tier is read in a few calls rather than one round trip for each user
+        if len(batch_users) > 0:
+            cached_users = cache.get_many([get_user_cache_key(*user_key) for user_key in batch_users])
+
+            for user_key in batch_users:
+                batch_users[user_key] = cached_users.get(get_user_cache_key(*user_key))
+
+    #The distinct users in this batch which have not been fully cached yet
+    pending_users = [user_key for user_key, user_entry in batch_users.items() if not is_user_cached(user_entry)]
+
+    #If the group directory is enabled make sure it has been swept for each identity store before the users are looked up
+    if group_directory is not None:
+        with measure_phase('GroupDirectory'):
+            for identity_store_id in set(identity_store_id for identity_store_id, user_id in pending_users):
+                group_directory.get(identity_store_id, deadline.time_left())
+
+    #Each cached user that is outside every group avoids an IsMemberInGroups call
+    avoided_calls = len([user_entry for user_entry in batch_users.values() if is_user_cached(user_entry) and user_entry['group_id'] is None])
+
+    if avoided_calls > 0:
+        logger.info("Avoided %d IsMemberInGroups calls for users outside every configured group", avoided_calls)
+
+    if batch_metrics is not None:
+        batch_metrics.add('Users', len(batch_users))
+        batch_metrics.add('PendingUsers', len(pending_users))
+        batch_metrics.add('AvoidedMembershipCalls', avoided_calls)
+
+    #Resolve every new user in one step, so the number of lookups grows with the distinct new users rather than the number of records
+    with measure_phase('Lookup'):
+        resolved_users = resolve_sso_details(pending_users, batch_users, deadline)
+        batch_users.update(resolved_users)
+
+    #Users that could not be looked up before the deadline are left for later, their records are still delivered
+    unresolved_users = len(pending_users) - len(resolved_users)
+
+    if unresolved_users > 0:
+        logger.warning("Deadline reached before %d users were looked up, their records are marked with enrichment_pending", unresolved_users)
+
+    if batch_metrics is not None:
+        batch_metrics.add('UnresolvedUsers', unresolved_users)
+
     #Create the records list to replace the records entry after processing
     records = []
-    
-    #Loop through each record
-    for record in event['records']:
-        
-        #Data is included in base64 format, decode it and load the JSON string to use the object
-        record_data_raw = json.loads(base64.b64decode(record['data']))
-        
-        #Only retrieve the events where an SSO user identity is included, this will remove calls from supported service integrations like Lambda. If nextToken is included and has a value we should not include it as the result was not returned
-        if 'onBehalfOf' in record_data_raw["detail"]["userIdentity"] and ("nextToken" not in record_data_raw["detail"]["requestParameters"] or record_data_raw["detail"]["requestParameters"]["nextToken"] == ""):
-            #Assume the event is a code suggestion...
-            event_type = "CodeSuggestionInvocation"
-            
-            #Unless it is a ListCodeAnalysisFindings event
-            if record_data_raw["detail"]["eventName"] == "ListCodeAnalysisFindings":
-                event_type = "SecurityScanInvocation"
-        
-            #Create the new processed format by extracting key details from the event
-            record_data = {
-                "event_time": record_data_raw["detail"]["eventTime"],
-                "account_id": record_data_raw["detail"]["userIdentity"]["accountId"],
-                "user_id": record_data_raw["detail"]["userIdentity"]["onBehalfOf"]["userId"],
-                "identity_store_arn": record_data_raw["detail"]["userIdentity"]["onBehalfOf"]["identityStoreArn"],
-                "event_type": event_type
-            }
-            
-            #if FileContext is included also capture the programming language that was used
-            if "fileContext" in record_data_raw["detail"]["requestParameters"]:
-                record_data["programming_language"] = record_data_raw["detail"]["requestParameters"]["fileContext"]["programmingLanguage"]["languageName"]
-                
-            #If SSO_GROUP_IDS is included then gather additional metadata and enrich the above record
-            if os.environ["SSO_GROUP_IDS"] != "":
-                record_data = append_sso_details(record_data, os.environ["SSO_GROUP_IDS"])
-            
-            #Convert the entity back into a JSON string and append a newline character to avoid grouped results residing in the same line
-            record_data = json.dumps(record_data)
-            record_data += "\n"
-    
-            #Base64 encode the result and let Firehose know it was processed correctly
-            record['data'] = base64.b64encode(record_data.encode('utf-8'))
-            record['result'] = 'Ok'
-        #This record should not be put into our S3 bucket, mark it as dropped so that Firehose will not reattempt to process
-        else:
-            record['result'] = 'Dropped'
-            
-        #Add to the records List
-        records.append(record)
-    
+
+    #Second pass: enrich and encode the records using the resolved user details
+    with measure_phase('Encode'):
+        for record, record_data in processed_records:
+
+            if record_data is not None:
+                #If SSO_GROUP_IDS is included then enrich the above record with the user and group details
+                if sso_enrichment_enabled:
+                    user_entry = batch_users[(get_identity_store_id(record_data), record_data['user_id'])]
+
+                    if is_user_cached(user_entry):
+                        record_data = apply_sso_details(record_data, user_entry)
+                    else:
+                        record_data['enrichment_pending'] = True
+
+                if dynamic_partitioning:
+                    record['metadata'] = {
+                        'partitionKeys': get_partition_keys(record_data)
+                    }
+
+                #Convert the entity back into a JSON string and append a newline character to avoid grouped results residing in the same line, then base64 encode the result and let Firehose know it was processed correctly
+                record['data'] = base64.b64encode((json.dumps(record_data) + "\n").encode('utf-8'))
+                record['result'] = 'Ok'
+            #This record should not be put into our S3 bucket, mark it as dropped so that Firehose will not reattempt to process
+            else:
+                record['result'] = 'Dropped'
+
+            #Add to the records List
+            records.append(record)
+
     #Return newly formatted events to be published into their destination
     event['records'] = records
-    
+
+    #Only remember the events once the batch has been processed. Should Firehose retry the batch anyway, its records are recognised by their record IDs
+    if recent_event_ids is not None:
+        recent_event_ids.update(batch_event_ids)
+
+    #Write the users and groups looked up in this batch to the cache tiers which hold their entries until flushed
+    cache.flush()
+
+    if duplicate_records > 0:
+        logger.info("Dropped %d duplicate events", duplicate_records)
+
+    if batch_metrics is not None:
+        batch_metrics.add('DuplicateRecords', duplicate_records)
+        batch_metrics.publish(records, context)
+
     return event
 
-#This function takes a individual records data and attempts to add additional data via the IAM Identity Center groups
-def append_sso_details(record_data, sso_group_ids):
-    
-    #Extract the idenitity store id from the Arn
-    identity_store_id = record_data['identity_store_arn'].split("/")[1]
-    
+#This function takes a decoded CloudTrail event and returns the processed format, or None if the event should be dropped
+def extract_record_data(record_data_raw):
+
+    detail = record_data_raw["detail"]
+    user_identity = detail["userIdentity"]
+    request_parameters = detail["requestParameters"]
+
+    #Only retrieve the events where an SSO user identity is included, this will remove calls from supported service integrations like Lambda. If nextToken is included and has a value we should not include it as the result was not returned
+    if 'onBehalfOf' in user_identity and request_parameters.get("nextToken", "") == "":
+        #Assume the event is a code suggestion...
+        event_type = "CodeSuggestionInvocation"
+
+        #Unless it is a ListCodeAnalysisFindings event
+        if detail["eventName"] == "ListCodeAnalysisFindings":
+            event_type = "SecurityScanInvocation"
+
+        on_behalf_of = user_identity["onBehalfOf"]
+
+        #Create the new processed format by extracting key details from the event
+        record_data = {
+            "event_id": detail.get("eventID"),
+            "event_time": detail["eventTime"],
+            "account_id": user_identity["accountId"],
+            "user_id": on_behalf_of["userId"],
+            "identity_store_arn": on_behalf_of["identityStoreArn"],
+            "event_type": event_type
+        }
+
+        #CloudTrail event times are always in the format 2023-08-01T12:34:56Z, convert them to 2023-08-01 12:34:56
+        if timestamp_event_time:
+            record_data["event_time"] = record_data["event_time"].replace("T", " ").rstrip("Z")
+
+        #if FileContext is included also capture the programming language that was used
+        if "fileContext" in request_parameters:
+            record_data["programming_language"] = request_parameters["fileContext"]["programmingLanguage"]["languageName"]
+
+        return record_data
+
+    return None
+
+#This function returns the partition an event belongs to, based on its own event time, and removes the partitioned fields from the event
+def get_partition_keys(record_data):
+
+    #The event time starts with the date in the format 2023-08-01 in both output formats
+    partition_keys = {
+        'year': record_data['event_time'][0:4],
+        'month': record_data['event_time'][5:7],
+        'day': record_data['event_time'][8:10]
+    }
+
+    for field in DYNAMIC_PARTITION_FIELDS:
+        partition_keys[field] = record_data.pop(field)
+
+    return partition_keys
+
+#Extract the idenitity store id from the Arn
+def get_identity_store_id(record_data):
+    return record_data['identity_store_arn'].split("/")[1]
+
+#Users and groups are cached under the identity store they belong to, as the cache may be shared
+def get_user_cache_key(identity_store_id, user_id):
+    return 'user#{}#{}'.format(identity_store_id, user_id)
+
+def get_group_cache_key(identity_store_id, group_id):
+    return 'group#{}#{}'.format(identity_store_id, group_id)
+
+#A user is fully cached once their user_name and group membership have been looked up. A group_id of None means they are not in any of the groups
+def is_user_cached(user_entry):
+    if user_entry is None or 'group_id' not in user_entry:
+        return False
+
+    #Entries cached before every group was being recorded need to be looked up again
+    return not record_all_groups or 'group_ids' in user_entry
+
+#This function looks up the user and group details for every (identity_store_id, user_id) pair and returns the resulting cache entries. Users not looked up before the deadline are left out
+def resolve_sso_details(pending_users, batch_users, deadline=None):
+
+    if len(pending_users) == 0:
+        return {}
+
+    if deadline is None:
+        deadline = BatchDeadline()
+
+    #A single user does not need a thread pool unless the lookup has to be abandoned at the deadline
+    if deadline.expires_at is None and (len(pending_users) <= 1 or lookup_concurrency <= 1):
+        return {
+            user_key: lookup_sso_details(*user_key, batch_users.get(user_key), deadline)
+            for user_key in pending_users
+        }
+
+    #Look up the users across a bounded pool of workers, the limiter further restricts the number of in-flight calls if the identity store throttles
+    executor = ThreadPoolExecutor(max_workers=max(min(lookup_concurrency, len(pending_users)), 1))
+
+    try:
+        futures = {
+            user_key: executor.submit(lookup_sso_details, *user_key, batch_users.get(user_key), deadline)
+            for user_key in pending_users
+        }
+
+        wait(futures.values(), timeout=deadline.time_left())
+    finally:
+        #Do not wait for lookups still running at the deadline. Cancelling the batch stops them before their next call, even once a later batch has started
+        deadline.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    resolved_users = {}
+
+    for user_key, future in futures.items():
+        if not future.done() or future.cancelled() or isinstance(future.exception(), DeadlineExceeded):
+            continue
+
+        #Retrieve each result so that any error which could not be retried is raised
+        resolved_users[user_key] = future.result()
+
+    return resolved_users
+
+#This function performs the IAM Identity Center API calls for a single user and caches the results for later records
+def lookup_sso_details(identity_store_id, user_id, user_entry=None, deadline=None):
+
     #If we alrady have cached the user_name use that rather than performing the API call
-    if record_data['user_id'] in user_details:
-        record_data['user_name'] = user_details[record_data['user_id']]['user_name']
-    else:
+    if user_entry is None:
         #Loop us the user details
-        user_details_result = client.describe_user(
+        user_details_result = call_identity_store(
+            'describe_user',
+            deadline=deadline,
             IdentityStoreId=identity_store_id,
-            UserId=record_data['user_id']
+            UserId=user_id
         )
-        
-        #Append user_name to the record data
-        record_data['user_name'] = user_details_result['UserName']
-        
-        #Cache the result for later invocations
-        user_details[record_data['user_id']] = {
-            'user_name': record_data['user_name']
+
+        user_entry = {
+            'user_name': user_details_result['UserName']
         }
-    
-    #Convert the SSO group IDs inot a list by splitting on the , character
-    sso_group_ids = sso_group_ids.split(',')
-    
-    #If we already have a group_id set in the cached details reuse it. We can safely assume that if this logic has been carried out the group will also be cached
-    if 'group_id' in user_details[record_data['user_id']]:
-        record_data['group_id'] = user_details[record_data['user_id']]['group_id']
-        record_data['group_name'] = group_details[record_data['group_id']]
-    #The users groups are not known so look up if they are part of at least one of the groups
     else:
-        is_member_in_groups = client.is_member_in_groups(
-            IdentityStoreId=identity_store_id,
-            MemberId={
-                'UserId': record_data['user_id']
-            },
-            GroupIds=sso_group_ids
-        )
-        
-        #Loop over the results
-        for result in is_member_in_groups['Results']:
-            #If the user if a part of the group proceeed with the logic
-            if result['MembershipExists'] == True:
-                #Amend the record_data and cache the group_id for later
-                user_details[record_data['user_id']]['group_id'] = result['GroupId']
-                record_data['group_id'] = result['GroupId']
-                
-                #If the group has been looked up before and is cached, reuse the details
-                if result['GroupId'] in group_details:
-                    record_data['group_name'] = result['GroupId']
-                #Otherwise do a describe_group call to get the group name
-                else:
-                    group_description = client.describe_group(
-                        IdentityStoreId=identity_store_id,
-                        GroupId=record_data['group_id']
-                    )
-                    
-                    #Amend the record_data and store the group name in the cache
-                    record_data['group_name'] = group_description['DisplayName']
-                    group_details[record_data['group_id']] = group_description['DisplayName']
-                
-                #Break out of the loop by returning the record data
-                return record_data
-    
-    return record_data
\ No newline at end of file
+        #Copy the entry so that the cached value is only changed through the cache
+        user_entry = dict(user_entry)
+
+    #If the groups have not been looked up yet check which of the groups they are part of
+    if not is_user_cached(user_entry):
+        member_group_ids = lookup_member_group_ids(identity_store_id, user_id, deadline)
+
+        #Record the first matching group, or that the user is outside every group
+        if len(member_group_ids) > 0:
+            user_entry['group_id'] = member_group_ids[0]
+            user_entry['group_name'] = lookup_group_name(identity_store_id, member_group_ids[0], deadline)
+        else:
+            user_entry['group_id'] = None
+
+        #Also record every matching group if requested
+        if record_all_groups:
+            user_entry['group_ids'] = member_group_ids
+            user_entry['group_names'] = [lookup_group_name(identity_store_id, group_id, deadline) for group_id in member_group_ids]
+
+    #Cache the result for later invocations
+    if user_entry['group_id'] is None:
+        cache.set(get_user_cache_key(identity_store_id, user_id), user_entry, negative_cache_ttl)
+    else:
+        cache.set(get_user_cache_key(identity_store_id, user_id), user_entry)
+
+    return user_entry
+
+#This function returns the IDs of every configured group the user is a member of, in the order they were configured
+def lookup_member_group_ids(identity_store_id, user_id, deadline=None):
+
+    #If the group directory has been swept the groups can be found without an API call
+    if group_directory is not None:
+        directory = group_directory.get(identity_store_id, deadline.time_left() if deadline is not None else None)
+
+        if directory is not None:
+            return directory['user_groups'].get(user_id, [])
+
+    #A single chunk does not need a thread pool
+    if membership_executor is None:
+        chunk_results = [check_group_membership(identity_store_id, user_id, chunk, deadline) for chunk in sso_group_id_chunks]
+    #Otherwise check every chunk concurrently, the limiter bounds the number of in-flight calls across all users
+    else:
+        futures = [membership_executor.submit(check_group_membership, identity_store_id, user_id, chunk, deadline) for chunk in sso_group_id_chunks]
+        chunk_results = [future.result() for future in futures]
+
+    member_group_ids = set()
+
+    for chunk_result in chunk_results:
+        member_group_ids.update(chunk_result)
+
+    return [group_id for group_id in sso_group_ids if group_id in member_group_ids]
+
+#This function checks a single chunk of groups and returns the IDs of the ones the user is a member of
+def check_group_membership(identity_store_id, user_id, group_ids, deadline=None):
+
+    is_member_in_groups = call_identity_store(
+        'is_member_in_groups',
+        deadline=deadline,
+        IdentityStoreId=identity_store_id,
+        MemberId={
+            'UserId': user_id
+        },
+        GroupIds=group_ids
+    )
+
+    #If the user if a part of the group proceeed with the logic
+    return [result['GroupId'] for result in is_member_in_groups['Results'] if result['MembershipExists'] == True]
+
+#The group names being looked up, keyed by their cache key, so that users of the same group share a single call
+group_name_lookups = {}
+group_name_lookups_lock = threading.Lock()
+
+#This function returns the display name of a group, using the cached value where possible
+def lookup_group_name(identity_store_id, group_id, deadline=None):
+
+    #If the group directory has been swept it already contains the name
+    if group_directory is not None:
+        directory = group_directory.get(identity_store_id, deadline.time_left() if deadline is not None else None)
+
+        if directory is not None:
+            return directory['group_names'][group_id]
+
+    group_cache_key = get_group_cache_key(identity_store_id, group_id)
+    group_name = cache.get(group_cache_key)
+
+    if group_name is not None:
+        return group_name
+
+    while True:
+        #Only the first lookup of a group makes the describe_group call, lookups of the same group made at the same time wait for its result
+        with group_name_lookups_lock:
+            group_name_lookup = group_name_lookups.get(group_cache_key)
+            owner = group_name_lookup is None
+
+            if owner:
+                group_name_lookup = Future()
+                group_name_lookups[group_cache_key] = group_name_lookup
+
+        if owner:
+            try:
+                group_description = call_identity_store(
+                    'describe_group',
+                    deadline=deadline,
+                    IdentityStoreId=identity_store_id,
+                    GroupId=group_id
+                )
+
+                #Store the group name in the cache
+                group_name = group_description['DisplayName']
+                cache.set(group_cache_key, group_name)
+                group_name_lookup.set_result(group_name)
+
+                return group_name
+            except Exception as error:
+                group_name_lookup.set_exception(error)
+                raise
+            finally:
+                with group_name_lookups_lock:
+                    del group_name_lookups[group_cache_key]
+
+        try:
+            return group_name_lookup.result(timeout=deadline.time_left() if deadline is not None else None)
+        except FutureTimeoutError:
+            raise DeadlineExceeded('describe_group')
+        except DeadlineExceeded:
+            #The lookup being waited for belonged to a batch which has already been returned, so look the group up again while this batch has time left
+            if deadline is not None and deadline.expired():
+                raise
+
+#This function adds the user and group details from a cache entry to a records data
+def apply_sso_details(record_data, user_entry):
+
+    #Append user_name to the record data
+    record_data['user_name'] = user_entry['user_name']
+
+    #If the user is a member of one of the groups, append the group details
+    if user_entry['group_id'] is not None:
+        record_data['group_id'] = user_entry['group_id']
+        record_data['group_name'] = user_entry['group_name']
+
+    #If every matching group is recorded, append them as list columns
+    if record_all_groups:
+        record_data['group_ids'] = user_entry['group_ids']
+        record_data['group_names'] = user_entry['group_names']
+
+    return record_data
+
+#This function takes a individual records data and attempts to add additional data via the IAM Identity Center groups
+def append_sso_details(record_data):
+
+    identity_store_id = get_identity_store_id(record_data)
+    user_entry = cache.get(get_user_cache_key(identity_store_id, record_data['user_id']))
+
+    #If the user is not cached look them up now
+    if not is_user_cached(user_entry):
+        user_entry = lookup_sso_details(identity_store_id, record_data['user_id'], user_entry)
+
+    return apply_sso_details(record_data, user_entry)
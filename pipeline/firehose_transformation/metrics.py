@@ -0,0 +1,183 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+#The X-Ray SDK is not included in the Lambda runtime, lookup phases are only traced when it is packaged with the function
+try:
+    from aws_xray_sdk.core import xray_recorder
+except ImportError:
+    xray_recorder = None
+
+#The CloudWatch namespace the metrics are published to by default
+DEFAULT_NAMESPACE = 'CodeWhispererUsageAnalyzer'
+
+#The embedded metric format accepts at most this many values for a metric in a single document
+MAX_METRIC_VALUES = 100
+
+#The metric names used for each cache tier
+CACHE_TIER_NAMES = {
+    'memory': 'Memory',
+    'file': 'File',
+    'dynamodb': 'DynamoDB'
+}
+
+#This class collects the performance of a single invocation and writes it to the function logs in the CloudWatch embedded metric format, which CloudWatch turns into metrics without any API calls
+class BatchMetrics:
+
+    def __init__(self, namespace, function_name, cache):
+        self.namespace = namespace
+        self.function_name = function_name
+        self.cache = cache
+        self.lock = threading.Lock()
+
+        #Only trace the phases when running in Lambda, outside of Lambda there is no segment to add them to
+        self.trace = xray_recorder is not None and 'AWS_LAMBDA_FUNCTION_NAME' in os.environ
+
+        self.start()
+
+    #Reset the values at the start of each invocation. The cache counters are kept for the life of the container, so the values at the start are subtracted when publishing
+    def start(self):
+        self.started_at = time.perf_counter()
+        self.values = defaultdict(int)
+        self.units = {}
+        self.latencies = defaultdict(list)
+        self.cache_stats = self.cache.stats()
+
+    #Add to a count for this invocation, this may be called from the lookup threads
+    def add(self, name, value=1, unit='Count'):
+        with self.lock:
+            self.values[name] += value
+            self.units[name] = unit
+
+    #Time a block of the invocation, and trace it as an X-Ray subsegment if the SDK is available
+    @contextmanager
+    def phase(self, name):
+        started_at = time.perf_counter()
+
+        if self.trace:
+            with xray_recorder.in_subsegment(name):
+                yield
+        else:
+            yield
+
+        self.add('{}Duration'.format(name), (time.perf_counter() - started_at) * 1000, 'Milliseconds')
+
+    #Wrap the function used to call the identity store, so that the number, latency and errors of each operation are recorded
+    #Calls given up with one of the skipped errors, as the deadline of the batch had passed, are only counted as skipped so they do not add to the errors or latencies
+    def instrument(self, call_identity_store, skipped_errors=()):
+
+        def instrumented_call(operation, **kwargs):
+            name = ''.join(part.title() for part in operation.split('_'))
+            started_at = time.perf_counter()
+
+            try:
+                result = call_identity_store(operation, **kwargs)
+            except skipped_errors:
+                self.add('{}Skipped'.format(name))
+                raise
+            except Exception:
+                self.record_call(name, started_at)
+                self.add('{}Errors'.format(name))
+                raise
+
+            self.record_call(name, started_at)
+
+            return result
+
+        return instrumented_call
+
+    def record_call(self, name, started_at):
+
+        latency = (time.perf_counter() - started_at) * 1000
+
+        with self.lock:
+            self.values['{}Calls'.format(name)] += 1
+            self.units['{}Calls'.format(name)] = 'Count'
+            self.latencies['{}Latency'.format(name)].append(latency)
+
+    #Write the metrics of the invocation to the function logs
+    def publish(self, records, context):
+
+        self.add('Records', len(records))
+        self.add('OkRecords', len([record for record in records if record['result'] == 'Ok']))
+        self.add('DroppedRecords', len([record for record in records if record['result'] == 'Dropped']))
+
+        #The record data is measured in base64, as this is what counts towards the size limit of the invocation
+        self.add('BytesOut', sum(len(record['data']) for record in records if record['result'] == 'Ok'), 'Bytes')
+
+        #The hit ratio of each tier during this invocation
+        for tier, tier_stats in self.cache.stats().items():
+            tier_name = CACHE_TIER_NAMES.get(tier, tier.title())
+            hits = tier_stats['hits'] - self.cache_stats.get(tier, {}).get('hits', 0)
+            misses = tier_stats['misses'] - self.cache_stats.get(tier, {}).get('misses', 0)
+
+            errors = tier_stats.get('errors', 0) - self.cache_stats.get(tier, {}).get('errors', 0)
+
+            self.add('{}CacheHits'.format(tier_name), hits)
+            self.add('{}CacheMisses'.format(tier_name), misses)
+            self.add('{}CacheErrors'.format(tier_name), errors)
+
+            if hits + misses > 0:
+                self.add('{}CacheHitRatio'.format(tier_name), hits * 100 / (hits + misses), 'Percent')
+
+        self.add('BatchDuration', (time.perf_counter() - self.started_at) * 1000, 'Milliseconds')
+
+        #The context is not available when the function is run outside of Lambda
+        if context is not None:
+            self.add('RemainingTime', context.get_remaining_time_in_millis(), 'Milliseconds')
+
+        timestamp = int(time.time() * 1000)
+
+        #Slow batches can make hundreds of calls of one operation, so their latencies are split across as many documents as needed. The counts are only written in the first
+        latency_chunks = {
+            name: [latencies[position:position + MAX_METRIC_VALUES] for position in range(0, len(latencies), MAX_METRIC_VALUES)]
+            for name, latencies in self.latencies.items()
+        }
+
+        document_count = max([len(chunks) for chunks in latency_chunks.values()] + [1])
+
+        for document_position in range(document_count):
+            values = dict(self.values) if document_position == 0 else {}
+            units = dict(self.units) if document_position == 0 else {}
+
+            for name, chunks in latency_chunks.items():
+                if document_position < len(chunks):
+                    values[name] = chunks[document_position]
+                    units[name] = 'Milliseconds'
+
+            #Embedded metric format documents are read from standard output
+            print(json.dumps(self.create_document(timestamp, values, units)))
+
+    #Return an embedded metric format document of the given values
+    def create_document(self, timestamp, values, units):
+
+        document = {
+            '_aws': {
+                'Timestamp': timestamp,
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['FunctionName']],
+                    'Metrics': [{'Name': name, 'Unit': unit} for name, unit in units.items()]
+                }]
+            },
+            'FunctionName': self.function_name
+        }
+
+        document.update(values)
+
+        return document
+
+#Build the metrics from the environment variables set by the KinesisFirehose construct, returning None when they are disabled
+def create_metrics(cache):
+
+    if 'METRICS_NAMESPACE' not in os.environ:
+        return None
+
+    return BatchMetrics(
+        os.environ['METRICS_NAMESPACE'],
+        os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local'),
+        cache
+    )
@@ -0,0 +1,42 @@
+#The number of event IDs remembered by default, the memory used stays below roughly 250 bytes per ID
+DEFAULT_WINDOW = 100000
+
+#This class remembers the IDs of recently delivered events, along with the Firehose record that carried each one, so that redelivered copies can be dropped.
+#IDs are kept in two generations of half the window each, when the current generation is full the previous one is discarded, so memory stays flat however many events are processed
+class RecentEventIds:
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.generation_size = max(window // 2, 1)
+        self.current = {}
+        self.previous = {}
+
+    def __contains__(self, event_id):
+        return event_id in self.current or event_id in self.previous
+
+    #Return the ID of the record that carried the event, or None if it has not been seen recently
+    def get(self, event_id):
+        if event_id in self.current:
+            return self.current[event_id]
+
+        return self.previous.get(event_id)
+
+    #A copy is the same event carried by a different record. Firehose retries a batch with the same record IDs, so those records are not copies of themselves
+    def is_duplicate(self, event_id, record_id):
+        seen_record_id = self.get(event_id)
+
+        return seen_record_id is not None and seen_record_id != record_id
+
+    #Remember the events of a batch once it has been processed, given as a mapping of event ID to record ID
+    def update(self, event_records):
+        for event_id, record_id in event_records.items():
+            if event_id in self:
+                continue
+
+            if len(self.current) >= self.generation_size:
+                self.previous = self.current
+                self.current = {}
+
+            self.current[event_id] = record_id
+
+    def __len__(self):
+        return len(self.current) + len(self.previous)
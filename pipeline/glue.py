@@ -9,71 +9,225 @@ from cdk_nag import NagSuppressions
 from cdk_nag import NagPackSuppression
 import os
 
+#The name of the database and the table holding the processed events
+DATABASE_NAME = "codewhisperer_events"
+TABLE_NAME = "codewhispererevents"
+
+#The columns written by the Firehose transformation function. These are used as the schema when converting the events to Parquet
+EVENT_COLUMNS = [
+    ("event_time", "timestamp"),
+    ("account_id", "string"),
+    ("user_id", "string"),
+    ("identity_store_arn", "string"),
+    ("event_type", "string"),
+    ("programming_language", "string"),
+    ("user_name", "string"),
+    ("group_id", "string"),
+    ("group_name", "string"),
+    ("group_ids", "array<string>"),
+    ("group_names", "array<string>"),
+    ("enrichment_pending", "boolean"),
+    ("event_id", "string")
+]
+
+#The partitions created by the Firehose delivery prefix
+PARTITION_COLUMNS = [
+    ("year", "string"),
+    ("month", "string"),
+    ("day", "string")
+]
+
+#The partitions added when dynamic partitioning is enabled. These fields are removed from the events, as a partition cannot share its name with a column
+DYNAMIC_PARTITION_COLUMNS = [
+    ("account_id", "string"),
+    ("event_type", "string")
+]
+
+#The event types written by the Firehose transformation function
+EVENT_TYPES = ["CodeSuggestionInvocation", "SecurityScanInvocation"]
+
 class Glue(Construct):
     
     def __init__(
         self,
         scope: Construct,
         id_: str,
-        bucket: s3.IBucket
+        bucket: s3.IBucket,
+        output_format: str = "json",
+        dynamic_partitioning: bool = False,
+        account_ids: [] = None
     ):
         super().__init__(scope, id_)
         
-        #Create the Glue IAM Role and set relevant permissions
-        crawler_role = iam.Role(self, "GlueCrawlerRole",
-            assumed_by=iam.ServicePrincipal('glue.amazonaws.com')
-        )
+        self.database_name = DATABASE_NAME
+        self.table_name = TABLE_NAME
         
-        crawler_role.add_to_policy(
-            iam.PolicyStatement(
-                resources=["*"],
-                actions=[
-                    "glue:BatchCreatePartition",
-                    "glue:BatchGetPartition",
-                    "glue:CreateTable",
-                    "glue:GetDatabase",
-                    "glue:GetTable",
-                    "logs:PutLogEvents"
-                ]
+        #Create a Glue database which will be able to be queried in Amazon Athena
+        self.database = database = glue.CfnDatabase(self, "CodeWhispererEventsDatabase",
+            catalog_id=stack.of(self).account,
+            database_input=glue.CfnDatabase.DatabaseInputProperty(
+                name=DATABASE_NAME
             )
         )
         
-        #Allow Glue to interact with the CodeWhisperer events bucket
-        bucket.grant_read(crawler_role)
+        #JSON events keep the original event time string, Parquet events store it as a timestamp
+        columns = [(name, "string" if name == "event_time" and output_format != "parquet" else type_) for name, type_ in EVENT_COLUMNS]
+        partition_columns = list(PARTITION_COLUMNS)
         
-        NagSuppressions.add_resource_suppressions(
-            crawler_role,
-            [NagPackSuppression(id="AwsSolutions-IAM5", reason="IAM permissions restricted to this specific bucket, used for crawling the bucket")],
-            True
-        )
+        if dynamic_partitioning:
+            columns = [(name, type_) for name, type_ in columns if name not in dict(DYNAMIC_PARTITION_COLUMNS)]
+            partition_columns += DYNAMIC_PARTITION_COLUMNS
         
-        #Create a Glue database which will be able to be queried in Amazon Athena
-        database = glue.CfnDatabase(self, "CodeWhispererEventsDatabase",
-            catalog_id=stack.of(self).account,
-            database_input=glue.CfnDatabase.DatabaseInputProperty(
-                name="codewhisperer_events"
+        #Parquet output and dynamic partitioning need an explicit schema, so define the table rather than inferring it from a sample of the files.
+        #The table has the same name as the one the crawler creates for JSON events, so either option can only be chosen when the stack is first deployed
+        if output_format == "parquet" or dynamic_partitioning:
+            if output_format == "parquet":
+                table_parameters = {
+                    "classification": "parquet",
+                    "parquet.compression": "SNAPPY"
+                }
+                
+                storage_formats = {
+                    "input_format": "org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat",
+                    "output_format": "org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat",
+                    "serialization_library": "org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
+                }
+            else:
+                table_parameters = {
+                    "classification": "json",
+                    "compressionType": "gzip"
+                }
+                
+                storage_formats = {
+                    "input_format": "org.apache.hadoop.mapred.TextInputFormat",
+                    "output_format": "org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat",
+                    "serialization_library": "org.openx.data.jsonserde.JsonSerDe"
+                }
+            
+            #With dynamic partitioning Athena works out the partitions from the query using partition projection, so they never need to be crawled
+            if dynamic_partitioning:
+                if account_ids == None:
+                    account_ids = [stack.of(self).account]
+                
+                table_parameters.update({
+                    "projection.enabled": "true",
+                    "projection.year.type": "integer",
+                    "projection.year.range": "2023,2100",
+                    "projection.month.type": "integer",
+                    "projection.month.range": "1,12",
+                    "projection.month.digits": "2",
+                    "projection.day.type": "integer",
+                    "projection.day.range": "1,31",
+                    "projection.day.digits": "2",
+                    "projection.account_id.type": "enum",
+                    "projection.account_id.values": ",".join(account_ids),
+                    "projection.event_type.type": "enum",
+                    "projection.event_type.values": ",".join(EVENT_TYPES),
+                    "storage.location.template": "s3://{}/CodeWhispererEvents/year=${{year}}/month=${{month}}/day=${{day}}/account_id=${{account_id}}/event_type=${{event_type}}/".format(bucket.bucket_name)
+                })
+            
+            self.table = glue.CfnTable(self, "CodeWhispererEventsTable",
+                catalog_id=database.catalog_id,
+                database_name=DATABASE_NAME,
+                table_input=glue.CfnTable.TableInputProperty(
+                    name=TABLE_NAME,
+                    table_type="EXTERNAL_TABLE",
+                    parameters=table_parameters,
+                    partition_keys=[glue.CfnTable.ColumnProperty(name=name, type=type_) for name, type_ in partition_columns],
+                    storage_descriptor=glue.CfnTable.StorageDescriptorProperty(
+                        columns=[glue.CfnTable.ColumnProperty(name=name, type=type_) for name, type_ in columns],
+                        location="s3://{}/CodeWhispererEvents/".format(bucket.bucket_name),
+                        input_format=storage_formats["input_format"],
+                        output_format=storage_formats["output_format"],
+                        serde_info=glue.CfnTable.SerdeInfoProperty(
+                            serialization_library=storage_formats["serialization_library"]
+                        )
+                    )
+                )
             )
-        )
+            
+            self.table.add_dependency(database)
+        else:
+            self.table = None
         
-        #Create a Crawler to run once every 6 hours (UTC) to create a new partition for the day
-        crawler = glue.CfnCrawler(self, "CodeWhispererEventsCrawler",
-            role=crawler_role.role_arn,
-            targets=glue.CfnCrawler.TargetsProperty(
-                s3_targets=[glue.CfnCrawler.S3TargetProperty(
-                    #Do not scan the Errors folder
-                    exclusions=["Errors/**"],
-                    path="{}/CodeWhispererEvents/".format(bucket.bucket_name),
-                    sample_size=5
-                )]
-            ),
-            database_name="codewhisperer_events",
-            schedule=glue.CfnCrawler.ScheduleProperty(
-                schedule_expression="cron(0 */6 * * ? *)"
-            ),
-            recrawl_policy=glue.CfnCrawler.RecrawlPolicyProperty(
-                recrawl_behavior="CRAWL_NEW_FOLDERS_ONLY"
+        #Partition projection replaces the crawler, otherwise a crawler is needed to add each new partition
+        if not dynamic_partitioning:
+            #Create the Glue IAM Role and set relevant permissions
+            crawler_role = iam.Role(self, "GlueCrawlerRole",
+                assumed_by=iam.ServicePrincipal('glue.amazonaws.com')
             )
-        )
+            
+            crawler_role.add_to_policy(
+                iam.PolicyStatement(
+                    resources=["*"],
+                    actions=[
+                        "glue:BatchCreatePartition",
+                        "glue:BatchGetPartition",
+                        "glue:CreateTable",
+                        "glue:GetDatabase",
+                        "glue:GetTable",
+                        "glue:GetPartition",
+                        "glue:GetPartitions",
+                        "glue:UpdateTable",
+                        "glue:BatchUpdatePartition",
+                        "logs:PutLogEvents"
+                    ]
+                )
+            )
+            
+            #Allow Glue to interact with the CodeWhisperer events bucket
+            bucket.grant_read(crawler_role)
+            
+            NagSuppressions.add_resource_suppressions(
+                crawler_role,
+                [NagPackSuppression(id="AwsSolutions-IAM5", reason="IAM permissions restricted to this specific bucket, used for crawling the bucket")],
+                True
+            )
+            
+            if self.table != None:
+                #The crawler only needs to add the new partitions to the existing table
+                crawler_targets = glue.CfnCrawler.TargetsProperty(
+                    catalog_targets=[glue.CfnCrawler.CatalogTargetProperty(
+                        database_name=DATABASE_NAME,
+                        tables=[TABLE_NAME]
+                    )]
+                )
+                
+                #Crawlers using a catalog target must crawl everything and cannot delete from the table
+                recrawl_behavior = "CRAWL_EVERYTHING"
+                schema_change_policy = glue.CfnCrawler.SchemaChangePolicyProperty(
+                    delete_behavior="LOG",
+                    update_behavior="LOG"
+                )
+            else:
+                crawler_targets = glue.CfnCrawler.TargetsProperty(
+                    s3_targets=[glue.CfnCrawler.S3TargetProperty(
+                        #Do not scan the Errors folder
+                        exclusions=["Errors/**"],
+                        path="{}/CodeWhispererEvents/".format(bucket.bucket_name),
+                        sample_size=5
+                    )]
+                )
+                
+                recrawl_behavior = "CRAWL_NEW_FOLDERS_ONLY"
+                schema_change_policy = None
+            
+            #Create a Crawler to run once every 6 hours (UTC) to create a new partition for the day
+            crawler = glue.CfnCrawler(self, "CodeWhispererEventsCrawler",
+                role=crawler_role.role_arn,
+                targets=crawler_targets,
+                database_name=DATABASE_NAME,
+                schedule=glue.CfnCrawler.ScheduleProperty(
+                    schedule_expression="cron(0 */6 * * ? *)"
+                ),
+                recrawl_policy=glue.CfnCrawler.RecrawlPolicyProperty(
+                    recrawl_behavior=recrawl_behavior
+                ),
+                schema_change_policy=schema_change_policy
+            )
+            
+            if self.table != None:
+                crawler.add_dependency(self.table)
         
         glue.CfnDataCatalogEncryptionSettings(self, "MyCfnDataCatalogEncryptionSettings",
             catalog_id=database.catalog_id,
@@ -1,17 +1,60 @@
 from constructs import Construct
 from aws_cdk import (
+    aws_cloudwatch as cloudwatch,
+    aws_dynamodb as dynamodb,
+    aws_glue as glue,
     aws_kinesisfirehose as kinesisfirehose,
     aws_iam as iam,
     aws_lambda as lambda_,
     aws_s3 as s3,
+    aws_ssm as ssm,
+    BundlingOptions as bundling_options,
     Duration as duration,
+    ILocalBundling as local_bundling,
+    RemovalPolicy as removal_policy,
     Stack as stack
 )
 from cdk_nag import NagSuppressions
 from cdk_nag import NagPackSuppression
+import jsii
 import os
+import subprocess
+import sys
 from pathlib import Path
 
+#The maximum number of groups listed individually in the DescribeGroup policy statement
+MAX_GROUP_RESOURCES = 50
+
+#Lambda environment variables are limited to 4KB in total, longer lists of group IDs are stored in a parameter instead
+MAX_GROUP_IDS_ENVIRONMENT_LENGTH = 2048
+
+#The namespace the transformation function publishes its metrics to, when enabled
+METRICS_NAMESPACE = "CodeWhispererUsageAnalyzer"
+
+#The remaining time, in milliseconds, below which a batch is considered close to the function timeout
+LOW_REMAINING_TIME_THRESHOLD = 10000
+
+#Install wheels for the runtime and architecture of the transformation function, whatever machine the layer is built on. Dependencies such as botocore come from the Lambda runtime
+PIP_INSTALL_OPTIONS = ["--no-deps", "--only-binary=:all:", "--platform", "manylinux2014_aarch64", "--implementation", "cp", "--python-version", "3.11"]
+
+#Install the requirements of a layer with the local pip, so Docker is only needed to bundle the layer when pip is unavailable
+@jsii.implements(local_bundling)
+class PipLocalBundling:
+    
+    def __init__(self, requirements_path: str):
+        self.requirements_path = requirements_path
+    
+    def try_bundle(self, output_dir, options):
+        try:
+            subprocess.run(
+                [sys.executable, "-m", "pip", "install", "--quiet", "-r", self.requirements_path, "--target", os.path.join(output_dir, "python")] + PIP_INSTALL_OPTIONS,
+                check=True
+            )
+        except (OSError, subprocess.CalledProcessError):
+            return False
+        
+        return True
+
 class KinesisFirehose(Construct):
     
     def __init__(
@@ -20,7 +63,23 @@ class KinesisFirehose(Construct):
         id_: str,
         bucket: s3.IBucket,
         group_ids: [],
-        sso_region: str
+        sso_region: str,
+        sso_lookup_concurrency: int = None,
+        sso_lookup_safety_margin: int = None,
+        identity_cache_ttl: int = None,
+        identity_cache_negative_ttl: int = None,
+        shared_identity_cache: bool = False,
+        record_all_groups: bool = False,
+        group_directory: bool = False,
+        group_directory_refresh_interval: int = None,
+        group_directory_sweep_timeout: int = None,
+        output_format: str = "json",
+        glue_table: glue.CfnTable = None,
+        dynamic_partitioning: bool = False,
+        metrics: bool = False,
+        provisioned_concurrency: int = None,
+        deduplication_window: int = None,
+        direct_delivery: bool = False
     ):
         super().__init__(scope, id_)
         
@@ -31,83 +90,315 @@ class KinesisFirehose(Construct):
         
         bucket.grant_read_write(firehose_role, "*")
         
-        environment_variables = {
-            'SSO_GROUP_IDS': ','.join(group_ids)
-        }
-        
-        if sso_region != None:
-            environment_variables['SSO_REGION'] = sso_region
-        
-        #Create the Lambda function that will be used for processing
-        transformer_function = lambda_.Function(self, "FirehoseTransformationLambda",
-            code=lambda_.Code.from_asset(os.path.join(Path.cwd(), "pipeline", "firehose_transformation")),
-            handler="index.lambda_handler",
-            runtime=lambda_.Runtime.PYTHON_3_11,
-            architecture=lambda_.Architecture.ARM_64,
-            environment=environment_variables,
-            #This should be more than enough for the majority of usecases. Results are cached in the function so lookups and processing should be fast
-            memory_size=512,
-            timeout=duration.seconds(60),
-            tracing=lambda_.Tracing.ACTIVE
-        )
-        
-        #Allow the function to be invoked by Firehose
-        transformer_function.grant_invoke(firehose_role)
-        
-        NagSuppressions.add_resource_suppressions(
-            transformer_function,
-            [NagPackSuppression(id="AwsSolutions-IAM4", reason="Default policy contains required permissions for Lambda to function such as writing logs")],
-            True
-        )
-
-        NagSuppressions.add_resource_suppressions(
-            transformer_function,
-            [NagPackSuppression(id="AwsSolutions-IAM5", reason="IAM permissions managed by L2 Lambda construct")],
-            True
-        )
-
         NagSuppressions.add_resource_suppressions(
             firehose_role,
             [NagPackSuppression(id="AwsSolutions-IAM5", reason="IAM permissions restricted to this specific bucket, used for pushing events into")],
             True
         )
+        
+        #With direct delivery the EventBridge rules write the records themselves, so no transformation function is created
+        transformer_function = None
+        
+        if not direct_delivery:
+            environment_variables = {
+                'SSO_GROUP_IDS': ','.join(group_ids)
+            }
+            
+            group_ids_parameter = None
+            
+            if len(environment_variables['SSO_GROUP_IDS']) > MAX_GROUP_IDS_ENVIRONMENT_LENGTH:
+                group_ids_parameter = ssm.StringParameter(self, "SSOGroupIdsParameter",
+                    string_value=environment_variables.pop('SSO_GROUP_IDS'),
+                    #Advanced parameters allow values of up to 8KB
+                    tier=ssm.ParameterTier.ADVANCED
+                )
+                
+                environment_variables['SSO_GROUP_IDS_PARAMETER'] = group_ids_parameter.parameter_name
+            
+            if sso_region != None:
+                environment_variables['SSO_REGION'] = sso_region
+            
+            #The number of users the function looks up concurrently when a batch contains several uncached users
+            if sso_lookup_concurrency != None:
+                environment_variables['SSO_LOOKUP_CONCURRENCY'] = str(sso_lookup_concurrency)
+            
+            #The number of seconds before the function times out at which lookups stop and the remaining records are marked for enrichment later
+            if sso_lookup_safety_margin != None:
+                environment_variables['SSO_LOOKUP_SAFETY_MARGIN'] = str(sso_lookup_safety_margin)
+            
+            #The number of seconds user and group details are cached before being looked up again
+            if identity_cache_ttl != None:
+                environment_variables['IDENTITY_CACHE_TTL'] = str(identity_cache_ttl)
+            
+            #The number of seconds a user outside every group is cached before their membership is checked again
+            if identity_cache_negative_ttl != None:
+                environment_variables['IDENTITY_CACHE_NEGATIVE_TTL'] = str(identity_cache_negative_ttl)
+            
+            #Record every group a user is a member of, rather than only the first
+            if record_all_groups:
+                environment_variables['SSO_RECORD_ALL_GROUPS'] = 'true'
+            
+            #Fetch the names and members of every group up front rather than checking each users membership
+            if group_directory:
+                environment_variables['SSO_GROUP_DIRECTORY'] = 'true'
+                
+                if group_directory_refresh_interval != None:
+                    environment_variables['SSO_GROUP_DIRECTORY_REFRESH_INTERVAL'] = str(group_directory_refresh_interval)
+                
+                if group_directory_sweep_timeout != None:
+                    environment_variables['SSO_GROUP_DIRECTORY_SWEEP_TIMEOUT'] = str(group_directory_sweep_timeout)
+            
+            #Parquet output needs the event time in a format the JSON deserializer reads as a timestamp
+            if output_format == "parquet":
+                environment_variables['OUTPUT_FORMAT'] = output_format
+            
+            #With dynamic partitioning the function returns the partition of each event in the record metadata
+            if dynamic_partitioning:
+                environment_variables['DYNAMIC_PARTITIONING'] = 'true'
+            
+            #The number of recent event IDs each container remembers to drop events delivered more than once
+            if deduplication_window != None:
+                environment_variables['DEDUPLICATION_WINDOW'] = str(deduplication_window)
+            
+            #Publish the performance of each batch as CloudWatch metrics
+            if metrics:
+                environment_variables['METRICS_NAMESPACE'] = METRICS_NAMESPACE
+            
+            #Create a table to share the cached user and group details between Lambda containers. Only required when SSO details are looked up
+            identity_cache_table = None
+            
+            if shared_identity_cache and len(group_ids) > 0:
+                identity_cache_table = dynamodb.Table(self, "IdentityCacheTable",
+                    partition_key=dynamodb.Attribute(
+                        name="cache_key",
+                        type=dynamodb.AttributeType.STRING
+                    ),
+                    billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+                    #Expired entries are removed by DynamoDB, the function also checks the expiry when reading
+                    time_to_live_attribute="expires_at",
+                    point_in_time_recovery=True,
+                    #The table only contains cached values which can be looked up again
+                    removal_policy=removal_policy.DESTROY
+                )
+                
+                environment_variables['IDENTITY_CACHE_TABLE'] = identity_cache_table.table_name
+            
+            #Create the Lambda function that will be used for processing
+            transformer_function = lambda_.Function(self, "FirehoseTransformationLambda",
+                code=lambda_.Code.from_asset(os.path.join(Path.cwd(), "pipeline", "firehose_transformation")),
+                handler="index.lambda_handler",
+                runtime=lambda_.Runtime.PYTHON_3_11,
+                architecture=lambda_.Architecture.ARM_64,
+                environment=environment_variables,
+                #This should be more than enough for the majority of usecases. Results are cached in the function so lookups and processing should be fast
+                memory_size=512,
+                timeout=duration.seconds(60),
+                tracing=lambda_.Tracing.ACTIVE
+            )
+            
+            #Record each phase of a batch as an X-Ray subsegment, the X-Ray SDK is provided in a layer as it is only needed with metrics
+            if metrics:
+                xray_sdk_path = os.path.join(Path.cwd(), "pipeline", "xray_sdk_layer")
+                
+                transformer_function.add_layers(lambda_.LayerVersion(self, "XRaySDKLayer",
+                    code=lambda_.Code.from_asset(xray_sdk_path,
+                        bundling=bundling_options(
+                            image=lambda_.Runtime.PYTHON_3_11.bundling_image,
+                            command=["bash", "-c", " ".join(["pip", "install", "-r", "requirements.txt", "--target", "/asset-output/python"] + PIP_INSTALL_OPTIONS)],
+                            local=PipLocalBundling(os.path.join(xray_sdk_path, "requirements.txt"))
+                        )
+                    ),
+                    compatible_runtimes=[lambda_.Runtime.PYTHON_3_11],
+                    compatible_architectures=[lambda_.Architecture.ARM_64]
+                ))
+            
+            #If requested keep a number of containers initialised, so bursts of events do not wait for new containers to start. Firehose invokes an alias as provisioned concurrency is configured on a version
+            if provisioned_concurrency != None:
+                processor_function = lambda_.Alias(self, "FirehoseTransformationAlias",
+                    alias_name="live",
+                    version=transformer_function.current_version,
+                    provisioned_concurrent_executions=int(provisioned_concurrency)
+                )
+            else:
+                processor_function = transformer_function
+            
+            #Allow the function to be invoked by Firehose
+            processor_function.grant_invoke(firehose_role)
+            
+            #Allow the function to read the group IDs when they are stored in a parameter
+            if group_ids_parameter != None:
+                group_ids_parameter.grant_read(transformer_function)
+            
+            #Allow the function to read and write the shared identity cache
+            if identity_cache_table != None:
+                identity_cache_table.grant_read_write_data(transformer_function)
+            
+            NagSuppressions.add_resource_suppressions(
+                transformer_function,
+                [NagPackSuppression(id="AwsSolutions-IAM4", reason="Default policy contains required permissions for Lambda to function such as writing logs")],
+                True
+            )
 
+            NagSuppressions.add_resource_suppressions(
+                transformer_function,
+                [NagPackSuppression(id="AwsSolutions-IAM5", reason="IAM permissions managed by L2 Lambda construct")],
+                True
+            )
+            
+            #Check if SSO Group IDs were passed in context. If they were then add permissions to read the user details and groups.
+            if len(group_ids) > 0:
+                transformer_function.add_to_role_policy(
+                        iam.PolicyStatement(
+                        resources=[
+                            "*"
+                        ],
+                        actions=[
+                            "identitystore:DescribeUser",
+    				        "identitystore:IsMemberInGroups"
+                        ]
+                    )
+                )
+                
+                group_resources = [
+                    "arn:aws:identitystore::{}:identitystore/*".format(stack.of(self).account)
+                ]
+                
+                #Large lists of groups would exceed the maximum size of the role policy, so allow every group instead
+                if len(group_ids) > MAX_GROUP_RESOURCES:
+                    group_resources.append("arn:aws:identitystore:::group/*")
+                else:
+                    for group_id in group_ids:
+                        group_resources.append("arn:aws:identitystore:::group/{}".format(group_id))
+                
+                transformer_function.add_to_role_policy(
+                        iam.PolicyStatement(
+                        resources=group_resources,
+                        actions=[
+    				        "identitystore:DescribeGroup"
+                        ]
+                    )
+                )
+                
+                #The group directory lists the members of each group
+                if group_directory:
+                    transformer_function.add_to_role_policy(
+                            iam.PolicyStatement(
+                            resources=group_resources,
+                            actions=[
+                                "identitystore:ListGroupMemberships"
+                            ]
+                        )
+                    )
+                
+                NagSuppressions.add_resource_suppressions(
+                    transformer_function,
+                    [NagPackSuppression(id="AwsSolutions-IAM5", reason="Wildcards are unavoidable as it needs to cover all users and groups to extract information")],
+                    True
+                )
         
-        #Check if SSO Group IDs were passed in context. If they were then add permissions to read the user details and groups.
-        if len(group_ids) > 0:
-            transformer_function.add_to_role_policy(
-                    iam.PolicyStatement(
+        #If Parquet output was requested convert each record using the schema of the Glue table, otherwise write GZIP compressed JSON lines
+        if output_format == "parquet":
+            #Allow Firehose to read the schema from the Glue table
+            firehose_role.add_to_policy(
+                iam.PolicyStatement(
                     resources=[
-                        "*"
+                        "arn:aws:glue:{}:{}:catalog".format(stack.of(self).region, stack.of(self).account),
+                        "arn:aws:glue:{}:{}:database/{}".format(stack.of(self).region, stack.of(self).account, glue_table.database_name),
+                        "arn:aws:glue:{}:{}:table/{}/{}".format(stack.of(self).region, stack.of(self).account, glue_table.database_name, glue_table.ref)
                     ],
                     actions=[
-                        "identitystore:DescribeUser",
-				        "identitystore:IsMemberInGroups"
+                        "glue:GetTable",
+                        "glue:GetTableVersion",
+                        "glue:GetTableVersions"
                     ]
                 )
             )
             
-            group_resources = [
-                "arn:aws:identitystore::{}:identitystore/*".format(stack.of(self).account)
-            ]
-            
-            for group_id in group_ids:
-                group_resources.append("arn:aws:identitystore:::group/{}".format(group_id))
-            
-            transformer_function.add_to_role_policy(
-                    iam.PolicyStatement(
-                    resources=group_resources,
-                    actions=[
-				        "identitystore:DescribeGroup"
-                    ]
+            data_format_conversion_configuration = kinesisfirehose.CfnDeliveryStream.DataFormatConversionConfigurationProperty(
+                enabled=True,
+                input_format_configuration=kinesisfirehose.CfnDeliveryStream.InputFormatConfigurationProperty(
+                    deserializer=kinesisfirehose.CfnDeliveryStream.DeserializerProperty(
+                        #With direct delivery the event time is written as CloudTrail records it, rather than converted by the function
+                        hive_json_ser_de=kinesisfirehose.CfnDeliveryStream.HiveJsonSerDeProperty(
+                            timestamp_formats=["yyyy-MM-dd'T'HH:mm:ss'Z'"] if direct_delivery else None
+                        )
+                    )
+                ),
+                output_format_configuration=kinesisfirehose.CfnDeliveryStream.OutputFormatConfigurationProperty(
+                    serializer=kinesisfirehose.CfnDeliveryStream.SerializerProperty(
+                        parquet_ser_de=kinesisfirehose.CfnDeliveryStream.ParquetSerDeProperty(
+                            compression="SNAPPY"
+                        )
+                    )
+                ),
+                schema_configuration=kinesisfirehose.CfnDeliveryStream.SchemaConfigurationProperty(
+                    catalog_id=stack.of(self).account,
+                    database_name=glue_table.database_name,
+                    table_name=glue_table.ref,
+                    region=stack.of(self).region,
+                    role_arn=firehose_role.role_arn,
+                    version_id="LATEST"
                 )
             )
             
-            NagSuppressions.add_resource_suppressions(
-                transformer_function,
-                [NagPackSuppression(id="AwsSolutions-IAM5", reason="Wildcards are unavoidable as it needs to cover all users and groups to extract information")],
-                True
+            #Parquet files are compressed by the serializer, and format conversion requires a buffer of at least 64MB
+            compression_format = "UNCOMPRESSED"
+            buffering_size = 64
+        else:
+            data_format_conversion_configuration = None
+            compression_format = "GZIP"
+            buffering_size = 10
+        
+        #Dynamic partitioning groups the events by their own date, account and event type rather than the time they arrived in Firehose
+        if dynamic_partitioning:
+            dynamic_partitioning_configuration = kinesisfirehose.CfnDeliveryStream.DynamicPartitioningConfigurationProperty(
+                enabled=True,
+                retry_options=kinesisfirehose.CfnDeliveryStream.RetryOptionsProperty(
+                    duration_in_seconds=300
+                )
             )
+            
+            #The partition keys are returned by the function, or with direct delivery extracted from each record by Firehose
+            partition_key_source = "partitionKeyFromQuery" if direct_delivery else "partitionKeyFromLambda"
+            prefix = "CodeWhispererEvents/year=!{{{0}:year}}/month=!{{{0}:month}}/day=!{{{0}:day}}/account_id=!{{{0}:account_id}}/event_type=!{{{0}:event_type}}/".format(partition_key_source)
+            
+            #Dynamic partitioning requires a buffer of at least 64MB
+            buffering_size = max(buffering_size, 64)
+        else:
+            dynamic_partitioning_configuration = None
+            prefix = "CodeWhispererEvents/year=!{timestamp:yyyy}/month=!{timestamp:MM}/day=!{timestamp:dd}/"
+        
+        #Include a Lambda processor to remove unneeded data and enrich with SSO data (where groups IDs were supplied)
+        if not direct_delivery:
+            processors = [kinesisfirehose.CfnDeliveryStream.ProcessorProperty(
+                type="Lambda",
+                parameters=[kinesisfirehose.CfnDeliveryStream.ProcessorParameterProperty(
+                    parameter_name="LambdaArn",
+                    parameter_value=processor_function.function_arn
+                )]
+            )]
+        #Otherwise the records are already in their final format, so Firehose only extracts the partition keys and separates the records with a newline as the function does
+        else:
+            processors = []
+            
+            if dynamic_partitioning:
+                processors.append(kinesisfirehose.CfnDeliveryStream.ProcessorProperty(
+                    type="MetadataExtraction",
+                    parameters=[
+                        kinesisfirehose.CfnDeliveryStream.ProcessorParameterProperty(
+                            parameter_name="MetadataExtractionQuery",
+                            parameter_value="{year: .event_time[0:4], month: .event_time[5:7], day: .event_time[8:10], account_id: .account_id, event_type: .event_type}"
+                        ),
+                        kinesisfirehose.CfnDeliveryStream.ProcessorParameterProperty(
+                            parameter_name="JsonParsingEngine",
+                            parameter_value="JQ-1.6"
+                        )
+                    ]
+                ))
+            
+            processors.append(kinesisfirehose.CfnDeliveryStream.ProcessorProperty(
+                type="AppendDelimiterToRecord"
+            ))
         
         #Create a Kinesis Data Firehose stream that will publish to an S3 bucket
         self.stream = kinesisfirehose.CfnDeliveryStream(self, "KinesisFirehoseStream",
@@ -121,22 +412,139 @@ class KinesisFirehose(Construct):
                 #Buffer every 5 minutes to avoid creating large volumes of small files
                 buffering_hints=kinesisfirehose.CfnDeliveryStream.BufferingHintsProperty(
                     interval_in_seconds=300,
-                    size_in_m_bs=10
+                    size_in_m_bs=buffering_size
                 ),
-                compression_format="GZIP",
+                compression_format=compression_format,
+                data_format_conversion_configuration=data_format_conversion_configuration,
                 #Prefix the processed events and errors using Year, Month and Day. This allows partitioning to maximise Athena performance
                 error_output_prefix="Errors/!{firehose:error-output-type}/year=!{timestamp:yyyy}/month=!{timestamp:MM}/day=!{timestamp:dd}/",
-                prefix="CodeWhispererEvents/year=!{timestamp:yyyy}/month=!{timestamp:MM}/day=!{timestamp:dd}/",
-                #Include a Lambda processor to remove unneeded data and enrich with SSO data (where groups IDs were supplied)
+                prefix=prefix,
+                dynamic_partitioning_configuration=dynamic_partitioning_configuration,
                 processing_configuration=kinesisfirehose.CfnDeliveryStream.ProcessingConfigurationProperty(
                     enabled=True,
-                    processors=[kinesisfirehose.CfnDeliveryStream.ProcessorProperty(
-                        type="Lambda",
-                        parameters=[kinesisfirehose.CfnDeliveryStream.ProcessorParameterProperty(
-                            parameter_name="LambdaArn",
-                            parameter_value=transformer_function.function_arn
-                        )]
-                    )]
+                    processors=processors
+                )
+            )
+        )
+        
+        #Make sure the role can read the schema and write to the bucket before the stream is created
+        self.stream.node.add_dependency(firehose_role)
+        
+        #If metrics are enabled create a dashboard and alarms for the transformation function and stream
+        if metrics and transformer_function != None:
+            self.create_dashboard(transformer_function, len(group_ids) > 0, identity_cache_table != None, group_directory)
+    
+    #Create a dashboard of the batch metrics published by the transformation function, and alarms for failed or slow batches
+    def create_dashboard(self, transformer_function: lambda_.IFunction, sso_enrichment: bool, shared_identity_cache: bool, group_directory: bool):
+        
+        def batch_metric(metric_name, statistic="Sum"):
+            return cloudwatch.Metric(
+                namespace=METRICS_NAMESPACE,
+                metric_name=metric_name,
+                dimensions_map={
+                    "FunctionName": transformer_function.function_name
+                },
+                statistic=statistic,
+                period=duration.minutes(5)
+            )
+        
+        def stream_metric(metric_name, statistic="Sum"):
+            return cloudwatch.Metric(
+                namespace="AWS/Firehose",
+                metric_name=metric_name,
+                dimensions_map={
+                    "DeliveryStreamName": self.stream.ref
+                },
+                statistic=statistic,
+                period=duration.minutes(5)
+            )
+        
+        dashboard = cloudwatch.Dashboard(self, "TransformationDashboard")
+        
+        dashboard.add_widgets(
+            cloudwatch.GraphWidget(
+                title="Records",
+                left=[batch_metric(name) for name in ["Records", "OkRecords", "DroppedRecords", "DuplicateRecords"]]
+            ),
+            cloudwatch.GraphWidget(
+                title="Bytes",
+                left=[batch_metric(name) for name in ["BytesIn", "BytesOut"]]
+            ),
+            cloudwatch.GraphWidget(
+                title="Batch Duration (p99)",
+                left=[batch_metric(name, "p99") for name in ["BatchDuration", "DecodeDuration", "LookupDuration", "EncodeDuration"]],
+                right=[batch_metric("RemainingTime", "Minimum")]
+            )
+        )
+        
+        #The identity store is only called when groups are configured
+        if sso_enrichment:
+            cache_tiers = ["Memory"]
+            
+            if shared_identity_cache:
+                cache_tiers.append("DynamoDB")
+            
+            operations = ["DescribeUser", "IsMemberInGroups", "DescribeGroup"]
+            
+            if group_directory:
+                operations.append("ListGroupMemberships")
+            
+            dashboard.add_widgets(
+                cloudwatch.GraphWidget(
+                    title="Cache Hit Ratio",
+                    left=[batch_metric("{}CacheHitRatio".format(tier), "Average") for tier in cache_tiers],
+                    right=[batch_metric("{}CacheErrors".format(tier)) for tier in cache_tiers[1:]]
+                ),
+                cloudwatch.GraphWidget(
+                    title="Identity Store Calls",
+                    left=[batch_metric("{}Calls".format(operation)) for operation in operations],
+                    right=[batch_metric("IdentityStoreThrottles"), batch_metric("UnresolvedUsers")] + [batch_metric("{}Skipped".format(operation)) for operation in operations]
+                ),
+                cloudwatch.GraphWidget(
+                    title="Identity Store Latency (p99)",
+                    left=[batch_metric("{}Latency".format(operation), "p99") for operation in operations]
                 )
             )
-        )
\ No newline at end of file
+        
+        dashboard.add_widgets(
+            cloudwatch.GraphWidget(
+                title="Transformation Function",
+                left=[transformer_function.metric_invocations(), transformer_function.metric_errors(), transformer_function.metric_throttles()]
+            ),
+            cloudwatch.GraphWidget(
+                title="Processing",
+                left=[stream_metric("ExecuteProcessing.Success", "Average")],
+                right=[stream_metric("ExecuteProcessing.Duration", "Average")]
+            ),
+            cloudwatch.GraphWidget(
+                title="Delivery Freshness (seconds)",
+                left=[stream_metric("DeliveryToS3.DataFreshness", "Maximum")]
+            )
+        )
+        
+        #Failed batches are retried by Firehose and then written to the Errors folder
+        cloudwatch.Alarm(self, "TransformationErrorsAlarm",
+            metric=transformer_function.metric_errors(period=duration.minutes(5)),
+            threshold=1,
+            evaluation_periods=1,
+            comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_OR_EQUAL_TO_THRESHOLD,
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING
+        )
+        
+        #Batches finishing close to the function timeout are at risk of timing out as the number of users grows
+        cloudwatch.Alarm(self, "LowRemainingTimeAlarm",
+            metric=batch_metric("RemainingTime", "Minimum"),
+            threshold=LOW_REMAINING_TIME_THRESHOLD,
+            evaluation_periods=1,
+            comparison_operator=cloudwatch.ComparisonOperator.LESS_THAN_THRESHOLD,
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING
+        )
+        
+        #Events are buffered for up to 5 minutes, data older than 15 minutes means delivery is falling behind
+        cloudwatch.Alarm(self, "DeliveryFreshnessAlarm",
+            metric=stream_metric("DeliveryToS3.DataFreshness", "Maximum"),
+            threshold=900,
+            evaluation_periods=3,
+            comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING
+        )
@@ -0,0 +1,160 @@
+from constructs import Construct
+from aws_cdk import (
+    aws_events as events,
+    aws_events_targets as events_targets,
+    aws_glue as glue,
+    aws_iam as iam,
+    aws_lambda as lambda_,
+    aws_s3 as s3,
+    Duration as duration,
+    Stack as stack
+)
+from cdk_nag import NagSuppressions
+from cdk_nag import NagPackSuppression
+from pipeline.athena import RESULTS_PREFIX, WORKGROUP_NAME
+from tools.compact import COMPACTED_PREFIX
+import os
+from pathlib import Path
+
+#The folder in the events bucket the rollup tables are stored in
+ROLLUPS_PREFIX = "Rollups/"
+
+#The columns of each rollup table, these match the queries in the daily_rollups function
+ROLLUP_TABLES = {
+    "daily_usage": [
+        ("account_id", "string"),
+        ("user_id", "string"),
+        ("user_name", "string"),
+        ("group_name", "string"),
+        ("programming_language", "string"),
+        ("event_type", "string"),
+        ("event_count", "bigint")
+    ],
+    "daily_user_sketches": [
+        ("group_name", "string"),
+        ("users_sketch", "binary"),
+        ("user_count", "bigint")
+    ]
+}
+
+class Rollups(Construct):
+
+    def __init__(
+        self,
+        scope: Construct,
+        id_: str,
+        bucket: s3.IBucket,
+        database: glue.CfnDatabase,
+        database_name: str,
+        events_table_name: str,
+        deduplicate_events: bool = False,
+        compacted_events: bool = False
+    ):
+        super().__init__(scope, id_)
+
+        #Create a Parquet table for each rollup, partitioned by the day of the events
+        for table_name, columns in ROLLUP_TABLES.items():
+            table = glue.CfnTable(self, "{}Table".format(table_name.title().replace("_", "")),
+                catalog_id=stack.of(self).account,
+                database_name=database_name,
+                table_input=glue.CfnTable.TableInputProperty(
+                    name=table_name,
+                    table_type="EXTERNAL_TABLE",
+                    parameters={
+                        "classification": "parquet",
+                        "parquet.compression": "SNAPPY"
+                    },
+                    partition_keys=[glue.CfnTable.ColumnProperty(name=name, type="string") for name in ["year", "month", "day"]],
+                    storage_descriptor=glue.CfnTable.StorageDescriptorProperty(
+                        columns=[glue.CfnTable.ColumnProperty(name=name, type=type_) for name, type_ in columns],
+                        location="s3://{}/{}{}/".format(bucket.bucket_name, ROLLUPS_PREFIX, table_name),
+                        input_format="org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat",
+                        output_format="org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat",
+                        serde_info=glue.CfnTable.SerdeInfoProperty(
+                            serialization_library="org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
+                        )
+                    )
+                )
+            )
+
+            table.add_dependency(database)
+
+        #Create the Lambda function that runs the rollup queries
+        rollup_function = lambda_.Function(self, "DailyRollupsLambda",
+            code=lambda_.Code.from_asset(os.path.join(Path.cwd(), "pipeline", "daily_rollups")),
+            handler="index.lambda_handler",
+            runtime=lambda_.Runtime.PYTHON_3_11,
+            architecture=lambda_.Architecture.ARM_64,
+            environment={
+                'DATABASE_NAME': database_name,
+                'EVENTS_TABLE_NAME': events_table_name,
+                'BUCKET_NAME': bucket.bucket_name,
+                'ROLLUPS_PREFIX': ROLLUPS_PREFIX,
+                #The queries run in the workgroup of the reports, which sets where their results are written
+                'WORKGROUP_NAME': WORKGROUP_NAME,
+                #Count each event once even if it was delivered more than once
+                'DEDUPLICATE_EVENTS': str(deduplicate_events).lower()
+            },
+            #The function waits for the Athena queries to complete, which scan one day of events each
+            memory_size=256,
+            timeout=duration.minutes(15),
+            tracing=lambda_.Tracing.ACTIVE
+        )
+
+        #Athena runs the queries using the permissions of the function, so it needs to read the events and write the rollups and results
+        bucket.grant_read(rollup_function, "CodeWhispererEvents/*")
+
+        #Once a day has been compacted the partition of the events table points at the compacted files instead
+        if compacted_events:
+            bucket.grant_read(rollup_function, "{}/*".format(COMPACTED_PREFIX))
+
+        bucket.grant_read_write(rollup_function, "{}*".format(ROLLUPS_PREFIX))
+        bucket.grant_read_write(rollup_function, "{}*".format(RESULTS_PREFIX))
+        bucket.grant_delete(rollup_function, "{}*".format(ROLLUPS_PREFIX))
+
+        rollup_function.add_to_role_policy(
+            iam.PolicyStatement(
+                resources=[
+                    "arn:aws:athena:{}:{}:workgroup/{}".format(stack.of(self).region, stack.of(self).account, WORKGROUP_NAME)
+                ],
+                actions=[
+                    "athena:StartQueryExecution",
+                    "athena:GetQueryExecution"
+                ]
+            )
+        )
+
+        rollup_function.add_to_role_policy(
+            iam.PolicyStatement(
+                resources=[
+                    "arn:aws:glue:{}:{}:catalog".format(stack.of(self).region, stack.of(self).account),
+                    "arn:aws:glue:{}:{}:database/{}".format(stack.of(self).region, stack.of(self).account, database_name),
+                    "arn:aws:glue:{}:{}:table/{}/*".format(stack.of(self).region, stack.of(self).account, database_name)
+                ],
+                actions=[
+                    "glue:GetDatabase",
+                    "glue:GetTable",
+                    "glue:GetPartition",
+                    "glue:GetPartitions",
+                    "glue:BatchGetPartition",
+                    "glue:CreatePartition",
+                    "glue:BatchCreatePartition"
+                ]
+            )
+        )
+
+        NagSuppressions.add_resource_suppressions(
+            rollup_function,
+            [
+                NagPackSuppression(id="AwsSolutions-IAM4", reason="Default policy contains required permissions for Lambda to function such as writing logs"),
+                NagPackSuppression(id="AwsSolutions-IAM5", reason="IAM permissions restricted to the prefixes of this bucket and the tables of this database, used to run the rollup queries")
+            ],
+            True
+        )
+
+        #Roll up the previous days once a day, after Firehose has delivered the last of the previous days events
+        rule = events.Rule(self, "DailyRollupsSchedule",
+            schedule=events.Schedule.cron(minute="30", hour="0")
+        )
+
+        rule.add_target(events_targets.LambdaFunction(rollup_function))
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import aws_cdk as cdk
+import pytest
+from aws_cdk.assertions import Template
+
+from pipeline.code_whisperer_professional_edition_analysis_stack import CodeWhispererProfessionalEditionAnalysisStack
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+#The tests reuse the synthetic events, stubbed identity store and module loader of the benchmarks, which import each other by name
+sys.path.insert(0, os.path.join(REPO_ROOT, 'benchmarks'))
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+#Synthesize the stack with the given context flags. The function code is packaged from the working directory, and asset bundling is skipped as only the template is checked
+@pytest.fixture
+def synth(monkeypatch):
+
+    monkeypatch.chdir(REPO_ROOT)
+
+    def synth_template(context):
+        app = cdk.App(context=dict(context, **{'aws:cdk:bundling-stacks': []}))
+        stack = CodeWhispererProfessionalEditionAnalysisStack(app, 'CodeWhispererProfessionalEditionAnalysisStack',
+            env=cdk.Environment(account='111122223333', region='us-east-1')
+        )
+
+        return Template.from_stack(stack)
+
+    return synth_template
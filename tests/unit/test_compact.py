@@ -0,0 +1,98 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from tools import compact
+from tools.compact import COMPACTED_PREFIX, MANIFEST_NAME, compact_partition, list_live_files, read_lines
+from tools.layout import EVENTS_PREFIX, partition_folder, partition_path
+
+DAY = {'year': '2023', 'month': '08', 'day': '01'}
+
+#Records the partition locations the compaction switches the table to
+class StubCatalog:
+
+    def __init__(self):
+        self.locations = []
+
+    def set_location(self, partition_keys, location):
+        self.locations.append(location)
+
+def write_events(location, file_name, event_ids):
+
+    path = os.path.join(location, partition_path(DAY), file_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with gzip.open(path, 'wb') as output:
+        output.writelines((json.dumps({'event_id': event_id, 'user_id': 'user-1'}) + "\n").encode('utf-8') for event_id in event_ids)
+
+    return path
+
+def read_event_ids(location):
+
+    return sorted(json.loads(line)['event_id'] for line in read_lines(list_live_files(location, partition_folder(DAY))))
+
+def list_tree(location):
+
+    return sorted(os.path.relpath(os.path.join(folder, file_name), location) for folder, _, file_names in os.walk(location) for file_name in file_names)
+
+def test_second_run_changes_nothing(tmp_path):
+
+    location = str(tmp_path)
+    write_events(location, 'events-1.gz', ['event-1', 'event-2'])
+    write_events(location, 'events-2.gz', ['event-3'])
+
+    catalog = StubCatalog()
+    first = compact_partition(location, DAY, catalog)
+    files = {path: os.stat(os.path.join(location, path)).st_mtime_ns for path in list_tree(location)}
+
+    second = compact_partition(location, DAY, catalog)
+
+    assert second == first
+    assert first['events'] == 3
+    assert {path: os.stat(os.path.join(location, path)).st_mtime_ns for path in list_tree(location)} == files
+    assert not any(path.startswith(EVENTS_PREFIX) for path in files)
+    assert catalog.locations[0] == catalog.locations[1] == os.path.join(location, first['location'])
+    assert read_event_ids(location) == ['event-1', 'event-2', 'event-3']
+
+def test_late_files_start_a_new_generation(tmp_path):
+
+    location = str(tmp_path)
+    write_events(location, 'events-1.gz', ['event-1', 'event-2'])
+    write_events(location, 'events-2.gz', ['event-3'])
+
+    first = compact_partition(location, DAY)
+    late_path = write_events(location, 'events-3.gz', ['event-4'])
+
+    #Until the next run the late file is read alongside the compacted files
+    assert read_event_ids(location) == ['event-1', 'event-2', 'event-3', 'event-4']
+
+    second = compact_partition(location, DAY)
+
+    assert second['location'] != first['location']
+    assert second['events'] == 4
+    assert len(second['sources']) == 3
+    assert not os.path.exists(late_path)
+    assert not any(path.startswith(first['location']) for path in list_tree(location))
+    assert [path for path in list_tree(location) if path.endswith(MANIFEST_NAME)] == [os.path.join(second['location'], MANIFEST_NAME)]
+    assert read_event_ids(location) == ['event-1', 'event-2', 'event-3', 'event-4']
+
+def test_checksum_mismatch_keeps_the_original_files(tmp_path, monkeypatch):
+
+    location = str(tmp_path)
+    source_paths = [write_events(location, 'events-1.gz', ['event-1', 'event-2']), write_events(location, 'events-2.gz', ['event-3'])]
+
+    #Lose the first event while writing, as a truncated upload would
+    write_generation = compact.write_generation
+    monkeypatch.setattr(compact, 'write_generation', lambda lines, *arguments: write_generation((line for position, line in enumerate(lines) if position > 0), *arguments))
+
+    catalog = StubCatalog()
+
+    with pytest.raises(RuntimeError):
+        compact_partition(location, DAY, catalog)
+
+    assert all(os.path.exists(path) for path in source_paths)
+    assert catalog.locations == []
+    assert not any(path.endswith(MANIFEST_NAME) for path in list_tree(os.path.join(location, COMPACTED_PREFIX)))
+    assert read_event_ids(location) == ['event-1', 'event-2', 'event-3']
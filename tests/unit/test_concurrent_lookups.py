@@ -0,0 +1,109 @@
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from events import create_user_batch, read_record
+from identitystore_stub import StubIdentityStoreClient, create_directory
+from transformer import load_transformer
+
+#Each stubbed call waits this long, so the wall time of a cold batch is dominated by the lookups
+LATENCY = 0.02
+
+#This class throttles every nth call, so the transformer has to back off and retry
+class ThrottlingStubClient(StubIdentityStoreClient):
+
+    def __init__(self, users, groups, memberships, latency=0.0, throttle_every=5):
+        super().__init__(users, groups, memberships, latency)
+        self.throttle_every = throttle_every
+        self.throttles = 0
+
+    def _call(self, operation):
+        super()._call(operation)
+
+        with self.lock:
+            throttled = sum(self.calls.values()) % self.throttle_every == 0
+
+            if throttled:
+                self.throttles += 1
+
+        if throttled:
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'Stub')
+
+#Process a cold batch with the given pool size, returning the wall time and the output records
+def run_cold_batch(concurrency, client_class=StubIdentityStoreClient):
+
+    users, groups, memberships = create_directory(48, 4)
+
+    index = load_transformer({
+        'SSO_GROUP_IDS': ','.join(groups),
+        'SSO_LOOKUP_CONCURRENCY': str(concurrency)
+    })
+    index.client = client_class(users, groups, memberships, LATENCY)
+
+    started_at = time.perf_counter()
+    output = index.lambda_handler(create_user_batch(users, 'python'), None)
+
+    return time.perf_counter() - started_at, output, index
+
+def test_wall_time_drops_with_pool_size():
+
+    durations = {concurrency: run_cold_batch(concurrency)[0] for concurrency in [1, 4, 8]}
+
+    #Allow for scheduling overhead, a linear drop would be a speedup of 4 and 8
+    assert durations[1] / durations[4] > 2.5
+    assert durations[1] / durations[8] > 4
+
+def test_every_user_is_enriched_concurrently():
+
+    duration, output, index = run_cold_batch(8)
+    records = [read_record(record) for record in output['records']]
+
+    assert all(record['result'] == 'Ok' for record in output['records'])
+    assert all('user_name' in record and 'enrichment_pending' not in record for record in records)
+
+    #Each user is described once, however many workers there are, and each group once as users of the same group share the lookup of its name
+    assert index.client.calls['DescribeUser'] == len(records)
+    assert index.client.calls['DescribeGroup'] == len(set(record['group_id'] for record in records if 'group_id' in record))
+
+def test_throttling_reduces_concurrency_without_failing_the_batch():
+
+    duration, output, index = run_cold_batch(8, ThrottlingStubClient)
+
+    assert index.client.throttles > 0
+    assert all(record['result'] == 'Ok' for record in output['records'])
+    assert all('user_name' in read_record(record) for record in output['records'])
+
+    #The limit was halved on throttling and has not had a full round of successes at every step to grow back
+    assert index.limiter.limit < index.limiter.max_limit
+
+def test_limiter_bounds_in_flight_calls():
+
+    limiter = load_transformer({}).AdaptiveLimiter(3)
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def call():
+        limiter.acquire()
+
+        with lock:
+            active.append(1)
+            peak.append(len(active))
+
+        time.sleep(0.01)
+
+        with lock:
+            active.pop()
+
+        limiter.release()
+
+    threads = [threading.Thread(target=call) for _ in range(12)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert max(peak) <= 3
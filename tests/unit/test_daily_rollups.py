@@ -0,0 +1,187 @@
+import importlib.util
+import json
+import os
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+from events import create_batches, generate_events, read_record
+from identitystore_stub import StubIdentityStoreClient, create_directory
+from transformer import load_transformer
+
+from pipeline.athena import REPORT_QUERIES, ROLLUP_REPORT_QUERIES, WORKGROUP_NAME
+
+ROLLUPS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'pipeline', 'daily_rollups', 'index.py')
+
+#SQLite refers to its own database as main, so the queries run unchanged against tables of that name
+DATABASE_NAME = 'main'
+EVENTS_TABLE_NAME = 'codewhispererevents'
+
+EVENT_COLUMNS = ['event_id', 'event_time', 'account_id', 'user_id', 'identity_store_arn', 'event_type', 'programming_language', 'user_name', 'group_id', 'group_name']
+
+#Each saved report and the saved report answering the same question from the rollups
+EQUIVALENT_REPORTS = {
+    'monthly_unique_users': 'rollup_monthly_unique_users',
+    'monthly_languages': 'rollup_monthly_languages',
+    'monthly_users_per_group': 'rollup_monthly_users_per_group'
+}
+
+#An exact stand in for the Athena HyperLogLog sketch, holding the distinct users themselves
+class ApproxSet:
+
+    def __init__(self):
+        self.values = set()
+
+    def step(self, value):
+        self.values.add(value)
+
+    def finalize(self):
+        return json.dumps(sorted(self.values))
+
+#These classes stand in for the Athena, Glue and S3 clients of the rollup function, running the queries against SQLite
+class StubAthenaClient:
+
+    def __init__(self, database):
+        self.database = database
+        self.queries = []
+
+    def start_query_execution(self, QueryString, WorkGroup):
+        assert WorkGroup == WORKGROUP_NAME
+
+        self.database.execute(QueryString.replace('AS varbinary', 'AS blob'))
+        self.queries.append(QueryString)
+
+        return {'QueryExecutionId': str(len(self.queries))}
+
+    def get_query_execution(self, QueryExecutionId):
+        return {'QueryExecution': {'Status': {'State': 'SUCCEEDED'}}}
+
+class StubGlueClient:
+
+    def get_table(self, DatabaseName, Name):
+        return {
+            'Table': {
+                'StorageDescriptor': {'Columns': [{'Name': name} for name in EVENT_COLUMNS]},
+                'PartitionKeys': [{'Name': name} for name in ['year', 'month', 'day']]
+            }
+        }
+
+#Deleting the objects of a rollup day deletes its rows, so a day rolled up again replaces its previous rows as it does in S3
+class StubS3Client:
+
+    def __init__(self, database):
+        self.database = database
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        return [{'Contents': [{'Key': Prefix}]}]
+
+    def delete_objects(self, Bucket, Delete):
+        for item in Delete['Objects']:
+            table_name, year, month, day = [part.split('=')[-1] for part in item['Key'].split('/')[1:5]]
+            self.database.execute('DELETE FROM "{}" WHERE year=? AND month=? AND day=?'.format(table_name), (year, month, day))
+
+#Load the rollup function with its clients replaced by the stubs, it is loaded by path as the transformation function is also a module named index
+def load_rollups(database, deduplicate_events=False):
+
+    os.environ.update({
+        'DATABASE_NAME': DATABASE_NAME,
+        'EVENTS_TABLE_NAME': EVENTS_TABLE_NAME,
+        'BUCKET_NAME': 'events-bucket',
+        'ROLLUPS_PREFIX': 'Rollups/',
+        'WORKGROUP_NAME': WORKGROUP_NAME,
+        'DEDUPLICATE_EVENTS': str(deduplicate_events).lower()
+    })
+
+    spec = importlib.util.spec_from_file_location('daily_rollups_index', ROLLUPS_PATH)
+    rollups = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(rollups)
+
+    rollups.athena = StubAthenaClient(database)
+    rollups.glue = StubGlueClient()
+    rollups.s3 = StubS3Client(database)
+
+    return rollups
+
+#Create a month of enriched events in an SQLite events table, with some events delivered twice
+def create_events_database(duplicate_every=0):
+
+    users, groups, memberships = create_directory(300, 6)
+
+    index = load_transformer({'SSO_GROUP_IDS': ','.join(groups), 'DEDUPLICATION_WINDOW': '0'})
+    index.client = StubIdentityStoreClient(users, groups, memberships)
+
+    database = sqlite3.connect(':memory:')
+    database.create_aggregate('approx_set', 1, ApproxSet)
+    database.execute('CREATE TABLE "{}" ({}, year, month, day)'.format(EVENTS_TABLE_NAME, ', '.join(EVENT_COLUMNS)))
+    database.execute('CREATE TABLE daily_usage (account_id, user_id, user_name, group_name, programming_language, event_type, event_count, year, month, day)')
+    database.execute('CREATE TABLE daily_user_sketches (group_name, users_sketch, user_count, year, month, day)')
+
+    events = generate_events(15000, list(users), start_time=datetime(2023, 8, 1, tzinfo=timezone.utc), duration=timedelta(days=31))
+    position = 0
+
+    for batch in create_batches(events):
+        for record in index.lambda_handler(batch, None)['records']:
+            if record['result'] != 'Ok':
+                continue
+
+            record_data = read_record(record)
+            row = [record_data.get(name) for name in EVENT_COLUMNS] + [record_data['event_time'][0:4], record_data['event_time'][5:7], record_data['event_time'][8:10]]
+            copies = 2 if duplicate_every > 0 and position % duplicate_every == 0 else 1
+            position += 1
+
+            for _ in range(copies):
+                database.execute('INSERT INTO "{}" VALUES ({})'.format(EVENTS_TABLE_NAME, ', '.join('?' * len(row))), row)
+
+    return database
+
+def run_report(database, queries, name, table_name=EVENTS_TABLE_NAME):
+
+    return sorted(database.execute(queries[name][1].format(database=DATABASE_NAME, table=table_name), ('2023', '08')).fetchall(), key=repr)
+
+def roll_up_month(rollups):
+
+    rollups.lambda_handler({'days': ['2023-08-{:02d}'.format(day) for day in range(1, 32)]}, None)
+
+def test_rollup_reports_match_full_recompute():
+
+    database = create_events_database()
+    rollups = load_rollups(database)
+
+    #Rolling the month up twice replaces each day, as the scheduled function does for the previous days
+    roll_up_month(rollups)
+    roll_up_month(rollups)
+
+    for report_name, rollup_report_name in EQUIVALENT_REPORTS.items():
+        assert len(run_report(database, REPORT_QUERIES, report_name)) > 0
+        assert run_report(database, ROLLUP_REPORT_QUERIES, rollup_report_name) == run_report(database, REPORT_QUERIES, report_name)
+
+    assert database.execute('SELECT SUM(event_count) FROM daily_usage').fetchone() == database.execute('SELECT COUNT(*) FROM "{}"'.format(EVENTS_TABLE_NAME)).fetchone()
+
+def test_user_sketches_match_full_recompute():
+
+    database = create_events_database()
+    roll_up_month(load_rollups(database))
+
+    expected = database.execute('SELECT group_name, day, COUNT(DISTINCT user_id) FROM "{}" GROUP BY 1, 2'.format(EVENTS_TABLE_NAME)).fetchall()
+    actual = database.execute('SELECT group_name, day, user_count FROM daily_user_sketches').fetchall()
+
+    assert sorted(actual, key=repr) == sorted(expected, key=repr)
+
+    #Merging the sketches of every day gives the distinct users of each group in the month
+    merged_users = {}
+
+    for group_name, users_sketch in database.execute('SELECT group_name, users_sketch FROM daily_user_sketches'):
+        merged_users.setdefault(group_name, set()).update(json.loads(users_sketch))
+
+    expected_users = database.execute('SELECT group_name, COUNT(DISTINCT user_id) FROM "{}" GROUP BY 1'.format(EVENTS_TABLE_NAME)).fetchall()
+
+    assert sorted(((group_name, len(users)) for group_name, users in merged_users.items()), key=repr) == sorted(expected_users, key=repr)
+
+def test_deduplicated_rollups_count_each_event_once():
+
+    database = create_events_database(duplicate_every=7)
+    roll_up_month(load_rollups(database, deduplicate_events=True))
+
+    assert database.execute('SELECT SUM(event_count) FROM daily_usage').fetchone() == database.execute('SELECT COUNT(DISTINCT event_id) FROM "{}"'.format(EVENTS_TABLE_NAME)).fetchone()
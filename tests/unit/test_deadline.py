@@ -0,0 +1,60 @@
+import time
+
+from events import create_batch, create_user_batch, read_record
+from identitystore_stub import StubIdentityStoreClient, create_directory
+from transformer import LambdaContext, load_transformer
+
+#Each stubbed call waits this long, so a cold batch takes far longer than the deadline
+LATENCY = 0.1
+
+#The seconds left on the Lambda context of a batch which is returned at the deadline
+TIMEOUT = 0.3
+
+CONCURRENCY = 2
+
+#Load the transformer with a slow identity store and no safety margin, so the deadline is the remaining time of the context. Every user is in every group, so each lookup makes a long series of calls
+def load_slow_transformer():
+
+    users, groups, memberships = create_directory(40, 10)
+    memberships = {group_id: list(users) for group_id in groups}
+
+    index = load_transformer({
+        'SSO_GROUP_IDS': ','.join(groups),
+        'SSO_LOOKUP_CONCURRENCY': str(CONCURRENCY),
+        'SSO_LOOKUP_SAFETY_MARGIN': '0',
+        'SSO_RECORD_ALL_GROUPS': 'true'
+    })
+    index.client = StubIdentityStoreClient(users, groups, memberships, LATENCY)
+
+    return index, users
+
+def test_batch_is_returned_at_the_deadline():
+
+    index, users = load_slow_transformer()
+
+    started_at = time.perf_counter()
+    output = index.lambda_handler(create_user_batch(users, 'python'), LambdaContext(TIMEOUT))
+    duration = time.perf_counter() - started_at
+
+    #Looking up every user would take several seconds
+    assert duration < TIMEOUT + 2 * LATENCY
+
+    records = [read_record(record) for record in output['records']]
+
+    assert all(record['result'] == 'Ok' for record in output['records'])
+    assert any(record.get('enrichment_pending') for record in records)
+    assert all('user_name' in record or record.get('enrichment_pending') for record in records)
+
+def test_abandoned_lookups_stop_when_a_later_batch_starts():
+
+    index, users = load_slow_transformer()
+    index.lambda_handler(create_user_batch(users, 'python'), LambdaContext(TIMEOUT))
+
+    #A later batch with plenty of time left must not extend the deadline of the lookups left running by the first
+    index.lambda_handler(create_batch([]), LambdaContext(60))
+    calls = sum(index.client.calls.values())
+
+    time.sleep(5 * LATENCY)
+
+    #Only the calls already in flight when the first batch was returned may complete
+    assert sum(index.client.calls.values()) - calls <= CONCURRENCY
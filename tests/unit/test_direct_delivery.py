@@ -0,0 +1,175 @@
+import json
+import random
+import re
+
+import pytest
+from aws_cdk.assertions import Match
+
+from events import EVENT_NAMES, create_event, create_event_batch, read_record
+from transformer import load_transformer
+
+#Stands in for a missing field, as a field can also be present with a null value
+MISSING = object()
+
+#Return the types of the processors of the Firehose stream
+def processor_types(template):
+
+    stream = list(template.find_resources('AWS::KinesisFirehose::DeliveryStream').values())[0]
+    processing_configuration = stream['Properties']['ExtendedS3DestinationConfiguration'].get('ProcessingConfiguration', {})
+
+    return [processor['Type'] for processor in processing_configuration.get('Processors', [])]
+
+def test_transformation_function_is_used_by_default(synth):
+
+    template = synth({})
+
+    assert processor_types(template) == ['Lambda']
+    template.resource_count_is('AWS::Events::Rule', 1)
+
+def test_direct_delivery_replaces_the_transformation_function(synth):
+
+    default_functions = len(synth({}).find_resources('AWS::Lambda::Function'))
+    template = synth({'direct_delivery': 'true'})
+
+    assert processor_types(template) == ['AppendDelimiterToRecord']
+    assert len(template.find_resources('AWS::Lambda::Function')) == default_functions - 1
+
+    #Each event type, with and without a programming language, has a rule of its own which reshapes the event
+    template.resource_count_is('AWS::Events::Rule', 4)
+
+    for rule in template.find_resources('AWS::Events::Rule').values():
+        assert 'InputTransformer' in rule['Properties']['Targets'][0]
+
+def test_direct_delivery_extracts_the_partition_keys(synth):
+
+    template = synth({'direct_delivery': 'true', 'dynamic_partitioning': 'true'})
+
+    assert processor_types(template) == ['MetadataExtraction', 'AppendDelimiterToRecord']
+    template.has_resource_properties('AWS::KinesisFirehose::DeliveryStream', {
+        'ExtendedS3DestinationConfiguration': {
+            'Prefix': Match.string_like_regexp('partitionKeyFromQuery:account_id'),
+            'DynamicPartitioningConfiguration': {'Enabled': True}
+        }
+    })
+
+def test_direct_delivery_reads_the_cloudtrail_event_time_as_parquet(synth):
+
+    template = synth({'direct_delivery': 'true', 'output_format': 'parquet'})
+
+    template.has_resource_properties('AWS::KinesisFirehose::DeliveryStream', {
+        'ExtendedS3DestinationConfiguration': {
+            'DataFormatConversionConfiguration': {
+                'InputFormatConfiguration': {
+                    'Deserializer': {
+                        'HiveJsonSerDe': {'TimestampFormats': ["yyyy-MM-dd'T'HH:mm:ss'Z'"]}
+                    }
+                }
+            }
+        }
+    })
+
+def test_direct_delivery_in_a_hub_also_reshapes_spoke_events(synth):
+
+    template = synth({'direct_delivery': 'true', 'spoke_account_ids': '444455556666'})
+
+    template.resource_count_is('AWS::Events::Rule', 8)
+
+def test_direct_delivery_cannot_enrich_events(synth):
+
+    with pytest.raises(ValueError):
+        synth({'direct_delivery': 'true', 'sso_group_ids': 'group-0000'})
+
+#Return the value at the given path of an event
+def get_field(event, path):
+
+    for key in path:
+        if not isinstance(event, dict) or key not in event:
+            return MISSING
+
+        event = event[key]
+
+    return event
+
+#Match an event against an EventBridge pattern, supporting the value lists and exists filters used by the rules
+def matches(pattern, event, path=()):
+
+    for key, values in pattern.items():
+        if isinstance(values, dict):
+            if not matches(values, event, path + (key,)):
+                return False
+
+            continue
+
+        value = get_field(event, path + (key,))
+        matched = False
+
+        for expected in values:
+            if isinstance(expected, dict):
+                exists = value is not MISSING and not isinstance(value, dict)
+                matched = matched or exists == expected['exists']
+            elif value is not MISSING and value == expected:
+                matched = True
+
+        if not matched:
+            return False
+
+    return True
+
+#Build the record an input transformer delivers for an event
+def transform(input_transformer, event):
+
+    def substitute(placeholder):
+        value = get_field(event, input_transformer['InputPathsMap'][placeholder.group(1)][2:].split('.'))
+
+        return 'null' if value is MISSING else json.dumps(value)
+
+    return re.sub(r'<([A-Za-z0-9_-]+)>', substitute, input_transformer['InputTemplate'])
+
+#Create events covering the fields the rules filter on: paged and unpaged calls, calls without an SSO user and languages which need escaping
+def generate_events(count, seed=0):
+
+    generator = random.Random(seed)
+    generated_events = []
+
+    for _ in range(count):
+        event = create_event(
+            generator.choice(EVENT_NAMES),
+            user_id=None if generator.random() < 0.2 else 'user-{}'.format(generator.randint(0, 50)),
+            account_id=str(generator.randint(10 ** 11, 10 ** 12 - 1))
+        )
+        request_parameters = event['detail']['requestParameters']
+
+        if generator.random() < 0.6:
+            request_parameters['fileContext'] = {'programmingLanguage': {'languageName': generator.choice(['python', 'jäva', 'c++', '日本語', 'q"uote\\'])}}
+
+        if generator.random() < 0.3:
+            request_parameters['nextToken'] = generator.choice(['', 'token', None])
+
+        generated_events.append(event)
+
+    return generated_events
+
+#Every event the function keeps must be matched by exactly one rule, which must deliver the same record, and every event it drops by none
+def test_rules_deliver_the_records_of_the_transformation_function(synth):
+
+    resources = synth({'direct_delivery': 'true'}).find_resources('AWS::Events::Rule')
+    rules = [(rule['Properties']['EventPattern'], rule['Properties']['Targets'][0]['InputTransformer']) for rule in resources.values()]
+
+    generated_events = generate_events(2000)
+
+    index = load_transformer({})
+    output = index.lambda_handler(create_event_batch(generated_events), None)
+
+    kept = 0
+
+    for event, record in zip(generated_events, output['records']):
+        delivered = [transform(input_transformer, event) for pattern, input_transformer in rules if matches(pattern, event)]
+
+        if record['result'] == 'Ok':
+            assert len(delivered) == 1
+            assert json.loads(delivered[0]) == read_record(record)
+            kept += 1
+        else:
+            assert delivered == []
+
+    assert 0 < kept < len(generated_events)
@@ -0,0 +1,112 @@
+import base64
+import copy
+import json
+import random
+
+from events import create_batches, create_event, generate_events
+from transformer import load_transformer
+
+#The straightforward implementation the fast path replaced, parsing every record in full. It includes the event ID the function has kept since deduplication was added
+def reference_transform(event):
+
+    records = []
+
+    for record in event['records']:
+        record_data_raw = json.loads(base64.b64decode(record['data']))
+        detail = record_data_raw["detail"]
+
+        if 'onBehalfOf' in detail["userIdentity"] and ("nextToken" not in detail["requestParameters"] or detail["requestParameters"]["nextToken"] == ""):
+            event_type = "CodeSuggestionInvocation"
+
+            if detail["eventName"] == "ListCodeAnalysisFindings":
+                event_type = "SecurityScanInvocation"
+
+            record_data = {
+                "event_id": detail.get("eventID"),
+                "event_time": detail["eventTime"],
+                "account_id": detail["userIdentity"]["accountId"],
+                "user_id": detail["userIdentity"]["onBehalfOf"]["userId"],
+                "identity_store_arn": detail["userIdentity"]["onBehalfOf"]["identityStoreArn"],
+                "event_type": event_type
+            }
+
+            if "fileContext" in detail["requestParameters"]:
+                record_data["programming_language"] = detail["requestParameters"]["fileContext"]["programmingLanguage"]["languageName"]
+
+            record['data'] = base64.b64encode((json.dumps(record_data) + "\n").encode('utf-8'))
+            record['result'] = 'Ok'
+        else:
+            record['result'] = 'Dropped'
+
+        records.append(record)
+
+    event['records'] = records
+
+    return event
+
+#Create events covering the cases the prefilter has to get right, encoded in the different ways EventBridge and other producers may serialise them
+def create_edge_case_batch(seed=0):
+
+    generator = random.Random(seed)
+    events = []
+
+    for position in range(2000):
+        event = create_event(
+            generator.choice(['GenerateCompletions', 'GenerateRecommendations', 'ListCodeAnalysisFindings']),
+            user_id=None if generator.random() < 0.2 else 'user-{}'.format(generator.randint(0, 50)),
+            programming_language=generator.choice([None, 'python', 'jäva', 'c++', '日本語', 'q"uote', 'back\\slash']),
+            next_token=generator.choice([None, None, '', 'eyJuZXh0IjoiMiJ9'])
+        )
+
+        #A null nextToken is present with a value, so the event is dropped
+        if generator.random() < 0.05:
+            event['detail']['requestParameters']['nextToken'] = None
+
+        #The prefilter key can appear in a value without the event having an SSO user identity
+        if generator.random() < 0.05:
+            event['detail']['userAgent'] = '"onBehalfOf"'
+
+        #Older events do not have an event ID
+        if generator.random() < 0.05:
+            del event['detail']['eventID']
+
+        events.append(json.dumps(event, separators=generator.choice([(',', ':'), (', ', ': ')]), ensure_ascii=generator.random() < 0.5))
+
+    return {
+        'records': [
+            {'recordId': str(position), 'data': base64.b64encode(data.encode('utf-8')).decode('utf-8')}
+            for position, data in enumerate(events)
+        ]
+    }
+
+#Compare the output of the function with the reference, byte for byte
+def assert_matches_reference(index, event):
+
+    expected = reference_transform(copy.deepcopy(event))
+    actual = index.lambda_handler(copy.deepcopy(event), None)
+
+    assert [record['result'] for record in actual['records']] == [record['result'] for record in expected['records']]
+
+    for actual_record, expected_record in zip(actual['records'], expected['records']):
+        if expected_record['result'] == 'Ok':
+            assert base64.b64decode(actual_record['data']) == base64.b64decode(expected_record['data'])
+
+def test_edge_cases_match_reference():
+
+    index = load_transformer({'DEDUPLICATION_WINDOW': '0'})
+
+    assert_matches_reference(index, create_edge_case_batch())
+
+def test_generated_batches_match_reference():
+
+    index = load_transformer({'DEDUPLICATION_WINDOW': '0'})
+
+    for batch in create_batches(generate_events(20000, ['user-{}'.format(position) for position in range(200)], paged_share=0.1, service_share=0.1)):
+        assert_matches_reference(index, batch)
+
+def test_standard_library_fallback_matches_reference():
+
+    index = load_transformer({'DEDUPLICATION_WINDOW': '0'})
+    index.json_loads = json.loads
+
+    assert_matches_reference(index, create_edge_case_batch(seed=1))
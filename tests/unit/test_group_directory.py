@@ -0,0 +1,139 @@
+import threading
+import time
+
+from identitystore_stub import StubIdentityStoreClient, create_directory
+
+#Importing the loader puts the modules of the transformation function on the path
+import transformer
+from group_directory import GroupDirectory
+
+IDENTITY_STORE_ID = 'd-0000000000'
+
+#This class holds every ListGroupMemberships call of the given group until it is released, so a sweep can be caught part way through
+class BlockingStubClient(StubIdentityStoreClient):
+
+    def __init__(self, users, groups, memberships, blocked_group_id):
+        super().__init__(users, groups, memberships)
+        self.blocked_group_id = blocked_group_id
+        self.blocked = threading.Event()
+        self.released = threading.Event()
+
+    def list_group_memberships(self, IdentityStoreId, GroupId, MaxResults=100, NextToken=None):
+        if GroupId == self.blocked_group_id:
+            self.blocked.set()
+            self.released.wait(5)
+
+        return super().list_group_memberships(IdentityStoreId, GroupId, MaxResults, NextToken)
+
+def create_group_directory(client, groups, **options):
+
+    return GroupDirectory(lambda operation, **kwargs: getattr(client, operation)(**kwargs), list(groups), **options)
+
+def test_directory_is_reused_until_the_refresh_interval_has_passed():
+
+    users, groups, memberships = create_directory(400, 3)
+    client = StubIdentityStoreClient(users, groups, memberships)
+    group_directory = create_group_directory(client, groups, refresh_interval=60)
+
+    directory = group_directory.get(IDENTITY_STORE_ID)
+
+    assert directory['group_names'] == groups
+    assert all(directory['user_groups'][user_id] == [group_id] for group_id, user_ids in memberships.items() for user_id in user_ids)
+
+    #Every group has a second page of members
+    assert client.calls['DescribeGroup'] == 3
+    assert client.calls['ListGroupMemberships'] == 6
+
+    assert group_directory.get(IDENTITY_STORE_ID) is directory
+    assert sum(client.calls.values()) == 9
+
+    #Once the directory is out of date it is swept again, picking up a new member
+    group_id = list(groups)[0]
+    memberships[group_id].append('user-new')
+    client.user_groups['user-new'] = {group_id}
+    group_directory.stores[IDENTITY_STORE_ID]['swept_at'] -= 60
+
+    assert group_directory.get(IDENTITY_STORE_ID)['user_groups']['user-new'] == [group_id]
+    assert client.calls['DescribeGroup'] == 6
+
+def test_sweep_is_only_started_when_it_fits_in_the_timeout():
+
+    users, groups, memberships = create_directory(20, 2)
+    client = StubIdentityStoreClient(users, groups, memberships)
+    group_directory = create_group_directory(client, groups, refresh_interval=60, sweep_timeout=10)
+
+    assert group_directory.get(IDENTITY_STORE_ID, timeout=5) is None
+    assert sum(client.calls.values()) == 0
+
+    directory = group_directory.get(IDENTITY_STORE_ID, timeout=10)
+    group_directory.stores[IDENTITY_STORE_ID]['swept_at'] -= 60
+
+    #An out of date directory is still used when there is no time to sweep again
+    assert group_directory.get(IDENTITY_STORE_ID, timeout=5) is directory
+
+def test_partial_sweep_is_not_used_or_retried_until_the_refresh_interval():
+
+    users, groups, memberships = create_directory(20, 3)
+    client = BlockingStubClient(users, groups, memberships, list(groups)[1])
+    group_directory = create_group_directory(client, groups, refresh_interval=60, sweep_timeout=0.2)
+
+    assert group_directory.get(IDENTITY_STORE_ID) is None
+    assert group_directory.stores[IDENTITY_STORE_ID]['complete'] is False
+
+    calls = sum(client.calls.values())
+    client.released.set()
+
+    assert group_directory.get(IDENTITY_STORE_ID) is None
+    assert sum(client.calls.values()) == calls
+
+    group_directory.stores[IDENTITY_STORE_ID]['swept_at'] -= 60
+
+    assert group_directory.get(IDENTITY_STORE_ID)['group_names'] == groups
+
+def test_previous_directory_is_used_while_a_sweep_runs():
+
+    users, groups, memberships = create_directory(20, 2)
+    client = BlockingStubClient(users, groups, memberships, None)
+    group_directory = create_group_directory(client, groups, refresh_interval=60, sweep_timeout=5)
+
+    directory = group_directory.get(IDENTITY_STORE_ID)
+    group_directory.stores[IDENTITY_STORE_ID]['swept_at'] -= 60
+    client.blocked_group_id = list(groups)[0]
+
+    sweep = threading.Thread(target=group_directory.get, args=(IDENTITY_STORE_ID,))
+    sweep.start()
+    assert client.blocked.wait(5)
+
+    #Other callers neither wait for the sweep nor start another one
+    started_at = time.monotonic()
+
+    assert group_directory.get(IDENTITY_STORE_ID) is directory
+    assert time.monotonic() - started_at < 1
+
+    client.released.set()
+    sweep.join(5)
+
+    assert group_directory.get(IDENTITY_STORE_ID) is not directory
+    assert client.calls['DescribeGroup'] == 4
+
+def test_first_sweep_is_shared_by_concurrent_callers():
+
+    users, groups, memberships = create_directory(20, 4)
+    client = BlockingStubClient(users, groups, memberships, list(groups)[0])
+    group_directory = create_group_directory(client, groups, sweep_timeout=5)
+
+    results = []
+    callers = [threading.Thread(target=lambda: results.append(group_directory.get(IDENTITY_STORE_ID))) for _ in range(4)]
+
+    for caller in callers:
+        caller.start()
+
+    assert client.blocked.wait(5)
+    client.released.set()
+
+    for caller in callers:
+        caller.join(5)
+
+    assert len(results) == 4
+    assert all(result is not None and result is results[0] for result in results)
+    assert client.calls['DescribeGroup'] == 4
@@ -0,0 +1,108 @@
+import json
+import os
+import subprocess
+import sys
+
+import aws_cdk as cdk
+from aws_cdk.assertions import Match, Template
+
+from pipeline.code_whisperer_spoke_stack import CodeWhispererSpokeStack
+from pipeline.event_bus import EVENT_BUS_NAME, event_bus_arn
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+
+HUB_ACCOUNT_ID = '111122223333'
+SPOKE_ACCOUNT_IDS = ['444455556666', '777788889999']
+
+#The resources only the hub deploys, a spoke only records its events and forwards them
+HUB_RESOURCE_TYPES = [
+    'AWS::KinesisFirehose::DeliveryStream',
+    'AWS::Glue::Database',
+    'AWS::Glue::Table',
+    'AWS::Athena::WorkGroup',
+    'AWS::Events::EventBus',
+    'AWS::Events::EventBusPolicy'
+]
+
+def synth_spoke(context):
+
+    app = cdk.App(context=dict(context, **{'aws:cdk:bundling-stacks': []}))
+    stack = CodeWhispererSpokeStack(app, 'CodeWhispererSpokeStack', env=cdk.Environment(account=SPOKE_ACCOUNT_IDS[0], region='us-east-1'))
+
+    return Template.from_stack(stack)
+
+def test_hub_accepts_events_from_each_spoke(synth):
+
+    template = synth({'spoke_account_ids': ','.join(SPOKE_ACCOUNT_IDS)})
+
+    template.has_resource_properties('AWS::Events::EventBus', {'Name': EVENT_BUS_NAME})
+
+    policies = template.find_resources('AWS::Events::EventBusPolicy')
+
+    assert sorted(policy['Properties']['Principal'] for policy in policies.values()) == SPOKE_ACCOUNT_IDS
+    assert all(policy['Properties']['Action'] == 'events:PutEvents' for policy in policies.values())
+
+    #The events of the spokes arrive on the central bus and are delivered to the same stream as the events of the hub
+    event_bus_id = list(template.find_resources('AWS::Events::EventBus'))[0]
+    stream_id = list(template.find_resources('AWS::KinesisFirehose::DeliveryStream'))[0]
+    rules = template.find_resources('AWS::Events::Rule')
+
+    bus_rules = [rule for rule in rules.values() if 'EventBusName' in rule['Properties']]
+
+    assert len(rules) == 2 and len(bus_rules) == 1
+    assert bus_rules[0]['Properties']['EventBusName'] == {'Ref': event_bus_id}
+    assert bus_rules[0]['Properties']['Targets'][0]['Arn'] == {'Fn::GetAtt': [stream_id, 'Arn']}
+
+def test_projection_includes_the_spoke_accounts(synth):
+
+    template = synth({'spoke_account_ids': ','.join(SPOKE_ACCOUNT_IDS), 'dynamic_partitioning': 'true'})
+
+    template.has_resource_properties('AWS::Glue::Table', {
+        'TableInput': Match.object_like({
+            'Parameters': Match.object_like({
+                'projection.account_id.type': 'enum',
+                'projection.account_id.values': ','.join([HUB_ACCOUNT_ID] + SPOKE_ACCOUNT_IDS)
+            })
+        })
+    })
+
+def test_stack_without_spokes_has_no_central_bus(synth):
+
+    template = synth({})
+
+    template.resource_count_is('AWS::Events::EventBus', 0)
+    template.resource_count_is('AWS::Events::EventBusPolicy', 0)
+    template.resource_count_is('AWS::Events::Rule', 1)
+
+def test_spoke_forwards_to_the_hub_bus():
+
+    template = synth_spoke({'hub_account_id': HUB_ACCOUNT_ID, 'hub_region': 'eu-west-1'})
+    rules = list(template.find_resources('AWS::Events::Rule').values())
+
+    assert len(rules) == 1
+    assert rules[0]['Properties']['Targets'][0]['Arn'] == event_bus_arn(HUB_ACCOUNT_ID, 'eu-west-1')
+    assert 'EventBusName' not in rules[0]['Properties']
+
+    for resource_type in HUB_RESOURCE_TYPES:
+        template.resource_count_is(resource_type, 0)
+
+#Synthesize the app as the CDK CLI does, passing the context in the environment
+def test_spoke_deployment_role_synthesizes_only_the_spoke_stack(tmp_path):
+
+    context = {'deployment_role': 'spoke', 'hub_account_id': HUB_ACCOUNT_ID, 'aws:cdk:bundling-stacks': []}
+    environment = dict(os.environ, CDK_CONTEXT_JSON=json.dumps(context), CDK_OUTDIR=str(tmp_path), JSII_SILENCE_WARNING_DEPRECATED_NODE_VERSION='1')
+
+    subprocess.run([sys.executable, 'app.py'], cwd=REPO_ROOT, env=environment, check=True, capture_output=True)
+
+    with open(os.path.join(str(tmp_path), 'manifest.json')) as manifest_file:
+        artifacts = json.load(manifest_file)['artifacts']
+
+    stacks = [name for name, artifact in artifacts.items() if artifact['type'] == 'aws:cloudformation:stack']
+
+    assert stacks == ['CodeWhispererSpokeStack']
+
+    with open(os.path.join(str(tmp_path), 'CodeWhispererSpokeStack.template.json')) as template_file:
+        resource_types = set(resource['Type'] for resource in json.load(template_file)['Resources'].values())
+
+    assert 'AWS::CloudTrail::Trail' in resource_types
+    assert resource_types.isdisjoint(HUB_RESOURCE_TYPES)
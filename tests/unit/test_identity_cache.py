@@ -0,0 +1,204 @@
+import json
+import os
+import time
+
+from events import create_user_batch, read_record
+from identitystore_stub import StubIdentityStoreClient, create_directory
+from transformer import load_transformer
+from identity_cache import DynamoDBCache, FileCache, LRUCache, TieredCache
+
+#This class stands in for the boto3 DynamoDB client, holding the items of the cache table in memory
+class StubDynamoDBClient:
+
+    def __init__(self, unprocessed_keys=0, fail=False):
+        self.items = {}
+        self.unprocessed_keys = unprocessed_keys
+        self.fail = fail
+        self.calls = {'GetItem': 0, 'BatchGetItem': 0, 'PutItem': 0}
+
+    def get_item(self, TableName, Key):
+        self.calls['GetItem'] += 1
+
+        if self.fail:
+            raise RuntimeError('ProvisionedThroughputExceededException')
+
+        item = self.items.get(Key['cache_key']['S'])
+
+        return {'Item': item} if item is not None else {}
+
+    def batch_get_item(self, RequestItems):
+        self.calls['BatchGetItem'] += 1
+
+        if self.fail:
+            raise RuntimeError('ProvisionedThroughputExceededException')
+
+        table_name, request = next(iter(RequestItems.items()))
+        assert len(request['Keys']) <= 100
+
+        #Leave some keys unprocessed on the first call, as DynamoDB does when the table is throttled
+        processed_keys = request['Keys'][self.unprocessed_keys:]
+        unprocessed_keys = request['Keys'][:self.unprocessed_keys]
+        self.unprocessed_keys = 0
+
+        result = {
+            'Responses': {
+                table_name: [self.items[key['cache_key']['S']] for key in processed_keys if key['cache_key']['S'] in self.items]
+            },
+            'UnprocessedKeys': {}
+        }
+
+        if len(unprocessed_keys) > 0:
+            result['UnprocessedKeys'][table_name] = {'Keys': unprocessed_keys}
+
+        return result
+
+    def put_item(self, TableName, Item):
+        self.calls['PutItem'] += 1
+
+        if self.fail:
+            raise RuntimeError('ProvisionedThroughputExceededException')
+
+        self.items[Item['cache_key']['S']] = Item
+
+#Load the transformer with a shared cache tier backed by the stubbed table
+def load_shared_cache_transformer(dynamodb_client, users, groups, memberships):
+
+    index = load_transformer({
+        'SSO_GROUP_IDS': ','.join(groups),
+        'IDENTITY_CACHE_TABLE': 'identity-cache'
+    })
+
+    index.cache.tiers[1].client = dynamodb_client
+    index.client = StubIdentityStoreClient(users, groups, memberships)
+
+    return index
+
+def test_shared_tier_is_read_in_batches():
+
+    users, groups, memberships = create_directory(250, 5)
+    dynamodb_client = StubDynamoDBClient()
+
+    #Fill the shared table from one container, then process the same users in a new container
+    load_shared_cache_transformer(dynamodb_client, users, groups, memberships).lambda_handler(create_user_batch(users), None)
+    index = load_shared_cache_transformer(dynamodb_client, users, groups, memberships)
+    dynamodb_client.calls = {'GetItem': 0, 'BatchGetItem': 0, 'PutItem': 0}
+
+    output = index.lambda_handler(create_user_batch(users), None)
+
+    assert dynamodb_client.calls['BatchGetItem'] == 3
+    assert dynamodb_client.calls['GetItem'] == 0
+    assert sum(index.client.calls.values()) == 0
+    assert all('user_name' in read_record(record) for record in output['records'])
+
+def test_unprocessed_keys_are_read_again():
+
+    users, groups, memberships = create_directory(20, 2)
+    dynamodb_client = StubDynamoDBClient()
+
+    load_shared_cache_transformer(dynamodb_client, users, groups, memberships).lambda_handler(create_user_batch(users), None)
+    index = load_shared_cache_transformer(dynamodb_client, users, groups, memberships)
+    dynamodb_client.calls = {'GetItem': 0, 'BatchGetItem': 0, 'PutItem': 0}
+    dynamodb_client.unprocessed_keys = 8
+
+    index.lambda_handler(create_user_batch(users), None)
+
+    assert dynamodb_client.calls['BatchGetItem'] == 2
+    assert index.cache.stats()['dynamodb']['hits'] == len(users)
+    assert sum(index.client.calls.values()) == 0
+
+def test_shared_tier_errors_are_misses():
+
+    users, groups, memberships = create_directory(20, 2)
+    dynamodb_client = StubDynamoDBClient(fail=True)
+    index = load_shared_cache_transformer(dynamodb_client, users, groups, memberships)
+
+    output = index.lambda_handler(create_user_batch(users), None)
+
+    #The users are looked up and enriched as if the table was empty, and the failures are counted
+    assert all('user_name' in read_record(record) for record in output['records'])
+    assert index.client.calls['DescribeUser'] == len(users)
+    assert index.cache.stats()['dynamodb']['errors'] > 0
+
+def test_expired_items_are_misses():
+
+    dynamodb_client = StubDynamoDBClient()
+    dynamodb_client.items['user#d-1#expired'] = {
+        'cache_key': {'S': 'user#d-1#expired'},
+        'cache_value': {'S': json.dumps({'user_name': 'old'})},
+        'expires_at': {'N': str(int(time.time()) - 1)}
+    }
+
+    assert DynamoDBCache('identity-cache', client=dynamodb_client).get_entries(['user#d-1#expired']) == {}
+
+def test_file_cache_is_written_once_for_each_batch(tmp_path, monkeypatch):
+
+    users, groups, memberships = create_directory(50, 2)
+    path = str(tmp_path / 'identity-cache.json')
+
+    index = load_transformer({'SSO_GROUP_IDS': ','.join(groups), 'IDENTITY_CACHE_FILE': path})
+    index.client = StubIdentityStoreClient(users, groups, memberships)
+
+    replaced_paths = []
+    replace = os.replace
+    monkeypatch.setattr(os, 'replace', lambda source, destination: replaced_paths.append(destination) or replace(source, destination))
+
+    index.lambda_handler(create_user_batch(users), None)
+
+    assert replaced_paths == [path]
+
+    #A batch of cached users has nothing to write
+    index.lambda_handler(create_user_batch(users), None)
+
+    assert replaced_paths == [path]
+
+    #The flushed file fills the cache of a new container
+    index = load_transformer({'SSO_GROUP_IDS': ','.join(groups), 'IDENTITY_CACHE_FILE': path})
+    index.client = StubIdentityStoreClient(users, groups, memberships)
+
+    output = index.lambda_handler(create_user_batch(users), None)
+
+    assert sum(index.client.calls.values()) == 0
+    assert index.cache.stats()['file']['hits'] == len(users)
+    assert all('user_name' in read_record(record) for record in output['records'])
+
+def test_file_cache_is_only_written_when_flushed(tmp_path):
+
+    path = str(tmp_path / 'identity-cache.json')
+    file_cache = FileCache(path)
+
+    file_cache.set('user#d-1#user-1', {'user_name': 'user-1'})
+
+    assert not os.path.exists(path)
+
+    file_cache.flush()
+
+    assert FileCache(path).get('user#d-1#user-1') == {'user_name': 'user-1'}
+
+#This class stands in for a tier that cannot be written, such as a full disk
+class FailingTier(LRUCache):
+
+    name = 'failing'
+
+    def _set(self, key, value, expires_at):
+        raise OSError('No space left on device')
+
+def test_back_fill_errors_are_counted():
+
+    shared_tier = LRUCache()
+    shared_tier.set('user#d-1#user-1', {'user_name': 'user-1'}, 60)
+    cache = TieredCache([FailingTier(), shared_tier])
+
+    #The value is still returned when it cannot be copied into the earlier tier
+    assert cache.get('user#d-1#user-1') == {'user_name': 'user-1'}
+    assert cache.stats()['failing'] == {'hits': 0, 'misses': 1, 'errors': 1}
+
+def test_back_fill_keeps_the_original_expiry():
+
+    memory_tier = LRUCache()
+    shared_tier = LRUCache()
+    shared_tier.set('user#d-1#user-1', {'user_name': 'user-1'}, 60)
+    cache = TieredCache([memory_tier, shared_tier])
+
+    cache.get('user#d-1#user-1')
+
+    assert abs(memory_tier.get_entry('user#d-1#user-1')[1] - shared_tier.get_entry('user#d-1#user-1')[1]) < 1
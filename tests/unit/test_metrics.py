@@ -0,0 +1,99 @@
+import json
+
+from events import create_user_batch
+from identitystore_stub import StubIdentityStoreClient, create_directory
+from transformer import LambdaContext, load_transformer
+
+#Return the embedded metric format documents written to standard output
+def read_documents(output):
+
+    return [json.loads(line) for line in output.splitlines() if line.startswith('{') and '"_aws"' in line]
+
+def run_batch(environment, users, groups, memberships, batch_users):
+
+    index = load_transformer(dict(environment, SSO_GROUP_IDS=','.join(groups), METRICS_NAMESPACE='CodeWhispererUsageAnalyzer'))
+    index.client = StubIdentityStoreClient(users, groups, memberships)
+
+    index.lambda_handler(create_user_batch(batch_users), LambdaContext())
+
+    return index
+
+#Every document must be accepted by CloudWatch, and together they must hold each value once
+def assert_valid_documents(documents):
+
+    for document in documents:
+        metric_names = [metric['Name'] for metric in document['_aws']['CloudWatchMetrics'][0]['Metrics']]
+
+        for name in metric_names:
+            assert name in document
+
+            if isinstance(document[name], list):
+                assert 0 < len(document[name]) <= 100
+
+    #The counts are only written once, so they are not added up twice by CloudWatch
+    assert len([document for document in documents if 'Records' in document]) == 1
+
+def test_latencies_of_a_cold_batch_are_split_across_documents(capsys):
+
+    users, groups, memberships = create_directory(250, 4)
+    run_batch({}, users, groups, memberships, list(users))
+
+    documents = read_documents(capsys.readouterr().out)
+    assert_valid_documents(documents)
+
+    latencies = [value for document in documents for value in document.get('DescribeUserLatency', [])]
+
+    assert len(documents) == 3
+    assert len(latencies) == documents[0]['DescribeUserCalls'] == 250
+
+def test_group_directory_pages_are_split_across_documents(capsys):
+
+    users, groups, memberships = create_directory(15000, 1, ungrouped_share=0)
+    run_batch({'SSO_GROUP_DIRECTORY': 'true'}, users, groups, memberships, list(users)[:10])
+
+    documents = read_documents(capsys.readouterr().out)
+    assert_valid_documents(documents)
+
+    latencies = [value for document in documents for value in document.get('ListGroupMembershipsLatency', [])]
+
+    assert len(latencies) == documents[0]['ListGroupMembershipsCalls'] == 150
+
+def test_small_batch_writes_a_single_document(capsys):
+
+    users, groups, memberships = create_directory(10, 2)
+    run_batch({}, users, groups, memberships, list(users))
+
+    documents = read_documents(capsys.readouterr().out)
+    assert_valid_documents(documents)
+
+    assert len(documents) == 1
+
+def test_calls_skipped_at_the_deadline_are_not_counted_as_calls(capsys):
+
+    users, groups, memberships = create_directory(40, 10)
+
+    #Every user is in every group and each call is slow, so most lookups are still waiting to start when the batch is returned
+    index = load_transformer({
+        'SSO_GROUP_IDS': ','.join(groups),
+        'SSO_LOOKUP_CONCURRENCY': '2',
+        'SSO_LOOKUP_SAFETY_MARGIN': '0',
+        'SSO_RECORD_ALL_GROUPS': 'true',
+        'METRICS_NAMESPACE': 'CodeWhispererUsageAnalyzer'
+    })
+    index.client = StubIdentityStoreClient(users, groups, {group_id: list(users) for group_id in groups}, 0.1)
+    index.lambda_handler(create_user_batch(users), LambdaContext(0.3))
+
+    documents = read_documents(capsys.readouterr().out)
+    assert_valid_documents(documents)
+
+    skipped = sum(value for name, value in documents[0].items() if name.endswith('Skipped'))
+
+    assert skipped > 0
+
+    #Only the calls which reached the identity store are counted, calls still in flight when the batch was returned are not counted yet
+    for operation in ['DescribeUser', 'IsMemberInGroups', 'DescribeGroup']:
+        calls = documents[0].get('{}Calls'.format(operation), 0)
+        latencies = [value for document in documents for value in document.get('{}Latency'.format(operation), [])]
+
+        assert len(latencies) == calls <= index.client.calls[operation]
+        assert '{}Errors'.format(operation) not in documents[0]
@@ -0,0 +1,88 @@
+import re
+
+import pytest
+
+from events import create_event, create_event_batch, read_record
+from identitystore_stub import StubIdentityStoreClient, create_directory
+from transformer import LambdaContext, load_transformer
+
+from pipeline.glue import TABLE_NAME
+
+#The Python type of each Hive column type in the events written by the transformation function
+COLUMN_TYPES = {
+    'string': str,
+    'timestamp': str,
+    'boolean': bool,
+    'array<string>': list
+}
+
+#The timestamp format the Hive JSON deserializer of Firehose reads by default
+HIVE_TIMESTAMP = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$')
+
+def find_events_table(template):
+
+    return [table['Properties']['TableInput'] for table in template.find_resources('AWS::Glue::Table').values() if table['Properties']['TableInput']['Name'] == TABLE_NAME][0]
+
+#Return the records of the transformation function with every optional field it can write: the groups of each user, the programming language and records whose users could not be looked up in time
+def transform_events(environment):
+
+    users, groups, memberships = create_directory(20, 3)
+    events = [create_event('GenerateCompletions' if position % 3 else 'ListCodeAnalysisFindings', user_id, programming_language='python' if position % 2 else None) for position, user_id in enumerate(users)]
+
+    index = load_transformer(dict(environment, SSO_GROUP_IDS=','.join(groups), SSO_RECORD_ALL_GROUPS='true'))
+    index.client = StubIdentityStoreClient(users, groups, memberships)
+    records = index.lambda_handler(create_event_batch(events), None)['records']
+
+    #With less time left than the safety margin no users are looked up
+    index = load_transformer(dict(environment, SSO_GROUP_IDS=','.join(groups), SSO_RECORD_ALL_GROUPS='true'))
+    index.client = StubIdentityStoreClient(users, groups, memberships)
+    records += index.lambda_handler(create_event_batch(events), LambdaContext(1))['records']
+
+    return [read_record(record) for record in records if record['result'] == 'Ok']
+
+@pytest.mark.parametrize('dynamic_partitioning', [False, True])
+def test_schema_matches_the_transformation_output(synth, dynamic_partitioning):
+
+    template = synth({'output_format': 'parquet', 'dynamic_partitioning': str(dynamic_partitioning).lower(), 'sso_group_ids': 'group-0000', 'record_all_groups': 'true'})
+    columns = {column['Name']: column['Type'] for column in find_events_table(template)['StorageDescriptor']['Columns']}
+
+    records = transform_events({'OUTPUT_FORMAT': 'parquet', 'DYNAMIC_PARTITIONING': str(dynamic_partitioning).lower()})
+
+    assert any(record.get('enrichment_pending') for record in records)
+    assert any('group_names' in record for record in records)
+
+    #Every field written has a column of the matching type, and every column is written by some record. Fields without a column would be lost in the conversion
+    assert set(field for record in records for field in record) == set(columns)
+
+    for record in records:
+        for field, value in record.items():
+            assert isinstance(value, COLUMN_TYPES[columns[field]]), field
+
+        assert HIVE_TIMESTAMP.match(record['event_time'])
+
+def test_event_time_is_only_a_timestamp_in_parquet(synth):
+
+    parquet_columns = dict((column['Name'], column['Type']) for column in find_events_table(synth({'output_format': 'parquet'}))['StorageDescriptor']['Columns'])
+    json_columns = dict((column['Name'], column['Type']) for column in find_events_table(synth({'dynamic_partitioning': 'true'}))['StorageDescriptor']['Columns'])
+
+    assert parquet_columns['event_time'] == 'timestamp'
+    assert json_columns['event_time'] == 'string'
+
+    #JSON events keep the event time as CloudTrail records it
+    assert all(record['event_time'].endswith('Z') for record in transform_events({}))
+
+def test_parquet_crawler_only_adds_partitions_to_the_table(synth):
+
+    crawlers = list(synth({'output_format': 'parquet'}).find_resources('AWS::Glue::Crawler').values())
+
+    assert len(crawlers) == 1
+    assert crawlers[0]['Properties']['Targets'] == {'CatalogTargets': [{'DatabaseName': 'codewhisperer_events', 'Tables': [TABLE_NAME]}]}
+    assert crawlers[0]['Properties']['SchemaChangePolicy'] == {'DeleteBehavior': 'LOG', 'UpdateBehavior': 'LOG'}
+    assert crawlers[0]['Properties']['RecrawlPolicy'] == {'RecrawlBehavior': 'CRAWL_EVERYTHING'}
+
+    #JSON events are crawled from the bucket, which creates the table
+    json_template = synth({})
+    json_crawlers = list(json_template.find_resources('AWS::Glue::Crawler').values())
+
+    assert 'S3Targets' in json_crawlers[0]['Properties']['Targets'] and 'CatalogTargets' not in json_crawlers[0]['Properties']['Targets']
+    assert not any(table['Properties']['TableInput']['Name'] == TABLE_NAME for table in json_template.find_resources('AWS::Glue::Table').values())
@@ -0,0 +1,78 @@
+import re
+
+import pytest
+
+from events import create_event, create_event_batch
+from transformer import load_transformer
+
+from pipeline.glue import TABLE_NAME
+
+def find_stream(template):
+
+    return list(template.find_resources('AWS::KinesisFirehose::DeliveryStream').values())[0]['Properties']['ExtendedS3DestinationConfiguration']
+
+def find_projection(template):
+
+    table = [table for table in template.find_resources('AWS::Glue::Table').values() if table['Properties']['TableInput']['Name'] == TABLE_NAME][0]
+
+    return table['Properties']['TableInput']['Parameters']
+
+#Return the bucket and the folder template of an S3 location, built in the template as s3://BUCKET/FOLDERS
+def split_location(location):
+
+    parts = location['Fn::Join'][1]
+
+    assert parts[0] == 's3://' and 'Ref' in parts[1]
+
+    return parts[1]['Ref'], ''.join(parts[2:]).lstrip('/')
+
+@pytest.mark.parametrize('context', [
+    {},
+    {'output_format': 'parquet'},
+    {'direct_delivery': 'true'},
+    {'spoke_account_ids': '444455556666'}
+], ids=['json', 'parquet', 'direct_delivery', 'hub'])
+def test_location_template_matches_the_firehose_prefix(synth, context):
+
+    template = synth(dict(context, dynamic_partitioning='true'))
+    stream = find_stream(template)
+    projection = find_projection(template)
+
+    bucket, location_template = split_location(projection['storage.location.template'])
+
+    assert stream['BucketARN'] == {'Fn::GetAtt': [bucket, 'Arn']}
+
+    #Each placeholder of the projection is filled from the partition key of the same name, so with the placeholders made alike the two must be identical
+    firehose_folders = re.sub(r'!\{partitionKeyFrom(?:Lambda|Query):([a-z_]+)\}', r'${\1}', stream['Prefix'])
+
+    assert location_template == firehose_folders
+    assert stream['DynamicPartitioningConfiguration']['Enabled'] is True
+
+    #Every projected partition is a partition key of the table
+    table = [table for table in template.find_resources('AWS::Glue::Table').values() if table['Properties']['TableInput']['Name'] == TABLE_NAME][0]
+    partition_keys = [column['Name'] for column in table['Properties']['TableInput']['PartitionKeys']]
+
+    assert re.findall(r'\$\{([a-z_]+)\}', location_template) == partition_keys
+
+    template.resource_count_is('AWS::Glue::Crawler', 0)
+
+#The partition keys returned by the function are the values the projection reads, including the zero padded month and day
+def test_partition_keys_fit_the_projection(synth):
+
+    projection = find_projection(synth({'dynamic_partitioning': 'true'}))
+    index = load_transformer({'DYNAMIC_PARTITIONING': 'true'})
+
+    events = [create_event(event_name, 'user-1') for event_name in ['GenerateCompletions', 'ListCodeAnalysisFindings']]
+
+    for record in index.lambda_handler(create_event_batch(events), None)['records']:
+        partition_keys = record['metadata']['partitionKeys']
+
+        assert partition_keys['account_id'] in projection['projection.account_id.values'].split(',')
+        assert partition_keys['event_type'] in projection['projection.event_type.values'].split(',')
+
+        for key in ['month', 'day']:
+            assert len(partition_keys[key]) == int(projection['projection.{}.digits'.format(key)])
+
+        year_start, year_end = projection['projection.year.range'].split(',')
+
+        assert int(year_start) <= int(partition_keys['year']) <= int(year_end)
@@ -0,0 +1,76 @@
+from events import create_batch, create_event, create_record
+from transformer import load_transformer
+from recent_events import RecentEventIds
+
+def test_full_generation_rotates_and_evicts_the_oldest_ids():
+
+    recent_event_ids = RecentEventIds(4)
+
+    recent_event_ids.update({'event-1': 'record-1', 'event-2': 'record-2'})
+    recent_event_ids.update({'event-3': 'record-3'})
+
+    #The first generation is now the previous one, and is still remembered
+    assert 'event-1' in recent_event_ids
+    assert recent_event_ids.get('event-3') == 'record-3'
+
+    recent_event_ids.update({'event-4': 'record-4', 'event-5': 'record-5'})
+
+    assert 'event-1' not in recent_event_ids
+    assert 'event-2' not in recent_event_ids
+    assert all(event_id in recent_event_ids for event_id in ['event-3', 'event-4', 'event-5'])
+    assert len(recent_event_ids) <= 4
+
+def test_ids_keep_the_first_record_that_carried_them():
+
+    recent_event_ids = RecentEventIds(10)
+
+    recent_event_ids.update({'event-1': 'record-1'})
+    recent_event_ids.update({'event-1': 'record-2'})
+
+    assert recent_event_ids.get('event-1') == 'record-1'
+    assert not recent_event_ids.is_duplicate('event-1', 'record-1')
+    assert recent_event_ids.is_duplicate('event-1', 'record-2')
+    assert not recent_event_ids.is_duplicate('event-2', 'record-2')
+
+def test_copy_within_a_batch_is_dropped():
+
+    index = load_transformer({})
+    event = create_event('GenerateCompletions', 'user-1')
+
+    output = index.lambda_handler(create_batch([create_record(event, 'record-1'), create_record(event, 'record-2')]), None)
+
+    assert [record['result'] for record in output['records']] == ['Ok', 'Dropped']
+
+def test_retried_batch_keeps_its_records():
+
+    index = load_transformer({})
+    events = [create_event('GenerateCompletions', 'user-1'), create_event('GenerateRecommendations', 'user-2')]
+    records = [create_record(event, 'record-{}'.format(position)) for position, event in enumerate(events)]
+
+    #Firehose invokes the function again with the same records when the response was lost
+    first = index.lambda_handler(create_batch([dict(record) for record in records]), None)
+    retry = index.lambda_handler(create_batch([dict(record) for record in records]), None)
+
+    assert [record['result'] for record in first['records']] == ['Ok', 'Ok']
+    assert [record['result'] for record in retry['records']] == ['Ok', 'Ok']
+    assert [record['data'] for record in retry['records']] == [record['data'] for record in first['records']]
+
+def test_copy_in_a_later_batch_is_dropped():
+
+    index = load_transformer({})
+    event = create_event('GenerateCompletions', 'user-1')
+
+    index.lambda_handler(create_batch([create_record(event, 'record-1')]), None)
+    output = index.lambda_handler(create_batch([create_record(event, 'record-2')]), None)
+
+    assert [record['result'] for record in output['records']] == ['Dropped']
+
+def test_window_of_zero_keeps_copies():
+
+    index = load_transformer({'DEDUPLICATION_WINDOW': '0'})
+    event = create_event('GenerateCompletions', 'user-1')
+
+    index.lambda_handler(create_batch([create_record(event, 'record-1')]), None)
+    output = index.lambda_handler(create_batch([create_record(event, 'record-2')]), None)
+
+    assert [record['result'] for record in output['records']] == ['Ok']
@@ -0,0 +1,137 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from events import create_event, create_event_batch, read_record
+from transformer import load_transformer
+
+from tools.compact import LineChecksum, compact_partition, read_current_generation, read_lines
+from tools.layout import partition_path
+from tools.reenrich import FixtureSource, create_user_entries, reenrich_partitions
+
+GROUP_IDS = ['group-1', 'group-2']
+
+FIXTURE = {
+    'd-0000000000': {
+        'users': {'user-1': 'alice', 'user-2': 'bob', 'user-3': 'carol'},
+        'groups': {
+            'group-1': {'name': 'Platform', 'members': ['user-1', 'user-2']},
+            'group-2': {'name': 'Payments', 'members': ['user-3']}
+        }
+    }
+}
+
+#The transformation function is only used to apply the details, as in the tool
+ENVIRONMENT = {'SSO_GROUP_IDS': '', 'SSO_RECORD_ALL_GROUPS': 'false'}
+
+DAY_1 = {'year': '2023', 'month': '08', 'day': '01'}
+DAY_2 = {'year': '2023', 'month': '08', 'day': '02'}
+
+#Return the records the transformation function writes for events of the given users when their details could not be looked up
+def create_pending_records(user_ids, day='01'):
+
+    index = load_transformer({})
+    output = index.lambda_handler(create_event_batch([create_event('GenerateCompletions', user_id, programming_language='python') for user_id in user_ids]), None)
+
+    return [dict(read_record(record), event_time='2023-08-{}T09:00:00Z'.format(day), enrichment_pending=True) for record in output['records']]
+
+def write_events(path, records):
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with gzip.open(path, 'wb') as output:
+        output.writelines((json.dumps(record) + "\n").encode('utf-8') for record in records)
+
+def read_events(path):
+
+    with gzip.open(path) as events_file:
+        return [json.loads(line) for line in events_file]
+
+def load_user_entries(tmp_path):
+
+    fixture_path = os.path.join(str(tmp_path), 'identity.json')
+
+    with open(fixture_path, 'w') as fixture_file:
+        json.dump(FIXTURE, fixture_file)
+
+    return create_user_entries(FixtureSource(fixture_path, GROUP_IDS).get_directories())
+
+def test_pending_events_are_enriched_and_other_files_are_left_alone(tmp_path):
+
+    location = str(tmp_path / 'bucket')
+    user_entries = load_user_entries(tmp_path)
+    day_folder = os.path.join(location, partition_path(DAY_1))
+
+    #A file to update, a file of a user who no longer exists and a file which is already up to date
+    write_events(os.path.join(day_folder, 'pending.gz'), create_pending_records(['user-1', 'user-3', 'user-9']))
+    write_events(os.path.join(day_folder, 'unknown.gz'), create_pending_records(['user-9']))
+
+    index = load_transformer({})
+    current_records = [index.apply_sso_details({key: value for key, value in record.items() if key != 'enrichment_pending'}, user_entries[('d-0000000000', 'user-2')]) for record in create_pending_records(['user-2'])]
+    write_events(os.path.join(day_folder, 'current.gz'), current_records)
+
+    untouched = {name: os.stat(os.path.join(day_folder, name)).st_mtime_ns for name in ['unknown.gz', 'current.gz']}
+
+    totals = reenrich_partitions(location, [DAY_1], ENVIRONMENT, user_entries, workers=2)
+
+    assert totals['files_rewritten'] == 1
+    assert totals['events_updated'] == 2
+    assert totals['unknown_users'] == 2
+
+    events = {event['user_id']: event for event in read_events(os.path.join(day_folder, 'pending.gz'))}
+
+    assert events['user-1']['user_name'] == 'alice'
+    assert events['user-1']['group_name'] == 'Platform'
+    assert events['user-3']['group_id'] == 'group-2'
+    assert 'enrichment_pending' not in events['user-1'] and 'enrichment_pending' not in events['user-3']
+    assert events['user-9']['enrichment_pending'] is True
+
+    for name, modified_at in untouched.items():
+        assert os.stat(os.path.join(day_folder, name)).st_mtime_ns == modified_at
+
+    #Running it again finds nothing to change
+    assert reenrich_partitions(location, [DAY_1], ENVIRONMENT, user_entries, workers=2)['files_rewritten'] == 0
+
+def test_compacted_day_keeps_a_matching_manifest(tmp_path):
+
+    location = str(tmp_path / 'bucket')
+    user_entries = load_user_entries(tmp_path)
+    day_folder = os.path.join(location, partition_path(DAY_2))
+
+    write_events(os.path.join(day_folder, 'first.gz'), create_pending_records(['user-1', 'user-2'], '02'))
+    write_events(os.path.join(day_folder, 'second.gz'), create_pending_records(['user-3'], '02'))
+
+    compacted = compact_partition(location, DAY_2)
+
+    reenrich_partitions(location, [DAY_2], ENVIRONMENT, user_entries, workers=2)
+
+    manifest = read_current_generation(location, 'year=2023/month=08/day=02/')
+    checksum = LineChecksum()
+
+    for line in read_lines([os.path.join(location, manifest['location'], file_name) for file_name in manifest['files']]):
+        checksum.add(line)
+
+    assert manifest['location'] == compacted['location']
+    assert manifest['checksum'] != compacted['checksum']
+    assert (manifest['events'], manifest['checksum']) == checksum.value()
+
+    #Compacting again finds nothing new, and the day is read from the same generation
+    assert compact_partition(location, DAY_2)['location'] == compacted['location']
+    assert all('enrichment_pending' not in event for file_name in manifest['files'] for event in read_events(os.path.join(location, manifest['location'], file_name)))
+
+def test_parquet_files_stop_the_run(tmp_path):
+
+    location = str(tmp_path / 'bucket')
+    user_entries = load_user_entries(tmp_path)
+    pending_path = os.path.join(location, partition_path(DAY_1), 'pending.gz')
+
+    write_events(pending_path, create_pending_records(['user-1']))
+    os.makedirs(os.path.join(location, partition_path(DAY_2)))
+    open(os.path.join(location, partition_path(DAY_2), 'events.parquet'), 'wb').close()
+
+    with pytest.raises(ValueError):
+        reenrich_partitions(location, [DAY_1, DAY_2], ENVIRONMENT, user_entries, workers=2)
+
+    assert all(event.get('enrichment_pending') for event in read_events(pending_path))
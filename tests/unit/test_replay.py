@@ -0,0 +1,135 @@
+import gzip
+import json
+import os
+import re
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from events import create_event
+from transformer import load_transformer
+
+from tools import replay
+from tools.compact import read_lines
+from tools.storage import list_files
+
+ACCOUNT_IDS = ['111122223333', '444455556666']
+
+#The event type each event name is recorded as
+EVENT_TYPES = {
+    'GenerateCompletions': 'CodeSuggestionInvocation',
+    'ListCodeAnalysisFindings': 'SecurityScanInvocation'
+}
+
+#Return CloudTrail records of CodeWhisperer events spread over four days, with records of other services between them
+def create_cloudtrail_records():
+
+    records = []
+    start_time = datetime(2023, 8, 31, 22, tzinfo=timezone.utc)
+
+    for position in range(40):
+        event_name = 'ListCodeAnalysisFindings' if position % 5 == 0 else 'GenerateCompletions'
+        records.append(create_event(event_name, 'user-{}'.format(position % 7), start_time + timedelta(hours=position * 1.5), 'python', account_id=ACCOUNT_IDS[position % 2])['detail'])
+
+        #Strings holding brackets, commas and characters of several bytes must not end a record early
+        if position % 3 == 0:
+            records.append({'eventSource': 's3.amazonaws.com', 'eventName': 'GetObject', 'eventTime': '2023-09-01T00:00:00Z', 'requestParameters': {'key': '], {"Records": [ ], ünïcödé ✓ ['}})
+
+    return records
+
+def write_log_file(path, records, **other_fields):
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with gzip.open(path, 'wb') as output:
+        output.write(json.dumps(dict(other_fields, Records=records), ensure_ascii=False).encode('utf-8'))
+
+    return path
+
+#Fill in the Firehose prefix of the stream with the values of an event
+def render_prefix(prefix, values):
+    return re.sub(r'!\{[A-Za-z]+:([A-Za-z_]+)\}', lambda match: values[match.group(1)], prefix)
+
+@pytest.mark.parametrize('read_size', [1, 7, 100, replay.READ_SIZE])
+def test_records_split_across_reads_are_parsed_whole(tmp_path, monkeypatch, read_size):
+
+    records = create_cloudtrail_records()
+    path = write_log_file(str(tmp_path / 'log.json.gz'), records, digestPublicKeyFingerprint='{"Records": [')
+
+    monkeypatch.setattr(replay, 'READ_SIZE', read_size)
+
+    with open(path, 'rb') as stream:
+        assert list(replay.iter_cloudtrail_records(stream)) == records
+
+def test_truncated_log_file_is_an_error(tmp_path):
+
+    path = str(tmp_path / 'log.json.gz')
+
+    with gzip.open(path, 'wb') as output:
+        output.write(json.dumps({'Records': create_cloudtrail_records()}).encode('utf-8')[:-200])
+
+    with pytest.raises(ValueError):
+        with open(path, 'rb') as stream:
+            list(replay.iter_cloudtrail_records(stream))
+
+def test_log_file_without_records_yields_nothing(tmp_path):
+
+    path = str(tmp_path / 'log.json.gz')
+
+    with gzip.open(path, 'wb') as output:
+        output.write(b'{"CloudTrailEvent": "digest"}')
+
+    with open(path, 'rb') as stream:
+        assert list(replay.iter_cloudtrail_records(stream)) == []
+
+@pytest.mark.parametrize('dynamic_partitioning', [False, True])
+def test_replayed_events_are_written_to_the_firehose_prefix(tmp_path, synth, dynamic_partitioning):
+
+    stream = list(synth({'dynamic_partitioning': str(dynamic_partitioning).lower()}).find_resources('AWS::KinesisFirehose::DeliveryStream').values())[0]
+    prefix = stream['Properties']['ExtendedS3DestinationConfiguration']['Prefix']
+
+    records = create_cloudtrail_records()
+    source_path = write_log_file(str(tmp_path / 'trail' / 'log.json.gz'), records)
+    destination = str(tmp_path / 'bucket')
+
+    environment = {'DYNAMIC_PARTITIONING': str(dynamic_partitioning).lower(), 'DEDUPLICATION_WINDOW': '0'}
+    load_transformer(environment)
+
+    events_read, events_written = replay.replay_files([source_path], destination, environment, None, None)
+
+    expected_folders = {}
+
+    for record in records:
+        if record['eventSource'] == replay.EVENT_SOURCE:
+            year, month, day = record['eventTime'][0:4], record['eventTime'][5:7], record['eventTime'][8:10]
+            folder = render_prefix(prefix, {
+                'yyyy': year, 'MM': month, 'dd': day, 'year': year, 'month': month, 'day': day,
+                'account_id': record['userIdentity']['accountId'],
+                'event_type': EVENT_TYPES[record['eventName']]
+            })
+            expected_folders[folder] = expected_folders.get(folder, 0) + 1
+
+    written_folders = {}
+
+    for path in list_files(destination):
+        folder = os.path.relpath(os.path.dirname(path), destination).replace(os.sep, '/') + '/'
+        written_folders[folder] = written_folders.get(folder, 0) + sum(1 for line in read_lines([path]))
+
+    assert events_read == events_written == 40
+    assert len(expected_folders) > 4 if dynamic_partitioning else len(expected_folders) == 4
+    assert written_folders == expected_folders
+
+def test_deduplication_window_drops_copies_in_later_batches(tmp_path, monkeypatch):
+
+    records = create_cloudtrail_records()
+    events = [record for record in records if record['eventSource'] == replay.EVENT_SOURCE]
+    source_path = write_log_file(str(tmp_path / 'trail' / 'log.json.gz'), records + events[0:5])
+
+    #The copies are read in a later batch than the events they repeat
+    monkeypatch.setattr(replay, 'BATCH_SIZE', 10)
+
+    for deduplication_window, expected_written in [(0, 45), (1000, 40)]:
+        environment = {'DEDUPLICATION_WINDOW': str(deduplication_window)}
+        load_transformer(environment)
+
+        assert replay.replay_files([source_path], str(tmp_path / 'bucket-{}'.format(deduplication_window)), environment, None, None) == (45, expected_written)
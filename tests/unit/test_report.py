@@ -0,0 +1,139 @@
+import base64
+import gzip
+import os
+import random
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from events import create_batches, generate_events, read_record
+from identitystore_stub import StubIdentityStoreClient, create_directory
+from transformer import load_transformer
+
+from pipeline.athena import REPORT_QUERIES
+from tools.layout import event_time_partition, partition_path
+from tools.report import compute_reports
+
+#SQLite refers to its own database as main, so the queries run unchanged against tables of that name
+DATABASE_NAME = 'main'
+
+EVENT_COLUMNS = ['event_id', 'event_time', 'account_id', 'user_id', 'identity_store_arn', 'event_type', 'programming_language', 'user_name', 'group_id', 'group_name']
+
+ACCOUNT_IDS = ['111122223333', '444455556666', '777788889999']
+
+#The month every report is run for, the events also cover the start of the next month which must not be counted
+MONTH_FILTERS = {'year': {'2023'}, 'month': {'08'}}
+QUERY_PARAMETERS = ('2023', '08')
+
+#Write the events of the transformer to a tree of partition folders as Firehose would, and to an SQLite table partitioned the same way. Some events are written twice to a second file of the same partition
+def create_events(location, dynamic_partitioning, duplicate_every=7):
+
+    users, groups, memberships = create_directory(80, 4)
+
+    index = load_transformer({
+        'SSO_GROUP_IDS': ','.join(groups),
+        'DYNAMIC_PARTITIONING': str(dynamic_partitioning).lower(),
+        'DEDUPLICATION_WINDOW': '0'
+    })
+    index.client = StubIdentityStoreClient(users, groups, memberships)
+
+    generator = random.Random(0)
+    events = list(generate_events(3000, list(users), start_time=datetime(2023, 8, 28, tzinfo=timezone.utc), duration=timedelta(days=6)))
+
+    for event in events:
+        event['detail']['userIdentity']['accountId'] = generator.choice(ACCOUNT_IDS)
+
+    database = sqlite3.connect(':memory:')
+    database.execute('CREATE TABLE events ({}, year, month, day)'.format(', '.join(EVENT_COLUMNS)))
+
+    files = {}
+    position = 0
+
+    for batch_number, batch in enumerate(create_batches(events, batch_bytes=256 * 1024)):
+        for record in index.lambda_handler(batch, None)['records']:
+            if record['result'] != 'Ok':
+                continue
+
+            record_data = read_record(record)
+
+            #With dynamic partitioning the account and event type are only stored in the folder names
+            if dynamic_partitioning:
+                partition = record['metadata']['partitionKeys']
+            else:
+                partition = event_time_partition(record_data['event_time'])
+
+            row = dict(record_data, **partition)
+            copies = 2 if position % duplicate_every == 0 else 1
+            position += 1
+
+            for copy in range(copies):
+                path = os.path.join(location, partition_path(partition), 'events-{}-{}.gz'.format(batch_number, copy))
+                files.setdefault(path, []).append(base64.b64decode(record['data']))
+                database.execute('INSERT INTO events VALUES ({})'.format(', '.join(['?'] * (len(EVENT_COLUMNS) + 3))), [row.get(name) for name in EVENT_COLUMNS + ['year', 'month', 'day']])
+
+    for path, lines in files.items():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with gzip.open(path, 'wb') as output:
+            output.writelines(lines)
+
+    return database
+
+#Run every saved report against the table in SQLite
+def run_queries(database, table):
+
+    return {
+        name: database.execute(query.format(database=DATABASE_NAME, table=table), QUERY_PARAMETERS).fetchall()
+        for name, (description, query) in REPORT_QUERIES.items()
+    }
+
+#Order rows with NULL last, as Athena does
+def sort_rows(rows):
+    return sorted(rows, key=lambda row: tuple((value is None, value) for value in row))
+
+def assert_reports_match(reports, results):
+
+    assert reports['total_unique_users'] == results['monthly_unique_users'][0][0]
+    assert reports['user_names'] == [row[0] for row in sort_rows(results['monthly_users'])]
+    assert sort_rows(reports['language_count']) == sort_rows(results['monthly_languages'])
+    assert [count for language, count in reports['language_count']] == [count for language, count in results['monthly_languages']]
+    assert sort_rows(reports['total_users_per_group']) == sort_rows(results['monthly_users_per_group'])
+    assert reports['total_scans'] == results['monthly_security_scans'][0][0]
+
+@pytest.mark.parametrize('dynamic_partitioning', [False, True])
+def test_reports_match_the_saved_queries(tmp_path, dynamic_partitioning):
+
+    database = create_events(str(tmp_path), dynamic_partitioning)
+    reports = compute_reports(str(tmp_path), MONTH_FILTERS, workers=2)
+
+    assert reports['events'] > 0
+    assert_reports_match(reports, run_queries(database, 'events'))
+
+@pytest.mark.parametrize('dynamic_partitioning', [False, True])
+def test_deduplicated_reports_match_the_saved_queries_over_distinct_events(tmp_path, dynamic_partitioning):
+
+    database = create_events(str(tmp_path), dynamic_partitioning)
+    database.execute('CREATE VIEW distinct_events AS SELECT * FROM events WHERE rowid IN (SELECT MIN(rowid) FROM events GROUP BY event_id)')
+
+    reports = compute_reports(str(tmp_path), MONTH_FILTERS, deduplicate=True, workers=2)
+    duplicated_reports = compute_reports(str(tmp_path), MONTH_FILTERS, workers=2)
+
+    assert reports['events'] < duplicated_reports['events']
+    assert_reports_match(reports, run_queries(database, 'distinct_events'))
+
+#Without dynamic partitioning the account and event type are fields of each event rather than folders, so the filters are applied to the events themselves
+@pytest.mark.parametrize('dynamic_partitioning', [False, True])
+def test_account_and_event_type_filters_match_the_saved_queries(tmp_path, dynamic_partitioning):
+
+    database = create_events(str(tmp_path), dynamic_partitioning)
+
+    for account_id in ACCOUNT_IDS[0:2]:
+        for event_type in ['CodeSuggestionInvocation', 'SecurityScanInvocation']:
+            database.execute('DROP VIEW IF EXISTS filtered_events')
+            database.execute("CREATE VIEW filtered_events AS SELECT * FROM events WHERE account_id = '{}' AND event_type = '{}'".format(account_id, event_type))
+
+            reports = compute_reports(str(tmp_path), dict(MONTH_FILTERS, account_id={account_id}, event_type={event_type}), workers=2)
+
+            assert reports['events'] > 0
+            assert_reports_match(reports, run_queries(database, 'filtered_events'))
@@ -0,0 +1,351 @@
+#Merge the small files Firehose writes for each finished day into a few large files, then point the Glue partition of the day at them
+#Usage: python -m tools.compact LOCATION [--start 2023-08-01] [--end 2023-08-31] [--sort] [--glue-table codewhisperer_events.codewhispererevents] [--workers 4]
+#LOCATION is a local directory or S3 URI containing the CodeWhispererEvents folder, for example s3://events-bucket
+#This module also contains the handler of the scheduled compaction function deployed by the stack
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from tools import storage
+from tools.layout import EVENTS_PREFIX, parse_partition, partition_folder
+
+#The folder each compacted day is written to, as CompactedEvents/year=2023/month=08/day=01/GENERATION/
+COMPACTED_PREFIX = 'CompactedEvents'
+
+#The manifest is written last, so a generation is only used once all of its files are complete. Athena ignores files starting with an underscore
+MANIFEST_NAME = '_manifest.json'
+
+#Compacted files are closed and a new one started once this many bytes have been written to them before compression
+MAX_FILE_BYTES = 1024 * 1024 * 1024
+
+#The number of days, before yesterday, the scheduled function compacts. Days which are already compacted are skipped
+LOOKBACK_DAYS = 7
+
+#This class keeps the partition locations in the Glue Data Catalog, so that Athena switches from the original files to the compacted ones in a single update
+class GlueCatalog:
+
+    def __init__(self, database_name, table_name, client=None):
+        self.database_name = database_name
+        self.table_name = table_name
+
+        if client is None:
+            import boto3
+            client = boto3.client('glue')
+
+        self.client = client
+
+    def set_location(self, partition_keys, location):
+
+        values = [partition_keys[key] for key in ['year', 'month', 'day']]
+
+        try:
+            partition = self.client.get_partition(DatabaseName=self.database_name, TableName=self.table_name, PartitionValues=values)['Partition']
+        except self.client.exceptions.EntityNotFoundException:
+            partition = None
+
+        #If the crawler has not added the partition yet create it from the table, otherwise keep everything but the location
+        if partition is None:
+            storage_descriptor = self.client.get_table(DatabaseName=self.database_name, Name=self.table_name)['Table']['StorageDescriptor']
+            storage_descriptor['Location'] = location
+
+            self.client.create_partition(
+                DatabaseName=self.database_name,
+                TableName=self.table_name,
+                PartitionInput={
+                    'Values': values,
+                    'StorageDescriptor': storage_descriptor
+                }
+            )
+        elif partition['StorageDescriptor']['Location'] != location:
+            partition['StorageDescriptor']['Location'] = location
+
+            self.client.update_partition(
+                DatabaseName=self.database_name,
+                TableName=self.table_name,
+                PartitionValueList=values,
+                PartitionInput={
+                    'Values': values,
+                    'StorageDescriptor': partition['StorageDescriptor'],
+                    'Parameters': partition.get('Parameters', {})
+                }
+            )
+
+#Return the path of a file relative to the location, as recorded in the manifests
+def relative_path(location, path):
+
+    if storage.is_s3(location):
+        return path[len(location.rstrip('/')) + 1:]
+
+    return os.path.relpath(path, location).replace(os.sep, '/')
+
+#Return the manifest of the most recent complete generation of a compacted partition, or None if it has not been compacted
+def read_current_generation(location, folder):
+
+    current = None
+
+    for manifest_path in storage.list_files(storage.join(location, COMPACTED_PREFIX, folder), suffixes=(MANIFEST_NAME,)):
+        with storage.open_input(manifest_path) as stream:
+            manifest = json.loads(stream.read())
+
+        if current is None or manifest['created_at'] > current['created_at']:
+            current = manifest
+
+    return current
+
+#Return the files holding the events of a partition. This is the current compacted generation, plus any files written to the partition since it was compacted
+def list_live_files(location, folder):
+
+    manifest = read_current_generation(location, folder)
+
+    if manifest is None:
+        return storage.list_files(storage.join(location, EVENTS_PREFIX, folder))
+
+    compacted_files = [storage.join(location, manifest['location'], file_name) for file_name in manifest['files']]
+    merged_sources = set(manifest['sources'])
+
+    return compacted_files + [
+        path for path in storage.list_files(storage.join(location, EVENTS_PREFIX, folder))
+        if relative_path(location, path) not in merged_sources
+    ]
+
+#This class keeps the number of events and an order independent checksum of their lines, used to check the compacted files hold exactly the original events
+class LineChecksum:
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+
+    def add(self, line):
+        self.count += 1
+        self.total = (self.total + int.from_bytes(hashlib.blake2b(line, digest_size=8).digest(), 'big')) % 2 ** 64
+
+    #Add each line to the checksum as it is passed on, so the files only need to be read once
+    def track(self, lines):
+        for line in lines:
+            self.add(line)
+            yield line
+
+    def value(self):
+        return self.count, '{:016x}'.format(self.total)
+
+#Yield each event line of the files, ending every line with a newline
+def read_lines(paths):
+
+    for path in paths:
+        with storage.open_input(path) as stream:
+            for line in gzip.GzipFile(fileobj=stream):
+                if line.strip() == b'':
+                    continue
+
+                yield line if line.endswith(b'\n') else line + b'\n'
+
+#Write the lines into as few files as possible in the generation folder, returning their names. Each file is written to the working directory before it is published
+def write_generation(lines, generation_location, working_directory):
+
+    file_names = []
+    output = None
+
+    for line in lines:
+        if output is None or output_bytes >= MAX_FILE_BYTES:
+            if output is not None:
+                output.close()
+                storage.publish(local_path, storage.join(generation_location, file_names[-1]))
+
+            file_names.append('part-{:05d}.gz'.format(len(file_names)))
+            local_path = os.path.join(working_directory, file_names[-1])
+            output = gzip.open(local_path, 'wb')
+            output_bytes = 0
+
+        output.write(line)
+        output_bytes += len(line)
+
+    if output is not None:
+        output.close()
+        storage.publish(local_path, storage.join(generation_location, file_names[-1]))
+
+    return file_names
+
+#Write the manifest of a generation, which marks it as complete
+def publish_manifest(location, manifest):
+
+    with tempfile.TemporaryDirectory(prefix='manifest-') as working_directory:
+        manifest_path = os.path.join(working_directory, MANIFEST_NAME)
+
+        with open(manifest_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+
+        storage.publish(manifest_path, storage.join(location, manifest['location'], MANIFEST_NAME))
+
+#Recompute the number of events and checksum of a generation whose files were rewritten in place, for example by the re-enrichment tool, and publish its manifest again
+def refresh_manifest(location, manifest):
+
+    checksum = LineChecksum()
+
+    for line in read_lines([storage.join(location, manifest['location'], file_name) for file_name in manifest['files']]):
+        checksum.add(line)
+
+    manifest = dict(manifest, events=checksum.count, checksum=checksum.value()[1])
+    publish_manifest(location, manifest)
+
+    return manifest
+
+#Compact a single partition. Running it again only merges files that arrived since the last run, and completes any run that was interrupted
+def compact_partition(location, partition_keys, catalog=None, sort=False):
+
+    folder = partition_folder(partition_keys)
+    current = read_current_generation(location, folder)
+
+    merged_sources = set(current['sources']) if current is not None else set()
+    new_sources = [path for path in storage.list_files(storage.join(location, EVENTS_PREFIX, folder)) if relative_path(location, path) not in merged_sources]
+
+    #With dynamic partitioning the table reads each partition from a fixed location using partition projection, so it cannot be switched to the compacted files
+    if any('account_id' in parse_partition(relative_path(location, path)) for path in new_sources):
+        raise ValueError('{} uses dynamic partitioning, which cannot be compacted'.format(folder))
+
+    #A partition with a single file does not need compacting
+    if current is None and len(new_sources) <= 1:
+        return None
+
+    if len(new_sources) > 0:
+        source_files = list_live_files(location, folder)
+        sources = sorted(merged_sources | set(relative_path(location, path) for path in new_sources))
+
+        #The generation is named after the files it merges, so an interrupted run writes to the same generation when repeated
+        generation = hashlib.sha256('\n'.join(sources).encode('utf-8')).hexdigest()[:16]
+        generation_folder = '{}/{}{}/'.format(COMPACTED_PREFIX, folder, generation)
+        generation_location = storage.join(location, generation_folder)
+
+        expected = LineChecksum()
+        lines = expected.track(read_lines(source_files))
+
+        #Sorting groups the events of each user together, which requires holding the partition in memory
+        if sort:
+            lines = sorted(lines, key=lambda line: json.loads(line).get('user_id') or '')
+
+        with tempfile.TemporaryDirectory(prefix='compact-') as working_directory:
+            file_names = write_generation(lines, generation_location, working_directory)
+
+            #Read the compacted files back and check they hold exactly the original events before they replace them
+            actual = LineChecksum()
+
+            for line in read_lines([storage.join(generation_location, file_name) for file_name in file_names]):
+                actual.add(line)
+
+            if actual.value() != expected.value():
+                raise RuntimeError('Compacted files of {} do not match the original files, expected {} events ({}) but found {} ({})'.format(folder, *expected.value(), *actual.value()))
+
+            current = {
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'location': generation_folder,
+                'sources': sources,
+                'files': file_names,
+                'events': expected.count,
+                'checksum': expected.value()[1]
+            }
+
+            publish_manifest(location, current)
+
+    #Switch the partition to the compacted files in one update, then remove the files it replaces
+    if catalog is not None:
+        catalog.set_location(partition_keys, storage.join(location, current['location']).rstrip('/') + '/')
+
+    merged_sources = set(current['sources'])
+    current_files = set(relative_path(location, storage.join(location, current['location'], file_name)) for file_name in current['files'] + [MANIFEST_NAME])
+
+    for path in storage.list_files(storage.join(location, EVENTS_PREFIX, folder)):
+        if relative_path(location, path) in merged_sources:
+            storage.delete(path)
+
+    #Remove the data files of earlier generations before their manifests, so an interrupted clean up never leaves a manifest without its files
+    earlier_files = [
+        path for path in storage.list_files(storage.join(location, COMPACTED_PREFIX, folder), suffixes=('.gz', MANIFEST_NAME))
+        if relative_path(location, path) not in current_files
+    ]
+
+    for path in sorted(earlier_files, key=lambda path: path.endswith(MANIFEST_NAME)):
+        storage.delete(path)
+
+    return current
+
+#Return the partition keys of each day between the start and end dates
+def day_partitions(start, end):
+
+    day = start
+
+    while day <= end:
+        yield {
+            'year': day.strftime('%Y'),
+            'month': day.strftime('%m'),
+            'day': day.strftime('%d')
+        }
+
+        day += timedelta(days=1)
+
+#Compact the days before yesterday, or the days given as a list of YYYY-MM-DD strings. Days are compacted once Firehose has finished writing to them
+def lambda_handler(event, context):
+
+    if 'days' in event:
+        partitions = [next(day_partitions(day, day)) for day in (datetime.strptime(day, '%Y-%m-%d').date() for day in event['days'])]
+    else:
+        today = datetime.now(timezone.utc).date()
+        partitions = list(day_partitions(today - timedelta(days=LOOKBACK_DAYS + 1), today - timedelta(days=2)))
+
+    location = 's3://{}'.format(os.environ['BUCKET_NAME'])
+    catalog = GlueCatalog(os.environ['DATABASE_NAME'], os.environ['TABLE_NAME'])
+    sort = os.environ.get('SORT_EVENTS', 'false').lower() == 'true'
+
+    compacted = {}
+
+    for partition_keys in partitions:
+        manifest = compact_partition(location, partition_keys, catalog, sort)
+
+        if manifest is not None:
+            compacted[partition_folder(partition_keys)] = manifest['events']
+
+    return {
+        'compacted': compacted
+    }
+
+def compact_worker(location, partition_keys, glue_table, sort):
+
+    catalog = GlueCatalog(*glue_table.split('.', 1)) if glue_table is not None else None
+
+    return compact_partition(location, partition_keys, catalog, sort)
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Merge the event files of each finished day into a few large files')
+    parser.add_argument('location', help='Local directory or S3 URI containing the CodeWhispererEvents folder')
+    parser.add_argument('--start', help='First day to compact, in the format 2023-08-01')
+    parser.add_argument('--end', help='Last day to compact, defaults to the day before yesterday (UTC)')
+    parser.add_argument('--sort', action='store_true', help='Sort the events of each day by user_id, this holds each day in memory')
+    parser.add_argument('--glue-table', help='Update the partition locations of this DATABASE.TABLE, required when compacting the events bucket of a deployment')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of days compacted at once')
+    arguments = parser.parse_args()
+
+    today = datetime.now(timezone.utc).date()
+    end = datetime.strptime(arguments.end, '%Y-%m-%d').date() if arguments.end else today - timedelta(days=2)
+    start = datetime.strptime(arguments.start, '%Y-%m-%d').date() if arguments.start else end - timedelta(days=LOOKBACK_DAYS - 1)
+
+    partitions = list(day_partitions(start, end))
+
+    with ProcessPoolExecutor(max_workers=arguments.workers) as executor:
+        results = executor.map(
+            compact_worker,
+            [arguments.location] * len(partitions),
+            partitions,
+            [arguments.glue_table] * len(partitions),
+            [arguments.sort] * len(partitions)
+        )
+
+        for partition_keys, manifest in zip(partitions, results):
+            if manifest is not None:
+                print('{}: {} events in {} files'.format(partition_folder(partition_keys), manifest['events'], len(manifest['files'])))
+
+if __name__ == '__main__':
+    main()
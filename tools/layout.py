@@ -0,0 +1,33 @@
+import re
+
+#The folder the Firehose stream writes the processed events to
+EVENTS_PREFIX = 'CodeWhispererEvents'
+
+#The partition keys in the order they appear in the folder names. account_id and event_type are only present when dynamic partitioning is enabled
+PARTITION_KEYS = ['year', 'month', 'day', 'account_id', 'event_type']
+
+PARTITION_PATTERN = re.compile(r'([a-z_]+)=([^/\\]+)')
+
+#Return the partition folders of the given partition keys, for example year=2023/month=08/day=01/
+def partition_folder(partition_keys):
+
+    return ''.join('{}={}/'.format(key, partition_keys[key]) for key in PARTITION_KEYS if key in partition_keys)
+
+#Return the folder, relative to the bucket, that an event with the given partition keys is stored in
+def partition_path(partition_keys):
+
+    return '{}/{}'.format(EVENTS_PREFIX, partition_folder(partition_keys))
+
+#Return the partition keys of the event time, which starts with the date in the format 2023-08-01 in both output formats
+def event_time_partition(event_time):
+
+    return {
+        'year': event_time[0:4],
+        'month': event_time[5:7],
+        'day': event_time[8:10]
+    }
+
+#Return the partition keys found in a path, for example {'year': '2023', 'month': '08'} for CodeWhispererEvents/year=2023/month=08/
+def parse_partition(path):
+
+    return {key: value for key, value in PARTITION_PATTERN.findall(path) if key in PARTITION_KEYS}
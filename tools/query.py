@@ -0,0 +1,140 @@
+#Run one of the reports saved in the Athena workgroup for a month, reusing the results of an identical query run recently rather than scanning the events again
+#Usage: python -m tools.query NAME --year 2023 --month 08 [--reuse-minutes 60] [--workgroup codewhisperer-analysis] [--json]
+#Run it without a name to list the saved reports
+import argparse
+import json
+import time
+
+#The workgroup created by the stack, which also runs the rollup queries
+WORKGROUP_NAME = 'codewhisperer-analysis'
+
+#The number of seconds to wait between checking whether a query has finished
+POLL_INTERVAL = 1
+
+#Return the saved queries of the workgroup, keyed by name
+def get_named_queries(athena, workgroup):
+
+    named_query_ids = []
+
+    for page in athena.get_paginator('list_named_queries').paginate(WorkGroup=workgroup):
+        named_query_ids += page['NamedQueryIds']
+
+    named_queries = {}
+
+    #Named queries can only be fetched 50 at a time
+    for position in range(0, len(named_query_ids), 50):
+        for named_query in athena.batch_get_named_query(NamedQueryIds=named_query_ids[position:position + 50])['NamedQueries']:
+            named_queries[named_query['Name']] = named_query
+
+    return named_queries
+
+#Run a query with the given execution parameters and wait for it to finish. If the same query was run within the reuse period its results are returned without scanning
+def run_query(athena, workgroup, named_query, parameters, reuse_minutes):
+
+    request = {
+        'QueryString': named_query['QueryString'],
+        'QueryExecutionContext': {
+            'Database': named_query['Database']
+        },
+        'WorkGroup': workgroup
+    }
+
+    if len(parameters) > 0:
+        request['ExecutionParameters'] = parameters
+
+    if reuse_minutes > 0:
+        request['ResultReuseConfiguration'] = {
+            'ResultReuseByAgeConfiguration': {
+                'Enabled': True,
+                'MaxAgeInMinutes': reuse_minutes
+            }
+        }
+
+    query_execution_id = athena.start_query_execution(**request)['QueryExecutionId']
+
+    while True:
+        query_execution = athena.get_query_execution(QueryExecutionId=query_execution_id)['QueryExecution']
+        status = query_execution['Status']
+
+        if status['State'] == 'SUCCEEDED':
+            return query_execution
+
+        if status['State'] in ['FAILED', 'CANCELLED']:
+            raise RuntimeError('Query {} {}: {}'.format(query_execution_id, status['State'], status.get('StateChangeReason', '')))
+
+        time.sleep(POLL_INTERVAL)
+
+#Return the column names and rows of a finished query
+def get_results(athena, query_execution_id):
+
+    columns = None
+    rows = []
+
+    for page in athena.get_paginator('get_query_results').paginate(QueryExecutionId=query_execution_id):
+        if columns is None:
+            columns = [column['Name'] for column in page['ResultSet']['ResultSetMetadata']['ColumnInfo']]
+
+        rows += [[value.get('VarCharValue') for value in row['Data']] for row in page['ResultSet']['Rows']]
+
+    #The first row of the first page holds the column names
+    return columns, rows[1:]
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Run a report saved in the Athena workgroup')
+    parser.add_argument('name', nargs='?', help='Name of the saved report, for example monthly_unique_users. Omit to list the saved reports')
+    parser.add_argument('--year', help='Year of the report, for example 2023')
+    parser.add_argument('--month', help='Month of the report, for example 08')
+    parser.add_argument('--reuse-minutes', type=int, default=60, help='Reuse the results of the same query run within this many minutes, 0 to always run it')
+    parser.add_argument('--workgroup', default=WORKGROUP_NAME, help='Athena workgroup the reports are saved in')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    arguments = parser.parse_args()
+
+    import boto3
+    athena = boto3.client('athena')
+
+    named_queries = get_named_queries(athena, arguments.workgroup)
+
+    if arguments.name is None:
+        for name, named_query in sorted(named_queries.items()):
+            print('{:<40} {}'.format(name, named_query.get('Description', '')))
+        return
+
+    if arguments.name not in named_queries:
+        parser.error('No saved report named {} in the {} workgroup'.format(arguments.name, arguments.workgroup))
+
+    named_query = named_queries[arguments.name]
+    parameters = []
+
+    #Reports which take parameters always filter on the year and month, so they only read the partitions of one month
+    if '?' in named_query['QueryString']:
+        if arguments.year is None or arguments.month is None:
+            parser.error('{} requires --year and --month'.format(arguments.name))
+
+        #Execution parameters are SQL literals, so the partition values are quoted as strings
+        parameters = ["'{}'".format(arguments.year), "'{}'".format(arguments.month.zfill(2))]
+
+    query_execution = run_query(athena, arguments.workgroup, named_query, parameters, arguments.reuse_minutes)
+    columns, rows = get_results(athena, query_execution['QueryExecutionId'])
+
+    reused = query_execution['Statistics'].get('ResultReuseInformation', {}).get('ReusedPreviousResult', False)
+    scanned = query_execution['Statistics'].get('DataScannedInBytes', 0)
+
+    if arguments.json:
+        print(json.dumps({
+            'columns': columns,
+            'rows': rows,
+            'reused_previous_result': reused,
+            'data_scanned_bytes': scanned
+        }, indent=2))
+        return
+
+    print('\t'.join(columns))
+
+    for row in rows:
+        print('\t'.join('' if value is None else value for value in row))
+
+    print('\n{} rows, {}'.format(len(rows), 'reused previous result' if reused else '{:,} bytes scanned'.format(scanned)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+#Rewrite the user and group details of events already in the events bucket, for example after groups were added to SSO_GROUP_IDS or reorganised
+#Usage: python -m tools.reenrich LOCATION --start 2023-08-01 --end 2023-08-31 --sso-group-ids GROUP_ID_1,GROUP_ID_2 [--record-all-groups] [--workers 4] [--dry-run]
+#LOCATION is a local directory or S3 URI containing the CodeWhispererEvents folder, for example s3://events-bucket
+#Users and groups are listed once from IAM Identity Center, or read from a fixture file with --identity-fixture, in the format
+#{"IDENTITY_STORE_ID": {"users": {"USER_ID": "USER_NAME"}, "groups": {"GROUP_ID": {"name": "GROUP_NAME", "members": ["USER_ID"]}}}}
+import argparse
+import gzip
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from tools import storage
+from tools.compact import day_partitions, list_live_files, read_current_generation, refresh_manifest
+from tools.layout import EVENTS_PREFIX, partition_folder
+from tools.replay import load_transformation
+
+#The longest the members of the groups may take to list. Unlike the transformation function there is no batch waiting on the result
+SWEEP_TIMEOUT = 900
+
+#The fields written by the enrichment, which are replaced on each event
+ENRICHMENT_FIELDS = ['user_name', 'group_id', 'group_name', 'group_ids', 'group_names', 'enrichment_pending']
+
+#This class lists the users and group members of an identity store from IAM Identity Center, with one paginated pass over the users and each group
+class IdentityStoreSource:
+
+    def __init__(self, group_ids, identity_store_id=None, region=None, concurrency=8):
+        self.group_ids = group_ids
+        self.identity_store_id = identity_store_id
+        self.region = region
+        self.concurrency = concurrency
+
+    #Return the directory of each identity store, keyed by identity store ID
+    def get_directories(self):
+
+        import boto3
+        from botocore.config import Config
+        from group_directory import GroupDirectory
+
+        #Unlike the transformation function nothing is waiting on the calls, so the SDK retries throttled calls itself
+        client = boto3.client('identitystore', region_name=self.region, config=Config(retries={'mode': 'adaptive', 'max_attempts': 10}))
+
+        identity_store_id = self.identity_store_id
+
+        #An organisation has a single IAM Identity Center instance, so its identity store is used unless another is given
+        if identity_store_id is None:
+            instances = boto3.client('sso-admin', region_name=self.region).list_instances()['Instances']
+
+            if len(instances) != 1:
+                raise ValueError('Found {} IAM Identity Center instances, specify the identity store with --identity-store-id'.format(len(instances)))
+
+            identity_store_id = instances[0]['IdentityStoreId']
+
+        user_names = {}
+
+        for page in client.get_paginator('list_users').paginate(IdentityStoreId=identity_store_id):
+            for user in page['Users']:
+                user_names[user['UserId']] = user['UserName']
+
+        #The group directory of the transformation function lists the members of every group concurrently and keeps the groups of each user in the configured order
+        directory = GroupDirectory(
+            lambda operation, **kwargs: getattr(client, operation)(**kwargs),
+            self.group_ids,
+            sweep_timeout=SWEEP_TIMEOUT,
+            concurrency=self.concurrency
+        ).sweep(identity_store_id)
+
+        if not directory['complete']:
+            raise RuntimeError('Listing the members of the groups in {} did not complete'.format(identity_store_id))
+
+        return {
+            identity_store_id: {
+                'user_names': user_names,
+                'group_names': directory['group_names'],
+                'user_groups': directory['user_groups']
+            }
+        }
+
+#This class reads the users and groups from a JSON fixture file, so events can be re-enriched without calling AWS
+class FixtureSource:
+
+    def __init__(self, path, group_ids):
+        self.path = path
+        self.group_ids = group_ids
+
+    def get_directories(self):
+
+        with open(self.path) as fixture_file:
+            fixture = json.load(fixture_file)
+
+        directories = {}
+
+        for identity_store_id, identity_store in fixture.items():
+            groups = identity_store.get('groups', {})
+            user_groups = {}
+
+            #Only the configured groups are recorded, in the configured order
+            for group_id in self.group_ids:
+                for user_id in groups.get(group_id, {}).get('members', []):
+                    user_groups.setdefault(user_id, []).append(group_id)
+
+            directories[identity_store_id] = {
+                'user_names': identity_store.get('users', {}),
+                'group_names': {group_id: groups[group_id]['name'] for group_id in self.group_ids if group_id in groups},
+                'user_groups': user_groups
+            }
+
+        return directories
+
+#Return the cache entry the transformation function would create for each user of each identity store, keyed by (identity_store_id, user_id)
+def create_user_entries(directories):
+
+    user_entries = {}
+
+    for identity_store_id, directory in directories.items():
+        for user_id, user_name in directory['user_names'].items():
+            member_group_ids = directory['user_groups'].get(user_id, [])
+
+            user_entry = {
+                'user_name': user_name,
+                'group_id': member_group_ids[0] if len(member_group_ids) > 0 else None,
+                'group_ids': member_group_ids,
+                'group_names': [directory['group_names'][group_id] for group_id in member_group_ids]
+            }
+
+            if user_entry['group_id'] is not None:
+                user_entry['group_name'] = user_entry['group_names'][0]
+
+            user_entries[(identity_store_id, user_id)] = user_entry
+
+    return user_entries
+
+#The transformation function and user entries are loaded once in each worker process, rather than sent with every file
+worker_state = {}
+
+def initialise_worker(environment, user_entries):
+
+    worker_state['index'] = load_transformation(environment)
+    worker_state['user_entries'] = user_entries
+
+#Rewrite a single file with the current user and group details, returning the number of events read, updated and left unchanged as their user was not found.
+#The file is only replaced if an event changed, by writing it to the same path so readers see either the old or the new file
+def reenrich_file(path, dry_run=False):
+
+    index = worker_state['index']
+    user_entries = worker_state['user_entries']
+
+    events_read = 0
+    events_updated = 0
+    unknown_users = 0
+
+    local_path = os.path.join(tempfile.mkdtemp(prefix='reenrich-'), 'events.gz')
+
+    with storage.open_input(path) as stream, gzip.open(local_path, 'wb') as output:
+        for line in gzip.GzipFile(fileobj=stream):
+            if line.strip() == b'':
+                continue
+
+            events_read += 1
+            record_data = json.loads(line)
+            user_entry = user_entries.get((index.get_identity_store_id(record_data), record_data['user_id']))
+
+            #Users which no longer exist keep the details they were written with
+            if user_entry is None:
+                unknown_users += 1
+                output.write(line)
+                continue
+
+            enriched = index.apply_sso_details({key: value for key, value in record_data.items() if key not in ENRICHMENT_FIELDS}, user_entry)
+
+            if enriched == record_data:
+                output.write(line)
+                continue
+
+            events_updated += 1
+            output.write((json.dumps(enriched) + "\n").encode('utf-8'))
+
+    if events_updated > 0 and not dry_run:
+        storage.publish(local_path, path)
+    else:
+        os.remove(local_path)
+
+    os.rmdir(os.path.dirname(local_path))
+
+    return events_read, events_updated, unknown_users
+
+#Re-enrich the events of the given day partitions with the user entries, returning the number of files and events read, updated and left unchanged
+def reenrich_partitions(location, partitions, environment, user_entries, workers=os.cpu_count(), dry_run=False):
+
+    folders = [partition_folder(partition_keys) for partition_keys in partitions]
+
+    #Only GZIP compressed JSON is rewritten, so stop before changing anything if the days hold Parquet files
+    parquet_files = [path for folder in folders for path in storage.list_files(storage.join(location, EVENTS_PREFIX, folder), suffixes=('.parquet',))]
+
+    if len(parquet_files) > 0:
+        raise ValueError('Found {} Parquet files, such as {}. Events written as Parquet cannot be re-enriched'.format(len(parquet_files), parquet_files[0]))
+
+    #Compacted days are rewritten in their compacted files, along with any files written since they were compacted
+    folder_files = {folder: list_live_files(location, folder) for folder in folders}
+    files = [path for paths in folder_files.values() for path in paths]
+
+    totals = {
+        'files': len(files),
+        'files_rewritten': 0,
+        'events_read': 0,
+        'events_updated': 0,
+        'unknown_users': 0
+    }
+
+    rewritten_files = set()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=initialise_worker, initargs=(environment, user_entries)) as executor:
+        for path, (file_read, file_updated, file_unknown) in zip(files, executor.map(reenrich_file, files, [dry_run] * len(files))):
+            totals['events_read'] += file_read
+            totals['events_updated'] += file_updated
+            totals['unknown_users'] += file_unknown
+
+            if file_updated > 0:
+                totals['files_rewritten'] += 1
+                rewritten_files.add(path)
+
+    #The manifest of a compacted day records the checksum of its files, so it is updated to match the rewritten files
+    if not dry_run:
+        for folder, paths in folder_files.items():
+            manifest = read_current_generation(location, folder)
+
+            if manifest is not None and any(storage.join(location, manifest['location'], file_name) in rewritten_files for file_name in manifest['files']):
+                refresh_manifest(location, manifest)
+
+    return totals
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Rewrite the user and group details of events already in the events bucket')
+    parser.add_argument('location', help='Local directory or S3 URI containing the CodeWhispererEvents folder')
+    parser.add_argument('--start', required=True, help='First day to re-enrich, in the format 2023-08-01')
+    parser.add_argument('--end', required=True, help='Last day to re-enrich, in the format 2023-08-31')
+    parser.add_argument('--sso-group-ids', required=True, help='Comma separated SSO group IDs to enrich the events with, as used in the stack')
+    parser.add_argument('--record-all-groups', action='store_true', help='Also record every group in the group_ids and group_names fields, as used in the stack')
+    parser.add_argument('--sso-region', help='Region of IAM Identity Center, if different from the default region')
+    parser.add_argument('--identity-store-id', help='Identity store to list the users of, defaults to the identity store of the IAM Identity Center instance')
+    parser.add_argument('--identity-fixture', help='Read the users and groups from this JSON file rather than IAM Identity Center')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes')
+    parser.add_argument('--dry-run', action='store_true', help='Count the events which would change without rewriting any files')
+    arguments = parser.parse_args()
+
+    group_ids = [group_id.strip() for group_id in arguments.sso_group_ids.split(',') if group_id.strip() != '']
+
+    #The transformation function is only used to apply the details, so it is loaded without groups and never calls IAM Identity Center itself
+    environment = {
+        'SSO_GROUP_IDS': '',
+        'SSO_RECORD_ALL_GROUPS': str(arguments.record_all_groups).lower()
+    }
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    load_transformation(environment)
+
+    if arguments.identity_fixture is not None:
+        identity_source = FixtureSource(arguments.identity_fixture, group_ids)
+    else:
+        identity_source = IdentityStoreSource(group_ids, arguments.identity_store_id, arguments.sso_region)
+
+    user_entries = create_user_entries(identity_source.get_directories())
+
+    start = datetime.strptime(arguments.start, '%Y-%m-%d').date()
+    end = datetime.strptime(arguments.end, '%Y-%m-%d').date()
+
+    totals = reenrich_partitions(arguments.location, list(day_partitions(start, end)), environment, user_entries, arguments.workers, arguments.dry_run)
+
+    print('{} {} of {} files: {} events read, {} updated, {} left unchanged as their user was not found'.format(
+        'Would rewrite' if arguments.dry_run else 'Rewrote',
+        totals['files_rewritten'], totals['files'], totals['events_read'], totals['events_updated'], totals['unknown_users']
+    ))
+
+if __name__ == '__main__':
+    main()
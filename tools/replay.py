@@ -0,0 +1,267 @@
+#Replay CodeWhisperer events from CloudTrail log files through the Firehose transformation, writing them in the same layout as the Firehose stream
+#Usage: python -m tools.replay SOURCE DESTINATION [--workers 4] [--start 2023-08-01] [--end 2023-08-31] [--sso-group-ids GROUP_ID_1,GROUP_ID_2] [--deduplication-window 100000]
+#SOURCE is a local directory or S3 URI containing CloudTrail .json.gz log files, for example s3://trail-bucket/AWSLogs/111122223333/CloudTrail/
+#DESTINATION is a local directory or S3 URI, for example s3://events-bucket. Events are written under CodeWhispererEvents/
+import argparse
+import base64
+import gzip
+import io
+import json
+import os
+import sys
+import tempfile
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from tools import storage
+from tools.layout import event_time_partition, partition_path
+
+#The transformation function is packaged from its own directory, so its modules import each other by name
+TRANSFORMATION_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pipeline', 'firehose_transformation')
+
+#The events matched by the EventBridge rule in the stack
+EVENT_SOURCE = 'codewhisperer.amazonaws.com'
+EVENT_NAMES = ['GenerateCompletions', 'GenerateRecommendations', 'ListCodeAnalysisFindings']
+
+#The amount of decompressed text read from a log file at a time
+READ_SIZE = 1024 * 1024
+
+#The number of events passed to the transformation at a time
+BATCH_SIZE = 500
+
+#Output files are closed and a new one started once this many bytes have been written to them before compression, and at most this many are kept open by each worker
+MAX_FILE_BYTES = 1024 * 1024 * 1024
+MAX_OPEN_FILES = 64
+
+#Yield each entry of the Records list of a CloudTrail log file, reading the file a chunk at a time rather than loading it all
+def iter_cloudtrail_records(stream):
+
+    decoder = json.JSONDecoder()
+    text = io.TextIOWrapper(gzip.GzipFile(fileobj=stream), encoding='utf-8')
+
+    buffer = ''
+    position = 0
+    end_of_file = False
+
+    #Read more of the file into the buffer, discarding what has already been parsed. Returns False once the end of the file is reached
+    def read_more():
+        nonlocal buffer, position, end_of_file
+
+        chunk = text.read(READ_SIZE)
+
+        if chunk == '':
+            end_of_file = True
+            return False
+
+        buffer = buffer[position:] + chunk
+        position = 0
+
+        return True
+
+    #Find the start of the Records list
+    while True:
+        start = buffer.find('"Records"', position)
+
+        if start != -1 and buffer.find('[', start) != -1:
+            position = buffer.find('[', start) + 1
+            break
+
+        if not read_more():
+            return
+
+    while True:
+        #Skip the whitespace and commas between records
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+
+        if position >= len(buffer):
+            if not read_more():
+                raise ValueError('CloudTrail log file ended before the end of the Records list')
+            continue
+
+        if buffer[position] == ']':
+            return
+
+        try:
+            record, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            #The record continues past the end of the buffer
+            if end_of_file or not read_more():
+                raise
+            continue
+
+        yield record
+
+#This class writes the transformed events into gzip files for each partition, in a local staging folder until they are finished
+class PartitionWriter:
+
+    def __init__(self, destination):
+        self.destination = destination
+        self.staging_directory = tempfile.mkdtemp(prefix='replay-')
+        self.open_files = OrderedDict()
+        self.files = {}
+        self.file_bytes = {}
+        self.events_written = 0
+
+    def write(self, partition, line):
+
+        if partition not in self.open_files:
+            #Close the least recently used file if too many are open. It is reopened as a new gzip member if more events arrive for it
+            if len(self.open_files) >= MAX_OPEN_FILES:
+                self.open_files.popitem(last=False)[1].close()
+
+            if partition not in self.files:
+                self.files[partition] = os.path.join(self.staging_directory, '{}.gz'.format(uuid.uuid4()))
+                self.file_bytes[partition] = 0
+
+            self.open_files[partition] = gzip.open(self.files[partition], 'ab')
+
+        self.open_files.move_to_end(partition)
+        self.open_files[partition].write(line)
+        self.file_bytes[partition] += len(line)
+        self.events_written += 1
+
+        #Start a new file once this one is large enough
+        if self.file_bytes[partition] >= MAX_FILE_BYTES:
+            self.open_files.pop(partition).close()
+            self.publish(partition)
+
+    def publish(self, partition):
+
+        local_path = self.files.pop(partition)
+        del self.file_bytes[partition]
+        storage.publish(local_path, storage.join(self.destination, partition, 'replay-{}.gz'.format(uuid.uuid4())))
+
+    #Close every file and move it to the destination
+    def finish(self):
+
+        for open_file in self.open_files.values():
+            open_file.close()
+
+        self.open_files.clear()
+
+        for partition in list(self.files):
+            self.publish(partition)
+
+        os.rmdir(self.staging_directory)
+
+#Load the transformation function with the given environment
+def load_transformation(environment):
+
+    os.environ.update(environment)
+    os.environ.setdefault('SSO_GROUP_IDS', '')
+
+    if TRANSFORMATION_PATH not in sys.path:
+        sys.path.insert(0, TRANSFORMATION_PATH)
+
+    import index
+    return index
+
+#Run a batch of CloudTrail records through the transformation and write the results. Record IDs are numbered on from the given one, so each event a worker reads has its own record ID as it would in Firehose
+def transform_batch(index, batch, writer, first_record_id=0):
+
+    firehose_event = {
+        'records': [
+            {
+                'recordId': str(first_record_id + position),
+                'data': base64.b64encode(json.dumps({'detail': record}).encode('utf-8'))
+            }
+            for position, record in enumerate(batch)
+        ]
+    }
+
+    for record in index.lambda_handler(firehose_event, None)['records']:
+        if record['result'] != 'Ok':
+            continue
+
+        #Events are partitioned by their own event time, or by the partition keys returned by the function when dynamic partitioning is enabled
+        if 'metadata' in record:
+            partition = partition_path(record['metadata']['partitionKeys'])
+        else:
+            partition = partition_path(event_time_partition(batch[int(record['recordId']) - first_record_id]['eventTime']))
+
+        writer.write(partition, base64.b64decode(record['data']))
+
+#Process a list of log files in a worker process, returning the number of events read and written
+def replay_files(files, destination, environment, start, end):
+
+    index = load_transformation(environment)
+    writer = PartitionWriter(destination)
+
+    events_read = 0
+    batch = []
+
+    for path in files:
+        with storage.open_input(path) as stream:
+            for record in iter_cloudtrail_records(stream):
+                #Only keep the events which would have matched the EventBridge rule, within the requested time range
+                if record.get('eventSource') != EVENT_SOURCE or record.get('eventName') not in EVENT_NAMES:
+                    continue
+
+                if (start is not None and record['eventTime'] < start) or (end is not None and record['eventTime'] >= end):
+                    continue
+
+                events_read += 1
+                batch.append(record)
+
+                if len(batch) >= BATCH_SIZE:
+                    transform_batch(index, batch, writer, events_read - len(batch))
+                    batch = []
+
+    if len(batch) > 0:
+        transform_batch(index, batch, writer, events_read - len(batch))
+
+    writer.finish()
+
+    return events_read, writer.events_written
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Replay CodeWhisperer events from CloudTrail log files')
+    parser.add_argument('source', help='Local directory or S3 URI containing CloudTrail log files')
+    parser.add_argument('destination', help='Local directory or S3 URI to write the events to')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes')
+    parser.add_argument('--start', help='Only replay events at or after this time, for example 2023-08-01')
+    parser.add_argument('--end', help='Only replay events before this time, for example 2023-09-01')
+    parser.add_argument('--sso-group-ids', default='', help='Comma separated SSO group IDs to enrich the events with, as used in the stack')
+    parser.add_argument('--sso-region', help='Region of IAM Identity Center, if different from the default region')
+    parser.add_argument('--dynamic-partitioning', action='store_true', help='Write events in the dynamic partitioning layout')
+    parser.add_argument('--deduplication-window', type=int, default=0, help='Drop copies of the last N events read by each worker process, workers do not share the events they have seen. Defaults to 0, which keeps every event')
+    arguments = parser.parse_args()
+
+    environment = {
+        'SSO_GROUP_IDS': arguments.sso_group_ids,
+        'DYNAMIC_PARTITIONING': str(arguments.dynamic_partitioning).lower(),
+        'DEDUPLICATION_WINDOW': str(arguments.deduplication_window)
+    }
+
+    if arguments.sso_region is not None:
+        environment['SSO_REGION'] = arguments.sso_region
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+    files = storage.list_files(arguments.source, suffixes=('.json.gz',))
+
+    #Spread the files across more tasks than workers, so that a few large files do not leave the other workers idle
+    task_count = min(len(files), arguments.workers * 4)
+    tasks = [files[position::task_count] for position in range(task_count)]
+
+    events_read = 0
+    events_written = 0
+
+    with ProcessPoolExecutor(max_workers=arguments.workers) as executor:
+        futures = [
+            executor.submit(replay_files, task, storage.join(arguments.destination), environment, arguments.start, arguments.end)
+            for task in tasks
+        ]
+
+        for future in futures:
+            task_read, task_written = future.result()
+            events_read += task_read
+            events_written += task_written
+
+    print('Replayed {} log files: {} CodeWhisperer events read, {} written, {} dropped'.format(len(files), events_read, events_written, events_read - events_written))
+
+if __name__ == '__main__':
+    main()
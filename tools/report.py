@@ -0,0 +1,231 @@
+#Compute the example reports from the README directly from the events written by the Firehose stream, without using Athena
+#Usage: python -m tools.report LOCATION --year 2023 --month 08 [--day 01] [--account-id 111122223333] [--event-type SecurityScanInvocation] [--deduplicate] [--json]
+#LOCATION is a local directory or S3 URI containing the CodeWhispererEvents folder, for example s3://events-bucket. Compacted days are read from their compacted files
+import argparse
+import gzip
+import json
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from tools import storage
+from tools.compact import COMPACTED_PREFIX, list_live_files
+from tools.layout import EVENTS_PREFIX, parse_partition, partition_folder
+
+#Use orjson to parse the events when it is installed as it is considerably faster, otherwise fall back to the standard library
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+#Return the folders under the location which match the partition filters. Only the folders of matching partitions are listed, so other days are never read
+def prune_partitions(location, filters):
+
+    partition_folders = []
+
+    for folder in storage.list_folders(location):
+        partition = parse_partition(folder.rstrip('/\\').replace('\\', '/').split('/')[-1])
+
+        if len(partition) == 0:
+            continue
+
+        key, value = next(iter(partition.items()))
+
+        if key in filters and value not in filters[key]:
+            continue
+
+        partition_folders.append(folder)
+
+    #A folder without partition folders below it holds the event files
+    if len(partition_folders) == 0:
+        return [location]
+
+    return [leaf for folder in partition_folders for leaf in prune_partitions(folder, filters)]
+
+#This class holds the running totals needed for each report. Its size grows with the number of users, groups and languages rather than the number of events
+class ReportTotals:
+
+    def __init__(self):
+        self.event_count = 0
+        self.user_ids = set()
+        self.user_names = set()
+        self.language_counts = Counter()
+        self.group_user_ids = {}
+        self.event_type_counts = Counter()
+
+    def add(self, event):
+        self.event_count += 1
+
+        if event.get('user_id') is not None:
+            self.user_ids.add(event['user_id'])
+
+        #SELECT DISTINCT includes NULL as a value
+        self.user_names.add(event.get('user_name'))
+
+        if event.get('programming_language') is not None:
+            self.language_counts[event['programming_language']] += 1
+
+        group_user_ids = self.group_user_ids.setdefault(event.get('group_name'), set())
+
+        if event.get('user_id') is not None:
+            group_user_ids.add(event['user_id'])
+
+        self.event_type_counts[event.get('event_type')] += 1
+
+    def merge(self, other):
+        self.event_count += other.event_count
+        self.user_ids.update(other.user_ids)
+        self.user_names.update(other.user_names)
+        self.language_counts.update(other.language_counts)
+
+        for group_name, user_ids in other.group_user_ids.items():
+            self.group_user_ids.setdefault(group_name, set()).update(user_ids)
+
+        self.event_type_counts.update(other.event_type_counts)
+
+    #Return the results of the README queries
+    def reports(self):
+        return {
+            'events': self.event_count,
+            'total_unique_users': len(self.user_ids),
+            'user_names': sorted(self.user_names, key=lambda name: (name is None, name)),
+            'language_count': sorted(self.language_counts.items(), key=lambda item: (-item[1], item[0])),
+            'total_users_per_group': sorted(
+                [(group_name, len(user_ids)) for group_name, user_ids in self.group_user_ids.items()],
+                key=lambda item: (-item[1], item[0] is None, item[0])
+            ),
+            'total_scans': self.event_type_counts.get('SecurityScanInvocation', 0)
+        }
+
+#Read a list of event files in a worker process and return their totals. When deduplicating, the files must all be from the same partition as IDs are only compared within a task
+def read_files(files, filters, deduplicate=False):
+
+    totals = ReportTotals()
+    event_ids = set()
+
+    for path in files:
+        #With dynamic partitioning account_id and event_type are only stored in the folder names
+        partition = parse_partition(path)
+
+        with storage.open_input(path) as stream:
+            for line in gzip.GzipFile(fileobj=stream):
+                if line.strip() == b'':
+                    continue
+
+                event = json_loads(line)
+
+                for key in ['account_id', 'event_type']:
+                    if key in partition:
+                        event[key] = partition[key]
+
+                #Filters on fields which are not partitions in this layout are applied to each event
+                if any(key in event and event[key] not in values for key, values in filters.items()):
+                    continue
+
+                #Only count the first copy of an event that was delivered more than once. Events recorded before the event ID was kept are always counted
+                if deduplicate and event.get('event_id') is not None:
+                    if event['event_id'] in event_ids:
+                        continue
+
+                    event_ids.add(event['event_id'])
+
+                totals.add(event)
+
+    return totals
+
+#Compute the reports from the events under the location which match the partition filters, reading the files across a pool of worker processes
+def compute_reports(location, filters, deduplicate=False, workers=os.cpu_count()):
+
+    #Compacted days may also hold files written since they were compacted, so each partition found in either folder is read from its live files
+    partitions = set()
+
+    for prefix in [EVENTS_PREFIX, COMPACTED_PREFIX]:
+        for folder in prune_partitions(storage.join(location, prefix), filters):
+            partition = parse_partition(folder.replace('\\', '/'))
+
+            if len(partition) > 0:
+                partitions.add(partition_folder(partition))
+
+    folder_files = [list_live_files(location, folder) for folder in sorted(partitions)]
+    files = [path for paths in folder_files for path in paths]
+
+    #Only the fields which are not partitions of the files need to be checked on each event
+    event_filters = {key: values for key, values in filters.items() if key in ['account_id', 'event_type']}
+
+    totals = ReportTotals()
+
+    #Copies of an event are written to the same partition, so deduplicating reads each partition in a single task. Memory is then bounded by the events of one partition
+    if deduplicate:
+        tasks = [paths for paths in folder_files if len(paths) > 0]
+    elif len(files) > 0:
+        task_count = min(len(files), workers * 4)
+        tasks = [files[position::task_count] for position in range(task_count)]
+    else:
+        tasks = []
+
+    if len(tasks) > 0:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for task_totals in executor.map(read_files, tasks, [event_filters] * len(tasks), [deduplicate] * len(tasks)):
+                totals.merge(task_totals)
+
+    return totals.reports()
+
+def print_reports(reports):
+
+    print('Events:                 {}'.format(reports['events']))
+    print('Unique users:           {}'.format(reports['total_unique_users']))
+    print('Security scans:         {}'.format(reports['total_scans']))
+
+    print('\nUsers:')
+    for user_name in reports['user_names']:
+        print('    {}'.format(user_name))
+
+    print('\nLanguages:')
+    for language, count in reports['language_count']:
+        print('    {:<30} {}'.format(language, count))
+
+    print('\nUnique users per group:')
+    for group_name, count in reports['total_users_per_group']:
+        print('    {:<30} {}'.format(str(group_name), count))
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Compute the example reports from the events bucket without Athena')
+    parser.add_argument('location', help='Local directory or S3 URI containing the CodeWhispererEvents folder')
+    parser.add_argument('--year', action='append', help='Only include this year, can be repeated')
+    parser.add_argument('--month', action='append', help='Only include this month, for example 08, can be repeated')
+    parser.add_argument('--day', action='append', help='Only include this day of the month, for example 01, can be repeated')
+    parser.add_argument('--account-id', action='append', help='Only include this account, can be repeated')
+    parser.add_argument('--event-type', action='append', help='Only include this event type, can be repeated')
+    parser.add_argument('--deduplicate', action='store_true', help='Count events delivered more than once only once, comparing events within each partition')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes')
+    parser.add_argument('--json', action='store_true', help='Print the reports as JSON')
+    arguments = parser.parse_args()
+
+    filters = {}
+
+    if arguments.year:
+        filters['year'] = set(arguments.year)
+
+    #Months and days are zero padded in the folder names
+    if arguments.month:
+        filters['month'] = set(month.zfill(2) for month in arguments.month)
+
+    if arguments.day:
+        filters['day'] = set(day.zfill(2) for day in arguments.day)
+
+    if arguments.account_id:
+        filters['account_id'] = set(arguments.account_id)
+
+    if arguments.event_type:
+        filters['event_type'] = set(arguments.event_type)
+
+    reports = compute_reports(arguments.location, filters, arguments.deduplicate, arguments.workers)
+
+    if arguments.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        print_reports(reports)
+
+if __name__ == '__main__':
+    main()
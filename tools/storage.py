@@ -0,0 +1,113 @@
+import os
+import shutil
+
+#Locations can either be a local directory or an S3 URI in the format s3://bucket/prefix
+def is_s3(location):
+    return location.startswith('s3://')
+
+#Split an S3 URI into its bucket and key
+def split_s3_uri(uri):
+
+    bucket, _, key = uri[len('s3://'):].partition('/')
+
+    return bucket, key
+
+#The S3 client is only created when an S3 location is used, so the tools can be run offline without boto3 credentials
+s3_client = None
+
+def get_s3_client():
+
+    global s3_client
+
+    if s3_client is None:
+        import boto3
+        s3_client = boto3.client('s3')
+
+    return s3_client
+
+#Return the path or URI of every file under the location whose name ends with one of the suffixes, in sorted order
+def list_files(location, suffixes=('.gz',)):
+
+    if is_s3(location):
+        bucket, prefix = split_s3_uri(location)
+        paginator = get_s3_client().get_paginator('list_objects_v2')
+
+        files = []
+
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                if item['Key'].endswith(suffixes):
+                    files.append('s3://{}/{}'.format(bucket, item['Key']))
+
+        return sorted(files)
+
+    files = []
+
+    for directory, _, file_names in os.walk(location):
+        for file_name in file_names:
+            if file_name.endswith(suffixes):
+                files.append(os.path.join(directory, file_name))
+
+    return sorted(files)
+
+#Return the immediate sub folders of a location, this is used to walk the partition folders without listing every file
+def list_folders(location):
+
+    if is_s3(location):
+        bucket, prefix = split_s3_uri(location.rstrip('/') + '/')
+        paginator = get_s3_client().get_paginator('list_objects_v2')
+
+        folders = []
+
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter='/'):
+            for common_prefix in page.get('CommonPrefixes', []):
+                folders.append('s3://{}/{}'.format(bucket, common_prefix['Prefix']))
+
+        return sorted(folders)
+
+    if not os.path.isdir(location):
+        return []
+
+    return sorted(
+        os.path.join(location, name) + os.sep
+        for name in os.listdir(location)
+        if os.path.isdir(os.path.join(location, name))
+    )
+
+#Open a file for reading as a binary stream. S3 objects are streamed rather than downloaded in full
+def open_input(path):
+
+    if is_s3(path):
+        bucket, key = split_s3_uri(path)
+
+        return get_s3_client().get_object(Bucket=bucket, Key=key)['Body']
+
+    return open(path, 'rb')
+
+#Copy a finished local file to its destination, which may be a local directory or an S3 URI
+def publish(local_path, destination):
+
+    if is_s3(destination):
+        bucket, key = split_s3_uri(destination)
+        get_s3_client().upload_file(local_path, bucket, key)
+        os.remove(local_path)
+    else:
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.move(local_path, destination)
+
+#Delete a file from a local directory or S3
+def delete(path):
+
+    if is_s3(path):
+        bucket, key = split_s3_uri(path)
+        get_s3_client().delete_object(Bucket=bucket, Key=key)
+    else:
+        os.remove(path)
+
+#Join a location with a relative path, using / for S3 URIs
+def join(location, *parts):
+
+    if is_s3(location):
+        return '/'.join([location.rstrip('/')] + [part.strip('/') for part in parts])
+
+    return os.path.join(location, *parts)